@@ -0,0 +1,655 @@
+"""Time every dashboard report against the configured database.
+
+Usage:
+    python benchmark.py run --repeat 5 --output baseline.json
+    python benchmark.py compare baseline.json --tolerance 0.25
+    python benchmark.py equivalence --report unused_providers_analysis
+    python benchmark.py fetch --repeat 3
+    python benchmark.py startup --repeat 3 --reruns 10
+    python benchmark.py load --sessions 1 5 10 20 --steps 20
+
+"run" records rows, latency percentiles and peak Python memory per report.
+"compare" runs the same measurements again and exits with status 1 when a
+report's median latency or peak memory grew by more than the tolerance.
+"equivalence" runs the original SQL of rewritten reports next to the current
+version, exits with status 1 when their results differ and prints both timings.
+"fetch" compares the row and COPY fetch backends per report on rows/s and peak
+RSS, measuring each backend in a fresh process.
+"startup" runs the dashboard script headless in fresh interpreters with the
+startup profiler on and prints the per-phase times of the cold first run and of
+the reruns that follow it.
+"load" starts the dashboard under `streamlit run` and drives concurrent headless
+sessions through its websocket, each switching views and changing the view's
+widgets like an analyst, and prints the rerun latency percentiles, the peak
+database connections, report queries per session and the server's peak RSS for
+each number of sessions.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.request
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import get_context
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+from websockets.sync.client import connect
+
+import procare
+
+
+# Original SQL of reports that have been rewritten, kept to check the rewrites against
+LEGACY_QUERIES = {
+    "unused_providers_analysis": """
+        WITH ActivePolicies AS (
+            SELECT s.ClientID, s.PolicyNumber, p.StartDate, p.EndDate, c.InsurancePlanName, c.HealthcareProviderID
+            FROM Sell s
+            INNER JOIN Policy p ON s.PolicyNumber = p.PolicyNumber
+            INNER JOIN Covers c ON p.InsurancePlanName = c.InsurancePlanName
+            WHERE p.EndDate >= CURRENT_DATE
+        ),
+        ProviderUsage AS (
+            SELECT ap.ClientID, ap.HealthcareProviderID, h.ProviderName, COUNT(DISTINCT pr.ServiceID) AS ServicesUsed
+            FROM ActivePolicies ap
+            LEFT JOIN Provide pr ON ap.ClientID = pr.ClientID
+            AND pr.DoctorID IN (
+                SELECT DoctorID FROM EmployDoctor WHERE HealthcareProviderID = ap.HealthcareProviderID
+            )
+            LEFT JOIN HealthcareProvider h ON ap.HealthcareProviderID = h.HealthcareProviderID
+            GROUP BY ap.ClientID, ap.HealthcareProviderID, h.ProviderName
+        ),
+        UnusedProviders AS (
+            SELECT DISTINCT h.HealthcareProviderID, h.ProviderName, c.InsurancePlanName
+            FROM Covers c
+            LEFT JOIN ProviderUsage pu ON c.HealthcareProviderID = pu.HealthcareProviderID
+            LEFT JOIN HealthcareProvider h ON c.HealthcareProviderID = h.HealthcareProviderID
+            WHERE pu.ServicesUsed IS NULL
+        )
+        SELECT up.ProviderName AS UnusedProvider,
+               up.InsurancePlanName AS CoveredPlan,
+               COUNT(DISTINCT ap.ClientID) AS ClientsCovered,
+               COUNT(DISTINCT ap.ClientID) AS ClientsUtilizing
+        FROM UnusedProviders up
+        LEFT JOIN ActivePolicies ap ON up.HealthcareProviderID = ap.HealthcareProviderID
+        LEFT JOIN Provide pr ON ap.ClientID = pr.ClientID
+        GROUP BY up.ProviderName, up.InsurancePlanName
+        ORDER BY ClientsCovered DESC;
+    """,
+    "company_profits": procare.COMPANY_PROFITS_RAW_QUERY,
+    # The joined form, with conditions counted by distinct client and ties broken by name as in the rewrite
+    "medical_conditions_insights": """
+        WITH ConditionFrequency AS (
+            SELECT mr.ConditionName, COUNT(DISTINCT mr.ClientID) AS ConditionCount
+            FROM MedicalRecords mr
+            GROUP BY mr.ConditionName
+            ORDER BY ConditionCount DESC, mr.ConditionName
+            LIMIT 10
+        ),
+        ServicesForConditions AS (
+            SELECT 
+                cf.ConditionName,
+                cf.ConditionCount,
+                ms.ServiceName,
+                ip.CoverageLevel,
+                COUNT(DISTINCT pr.ClientID) AS ClientsServed
+            FROM ConditionFrequency cf
+            JOIN MedicalRecords mr ON cf.ConditionName = mr.ConditionName
+            JOIN Provide pr ON mr.ClientID = pr.ClientID
+            JOIN MedicalService ms ON pr.ServiceID = ms.ServiceID
+            JOIN Sell sl ON mr.ClientID = sl.ClientID
+            JOIN Policy pl ON sl.PolicyNumber = pl.PolicyNumber
+            JOIN InsurancePlan ip ON pl.InsurancePlanName = ip.InsurancePlanName
+            GROUP BY 
+                cf.ConditionName, 
+                cf.ConditionCount, 
+                ms.ServiceName, 
+                ip.CoverageLevel
+        )
+        SELECT 
+            ConditionName,
+            ConditionCount,
+            ServiceName,
+            CoverageLevel,
+            ClientsServed
+        FROM ServicesForConditions
+        ORDER BY ConditionCount DESC, ConditionName, CoverageLevel, ClientsServed DESC;
+    """
+}
+
+
+# Time one report function with the result cache bypassed
+def measure(engine, func, repeat, warmup):
+    report = getattr(func, "__wrapped__", func)
+    for _ in range(warmup):
+        report(engine)
+    timings, peaks, rows = [], [], 0
+    for _ in range(repeat):
+        tracemalloc.start()
+        started = time.perf_counter()
+        data = report(engine)
+        timings.append((time.perf_counter() - started) * 1000)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        rows = len(data)
+    return {
+        "rows": rows,
+        "runs": repeat,
+        "mean_ms": round(float(np.mean(timings)), 2),
+        "p50_ms": round(float(np.percentile(timings, 50)), 2),
+        "p95_ms": round(float(np.percentile(timings, 95)), 2),
+        "p99_ms": round(float(np.percentile(timings, 99)), 2),
+        "peak_memory_bytes": int(max(peaks))
+    }
+
+
+def run_benchmarks(engine, repeat, warmup, only=None):
+    procare.ensure_materialized_views(engine)
+    results = {}
+    for label, func in procare.QUERY_OPTIONS.items():
+        if only and func.__name__ not in only:
+            continue
+        results[func.__name__] = measure(engine, func, repeat, warmup)
+        result = results[func.__name__]
+        print(
+            f"{func.__name__:<32} rows={result['rows']:>8} p50={result['p50_ms']:>9.2f}ms "
+            f"p95={result['p95_ms']:>9.2f}ms peak={result['peak_memory_bytes'] / 1e6:>8.2f}MB"
+        )
+    return results
+
+
+# Reports whose median latency or peak memory grew by more than the tolerance
+def find_regressions(baseline, current, tolerance):
+    regressions = []
+    for report, before in baseline["reports"].items():
+        after = current["reports"].get(report)
+        if after is None:
+            continue
+        for metric in ("p50_ms", "peak_memory_bytes"):
+            if before[metric] and after[metric] > before[metric] * (1 + tolerance):
+                regressions.append((report, metric, before[metric], after[metric]))
+    return regressions
+
+
+def legacy_report(query):
+    def report(engine):
+        return procare.run_query(engine, query)
+    return report
+
+
+# Same rows and columns, ignoring row order and column dtypes
+def same_result(legacy, current):
+    if list(legacy.columns) != list(current.columns) or len(legacy) != len(current):
+        return False
+    columns = list(legacy.columns)
+    legacy = legacy.sort_values(columns, key=lambda column: column.astype(str)).reset_index(drop=True)
+    current = current.sort_values(columns, key=lambda column: column.astype(str)).reset_index(drop=True)
+    try:
+        pd.testing.assert_frame_equal(legacy, current, check_dtype=False)
+    except AssertionError:
+        return False
+    return True
+
+
+def check_equivalence(engine, repeat, warmup, only=None):
+    procare.ensure_materialized_views(engine)
+    reports = {func.__name__: func for func in procare.QUERY_OPTIONS.values()}
+    mismatches = []
+    for name, query in LEGACY_QUERIES.items():
+        if only and name not in only:
+            continue
+        current = getattr(reports[name], "__wrapped__", reports[name])
+        if not same_result(legacy_report(query)(engine), current(engine)):
+            mismatches.append(name)
+        before = measure(engine, legacy_report(query), repeat, warmup)
+        after = measure(engine, current, repeat, warmup)
+        print(
+            f"{name:<32} {'MISMATCH' if name in mismatches else 'equal':<8} rows={after['rows']:>8} "
+            f"before p50={before['p50_ms']:>9.2f}ms after p50={after['p50_ms']:>9.2f}ms "
+            f"speedup={before['p50_ms'] / max(after['p50_ms'], 0.01):.1f}x"
+        )
+    return mismatches
+
+
+# Runs in a fresh process, so its peak RSS covers this backend and report only
+def fetch_in_process(name, backend, repeat):
+    procare.FETCH_CONFIG["backend"] = backend
+    engine = procare.connect_db()
+    report = {func.__name__: func for func in procare.QUERY_OPTIONS.values()}[name].__wrapped__
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    timings, rows = [], 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = len(report(engine))
+        timings.append(time.perf_counter() - started)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux
+    return {
+        "rows": rows,
+        "p50_ms": round(float(np.percentile(timings, 50)) * 1000, 2),
+        "rows_per_second": round(rows / float(np.percentile(timings, 50))),
+        "peak_rss_bytes": peak * 1024,
+        "rss_growth_bytes": (peak - baseline) * 1024
+    }
+
+
+def compare_fetch_backends(engine, repeat, only=None):
+    procare.ensure_materialized_views(engine)
+    results = {}
+    for func in procare.QUERY_OPTIONS.values():
+        if only and func.__name__ not in only:
+            continue
+        results[func.__name__] = {}
+        for backend in ("rows", "copy"):
+            try:
+                with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+                    result = pool.submit(fetch_in_process, func.__name__, backend, repeat).result()
+            except Exception as error:
+                print(f"{func.__name__:<32} {backend:<5} FAILED {type(error).__name__}: {str(error).splitlines()[0]}")
+                continue
+            results[func.__name__][backend] = result
+            print(
+                f"{func.__name__:<32} {backend:<5} rows={result['rows']:>8} p50={result['p50_ms']:>9.2f}ms "
+                f"rows/s={result['rows_per_second']:>10} peak_rss={result['peak_rss_bytes'] / 1e6:>8.1f}MB "
+                f"growth={result['rss_growth_bytes'] / 1e6:>7.1f}MB"
+            )
+    return results
+
+
+# Runs in a fresh interpreter, so the first script run pays the app's own imports like `streamlit run` does
+STARTUP_SCRIPT = """
+import sys
+from streamlit.testing.v1 import AppTest
+script, reruns = sys.argv[1:]
+# The script treats extra arguments as a maintenance command
+del sys.argv[1:]
+app = AppTest.from_file(script, default_timeout=600)
+for _ in range(int(reruns) + 1):
+    app.run()
+"""
+
+
+def profile_startup(repeat, reruns):
+    with tempfile.TemporaryDirectory() as directory:
+        output = os.path.join(directory, "profile.jsonl")
+        env = dict(os.environ, PROCARE_PROFILE="1", PROCARE_PROFILE_OUTPUT=output)
+        # Background prefetching would compete with the reruns being timed
+        env.setdefault("PROCARE_PREFETCH_CONNECTIONS", "0")
+        for _ in range(repeat):
+            child = subprocess.run(
+                [sys.executable, "-c", STARTUP_SCRIPT, os.path.abspath(procare.__file__), str(reruns)],
+                env=env, capture_output=True, text=True
+            )
+            if child.returncode:
+                sys.stderr.write(child.stderr)
+                raise SystemExit(f"startup run failed with status {child.returncode}")
+        with open(output) as lines:
+            runs = [json.loads(line) for line in lines]
+    results = {}
+    for kind in ("cold", "rerun"):
+        selected = [run for run in runs if run["kind"] == kind]
+        results[kind] = {
+            "runs": len(selected),
+            "total_p50_ms": round(float(np.percentile([run["total_ms"] for run in selected], 50)), 2),
+            "first_paint_p50_ms": round(float(np.percentile([run["first_paint_ms"] for run in selected], 50)), 2),
+            "phases_p50_ms": {
+                phase: round(float(np.percentile([run["phases_ms"].get(phase, 0.0) for run in selected], 50)), 2)
+                for phase in selected[0]["phases_ms"]
+            }
+        }
+        result = results[kind]
+        phases = " ".join(f"{phase}={ms:.1f}" for phase, ms in result["phases_p50_ms"].items())
+        print(
+            f"{kind:<6} runs={result['runs']:>4} total p50={result['total_p50_ms']:>9.2f}ms "
+            f"first paint p50={result['first_paint_p50_ms']:>9.2f}ms  {phases}"
+        )
+    return results
+
+
+# Widgets a load session changes once their view has rendered, as (widget type, label, values);
+# without values it picks one of the widget's options or a point in its range
+LOAD_ACTIONS = {
+    "Client Spending by Healthcare Provider": [
+        ("button", "Next", None),
+        ("button", "Previous", None),
+        ("radio", "View Option", None),
+        ("text_input", "Search clients by name or ID", ["17", "250", "4096", "Nassar", "Hasbini", "Karam"]),
+        ("selectbox", "Select a Client", None)
+    ],
+    "High-Risk Clients": [
+        ("slider", "More distinct ICD codes than", None),
+        ("slider", "More dependents than", None),
+        ("selectbox", "Sort by", None)
+    ],
+    "Insurance Plan Distribution Across Healthcare Providers": [
+        ("selectbox", "Select a Healthcare Provider to view details:", None)
+    ],
+    "Revenue Contribution by Agent": [("selectbox", "Filter by Year", None)],
+    "Medical Conditions Insights": [("radio", "Select Plot Type:", None)]
+}
+LOAD_VIEW_LABEL = "Choose a query to view"
+LOAD_WIDGETS = {"button", "radio", "selectbox", "slider", "text_input"}
+# Share of steps that switch to another view rather than change a widget of the current one
+LOAD_SWITCH_RATE = 0.4
+
+
+# One analyst: a websocket session that reruns the script with the widget states a browser would send.
+# Every widget still on the page keeps its state across reruns; buttons trigger once.
+class LoadSession:
+    def __init__(self, url, seed, timeout):
+        self.url = url
+        self.random = random.Random(seed)
+        self.timeout = timeout
+        self.states = {}
+        self.widgets = {}
+        self.view = None
+        self.latencies = []
+        self.errors = 0
+
+    # Time a rerun until the script finishes, skipping the runs of live refresh fragments in between
+    def rerun(self, websocket, changed=None):
+        if changed is not None:
+            self.states[changed.id] = changed
+        message = BackMsg()
+        message.rerun_script.widget_states.widgets.extend(self.states.values())
+        started = time.perf_counter()
+        websocket.send(message.SerializeToString())
+        widgets = {}
+        while True:
+            reply = ForwardMsg()
+            reply.ParseFromString(websocket.recv(timeout=self.timeout))
+            kind = reply.WhichOneof("type")
+            if kind == "delta" and reply.delta.WhichOneof("type") == "new_element":
+                element_type = reply.delta.new_element.WhichOneof("type")
+                if element_type == "exception":
+                    self.errors += 1
+                elif element_type in LOAD_WIDGETS:
+                    widget = getattr(reply.delta.new_element, element_type)
+                    widgets[(element_type, widget.label)] = widget
+            elif kind == "script_finished" and reply.script_finished in (
+                ForwardMsg.FINISHED_SUCCESSFULLY, ForwardMsg.FINISHED_WITH_COMPILE_ERROR
+            ):
+                if reply.script_finished == ForwardMsg.FINISHED_WITH_COMPILE_ERROR:
+                    self.errors += 1
+                break
+        self.latencies.append(time.perf_counter() - started)
+        shown = {widget.id for widget in widgets.values()}
+        self.states = {
+            widget_id: state for widget_id, state in self.states.items()
+            if widget_id in shown and state.WhichOneof("value") != "trigger_value"
+        }
+        self.widgets = widgets
+        if self.view is None and (("selectbox", LOAD_VIEW_LABEL)) in widgets:
+            self.view = widgets[("selectbox", LOAD_VIEW_LABEL)].options[0]
+
+    # Switch views on some steps, otherwise change one of the current view's widgets
+    def next_action(self):
+        actions = [
+            (kind, label, values) for kind, label, values in LOAD_ACTIONS.get(self.view, [])
+            if (kind, label) in self.widgets and not self.widgets[(kind, label)].disabled
+        ]
+        if not actions or self.random.random() < LOAD_SWITCH_RATE:
+            selectbox = self.widgets[("selectbox", LOAD_VIEW_LABEL)]
+            self.view = self.random.choice([option for option in selectbox.options if option != self.view])
+            return load_widget_state("selectbox", selectbox, self.view)
+        kind, label, values = self.random.choice(actions)
+        widget = self.widgets[(kind, label)]
+        if values is not None:
+            value = self.random.choice(values)
+        elif kind in ("selectbox", "radio"):
+            value = self.random.choice(list(widget.options))
+        elif kind == "slider":
+            value = widget.min + self.random.randint(0, int((widget.max - widget.min) // widget.step)) * widget.step
+        else:
+            value = True
+        return load_widget_state(kind, widget, value)
+
+    def run(self, steps, think):
+        with connect(self.url, subprotocols=["streamlit"], max_size=None) as websocket:
+            self.rerun(websocket)
+            for _ in range(steps):
+                if think:
+                    time.sleep(self.random.expovariate(1 / think))
+                self.rerun(websocket, self.next_action())
+
+
+# The state the browser sends for a widget set to value; option widgets send the option's label
+def load_widget_state(kind, widget, value):
+    state = WidgetState(id=widget.id)
+    if kind == "button":
+        state.trigger_value = True
+    elif kind == "slider":
+        state.double_array_value.data[:] = [value]
+    else:
+        state.string_value = value
+    return state
+
+
+# Resident set size of a process, read from /proc like ru_maxrss is read from getrusage
+def process_rss(pid):
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+# Record the peak connections to the dashboard's database and the server's peak RSS until stopped
+def sample_resources(engine, pid, stop, peaks):
+    with engine.connect() as conn:
+        while not stop.is_set():
+            total, active = conn.execute(text("""
+                SELECT count(*), count(*) FILTER (WHERE state <> 'idle')
+                FROM pg_stat_activity
+                WHERE datname = current_database() AND pid <> pg_backend_pid()
+            """)).one()
+            conn.rollback()
+            peaks["connections"] = max(peaks["connections"], total)
+            peaks["active_connections"] = max(peaks["active_connections"], active)
+            peaks["rss_bytes"] = max(peaks["rss_bytes"], process_rss(pid))
+            stop.wait(0.25)
+
+
+# Totals of the dashboard's Prometheus metrics, summed over their labels
+def scrape_metrics(port):
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=10) as response:
+        lines = response.read().decode().splitlines()
+    totals = Counter()
+    for line in lines:
+        if line and not line.startswith("#"):
+            sample, value = line.rsplit(" ", 1)
+            totals[sample.split("{")[0]] += float(value)
+    return totals
+
+
+# Run the dashboard headless in its own process, with the metrics endpoint on the next port
+@contextmanager
+def dashboard_server(port):
+    env = dict(os.environ, PROCARE_METRICS_PORT=str(port + 1))
+    with tempfile.TemporaryFile() as log:
+        server = subprocess.Popen(
+            [
+                sys.executable, "-m", "streamlit", "run", os.path.abspath(procare.__file__),
+                "--server.headless", "true", "--server.port", str(port),
+                "--server.fileWatcherType", "none", "--browser.gatherUsageStats", "false"
+            ],
+            env=env, stdout=log, stderr=subprocess.STDOUT
+        )
+        try:
+            deadline = time.monotonic() + 60
+            while True:
+                try:
+                    with urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=2):
+                        break
+                except OSError:
+                    if server.poll() is not None or time.monotonic() > deadline:
+                        log.seek(0)
+                        sys.stderr.write(log.read().decode(errors="replace"))
+                        raise SystemExit("the dashboard server did not start")
+                    time.sleep(0.5)
+            yield server
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+
+def run_load_level(url, engine, server, sessions, steps, think, timeout):
+    runs = [LoadSession(url, sessions * 1000 + index, timeout) for index in range(sessions)]
+    failures = []
+
+    def run(session):
+        try:
+            session.run(steps, think)
+        except Exception as error:
+            failures.append(f"{type(error).__name__}: {error}")
+
+    peaks = {"connections": 0, "active_connections": 0, "rss_bytes": 0}
+    stop = threading.Event()
+    sampler = threading.Thread(target=sample_resources, args=(engine, server.pid, stop, peaks))
+    sampler.start()
+    started = time.perf_counter()
+    threads = [threading.Thread(target=run, args=(session,)) for session in runs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    sampler.join()
+    latencies = [latency for session in runs for latency in session.latencies]
+    return {
+        "reruns": len(latencies),
+        "reruns_per_second": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 2) if latencies else None,
+        "p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 2) if latencies else None,
+        "p99_ms": round(float(np.percentile(latencies, 99)) * 1000, 2) if latencies else None,
+        "max_ms": round(max(latencies) * 1000, 2) if latencies else None,
+        "app_errors": sum(session.errors for session in runs),
+        "failed_sessions": failures,
+        **peaks
+    }
+
+
+# Drive each number of concurrent sessions in turn against one server, so later levels find the
+# result cache as earlier ones left it, the way a long-running dashboard does
+def load_test(levels, steps, think, port, timeout):
+    engine = procare.connect_db()
+    url = f"ws://127.0.0.1:{port}/_stcore/stream"
+    results = []
+    with dashboard_server(port) as server:
+        # The first run imports the app and starts its engine and background threads; it is not timed
+        LoadSession(url, 0, timeout).run(0, 0)
+        for sessions in levels:
+            before = scrape_metrics(port + 1)
+            result = {"sessions": sessions, **run_load_level(url, engine, server, sessions, steps, think, timeout)}
+            after = scrape_metrics(port + 1)
+            lookups = (after["procare_cache_hits_total"] - before["procare_cache_hits_total"]) + (
+                after["procare_cache_misses_total"] - before["procare_cache_misses_total"]
+            )
+            result["queries_per_session"] = round(
+                (after["procare_report_runs_total"] - before["procare_report_runs_total"]) / sessions, 2
+            )
+            result["report_errors"] = int(after["procare_report_errors_total"] - before["procare_report_errors_total"])
+            result["table_kb_per_rerun"] = round(
+                (after["procare_report_sent_bytes_total"] - before["procare_report_sent_bytes_total"]) / 1024
+                / max(result["reruns"], 1), 1
+            )
+            result["cache_hit_rate"] = round(
+                (after["procare_cache_hits_total"] - before["procare_cache_hits_total"]) / lookups, 3
+            ) if lookups else None
+            results.append(result)
+            print(
+                f"sessions={sessions:>4} reruns={result['reruns']:>5} p50={result['p50_ms']:>9.2f}ms "
+                f"p95={result['p95_ms']:>9.2f}ms p99={result['p99_ms']:>9.2f}ms "
+                f"connections={result['connections']:>3} (active {result['active_connections']:>3}) "
+                f"queries/session={result['queries_per_session']:>6.1f} table KB/rerun={result['table_kb_per_rerun']:>6.1f} "
+                f"rss={result['rss_bytes'] / 1e6:>7.1f}MB "
+                f"errors={result['app_errors'] + result['report_errors']} failed={len(result['failed_sessions'])}"
+            )
+            for failure in result["failed_sessions"][:3]:
+                print(f"    {failure}")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the ProCare report queries")
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name in ("run", "compare", "equivalence", "fetch", "startup"):
+        command = commands.add_parser(name)
+        command.add_argument("--repeat", type=int, default=5)
+        command.add_argument("--warmup", type=int, default=1)
+        command.add_argument("--report", action="append", help="only benchmark this report function")
+        command.add_argument("--output", help="write the results as JSON to this path")
+    commands.choices["compare"].add_argument("baseline")
+    commands.choices["compare"].add_argument("--tolerance", type=float, default=0.25)
+    commands.choices["startup"].add_argument("--reruns", type=int, default=10, help="reruns timed after each cold run")
+    load = commands.add_parser("load")
+    load.add_argument("--sessions", type=int, nargs="+", default=[1, 5, 10, 20], help="concurrent sessions, one level each")
+    load.add_argument("--steps", type=int, default=20, help="view switches and widget changes per session")
+    load.add_argument("--think", type=float, default=1.0, help="mean seconds between a session's steps")
+    load.add_argument("--port", type=int, default=8599, help="dashboard port; metrics use the next one")
+    load.add_argument("--timeout", type=float, default=600, help="seconds a rerun may take before its session fails")
+    load.add_argument("--output", help="write the results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    if args.command == "load":
+        results = load_test(args.sessions, args.steps, args.think, args.port, args.timeout)
+        if args.output:
+            with open(args.output, "w") as output:
+                json.dump(results, output, indent=2)
+        return 1 if any(result["failed_sessions"] for result in results) else 0
+
+    if args.command == "startup":
+        results = profile_startup(args.repeat, args.reruns)
+        if args.output:
+            with open(args.output, "w") as output:
+                json.dump(results, output, indent=2)
+        return 0
+
+    engine = procare.connect_db()
+    if args.command == "equivalence":
+        return 1 if check_equivalence(engine, args.repeat, args.warmup, args.report) else 0
+    if args.command == "fetch":
+        results = compare_fetch_backends(engine, args.repeat, args.report)
+        if args.output:
+            with open(args.output, "w") as output:
+                json.dump(results, output, indent=2)
+        return 0
+
+    results = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "database": f"{procare.DB_CONFIG['host']}:{procare.DB_CONFIG['port']}/{procare.DB_CONFIG['dbname']}",
+        "python": platform.python_version(),
+        "reports": run_benchmarks(engine, args.repeat, args.warmup, args.report)
+    }
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+
+    if args.command == "compare":
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = find_regressions(baseline, results, args.tolerance)
+        for report, metric, before, after in regressions:
+            print(f"REGRESSION {report}: {metric} {before} -> {after}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
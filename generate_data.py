@@ -0,0 +1,287 @@
+"""Fill a local Postgres with synthetic ProCare data for benchmarking.
+
+Usage:
+    python generate_data.py --scale 10k
+    python generate_data.py --scale 1m --seed 7
+
+Connection settings come from the same PROCARE_DB_* variables as the dashboard.
+Existing ProCare tables in the target database are dropped and recreated.
+Payments live in the Pays table, which is what company_profits reads.
+Client activity, claims and medical records are skewed towards low ids, so a
+small share of clients accounts for most rows, as in production.
+"""
+import argparse
+import time
+
+from sqlalchemy import create_engine, text
+
+import procare
+
+
+# Row counts per scale, keyed on the number of claims
+SCALES = {
+    "10k": {
+        "claims": 10_000, "clients": 2_000, "dependents": 1_500, "providers": 40,
+        "doctors": 300, "services": 60, "plans": 12, "agents": 30, "employees": 40,
+        "policies": 2_500, "provide": 30_000, "records": 12_000, "payments": 10_000
+    },
+    "1m": {
+        "claims": 1_000_000, "clients": 100_000, "dependents": 80_000, "providers": 400,
+        "doctors": 4_000, "services": 200, "plans": 30, "agents": 300, "employees": 400,
+        "policies": 130_000, "provide": 3_000_000, "records": 1_200_000, "payments": 1_000_000
+    },
+    "10m": {
+        "claims": 10_000_000, "clients": 1_000_000, "dependents": 800_000, "providers": 2_000,
+        "doctors": 20_000, "services": 400, "plans": 60, "agents": 1_500, "employees": 2_000,
+        "policies": 1_300_000, "provide": 30_000_000, "records": 12_000_000, "payments": 10_000_000
+    }
+}
+
+TABLES = [
+    "Pays", "RequestClaim", "MedicalRecords", "Provide", "Sell", "Policy", "Covers",
+    "EmployDoctor", "ClientDependent", "Client", "Agent", "Employee", "MedicalService",
+    "InsurancePlan", "HealthcareProvider"
+]
+
+SCHEMA = """
+CREATE TABLE HealthcareProvider (
+    HealthcareProviderID INT PRIMARY KEY,
+    ProviderName VARCHAR(100) NOT NULL
+);
+CREATE TABLE InsurancePlan (
+    InsurancePlanName VARCHAR(60) PRIMARY KEY,
+    CoverageLevel VARCHAR(20) NOT NULL
+);
+CREATE TABLE MedicalService (
+    ServiceID INT PRIMARY KEY,
+    ServiceName VARCHAR(100) NOT NULL
+);
+CREATE TABLE Employee (
+    EmployeeID INT PRIMARY KEY,
+    FirstName VARCHAR(50) NOT NULL,
+    MiddleName VARCHAR(50),
+    LastName VARCHAR(50) NOT NULL,
+    Salary NUMERIC(10, 2) NOT NULL
+);
+CREATE TABLE Agent (
+    AgentID INT PRIMARY KEY,
+    AgentName VARCHAR(100) NOT NULL,
+    CommissionRate NUMERIC(5, 2) NOT NULL
+);
+CREATE TABLE Client (
+    ClientID INT PRIMARY KEY,
+    FirstName VARCHAR(50) NOT NULL,
+    MiddleName VARCHAR(50),
+    LastName VARCHAR(50) NOT NULL,
+    DateOfBirth DATE
+);
+CREATE TABLE ClientDependent (
+    ClientID INT NOT NULL REFERENCES Client (ClientID),
+    DependentName VARCHAR(100) NOT NULL,
+    Relationship VARCHAR(20),
+    PRIMARY KEY (ClientID, DependentName)
+);
+CREATE TABLE EmployDoctor (
+    DoctorID INT NOT NULL,
+    HealthcareProviderID INT NOT NULL REFERENCES HealthcareProvider (HealthcareProviderID),
+    PRIMARY KEY (DoctorID, HealthcareProviderID)
+);
+CREATE TABLE Covers (
+    InsurancePlanName VARCHAR(60) NOT NULL REFERENCES InsurancePlan (InsurancePlanName),
+    HealthcareProviderID INT NOT NULL REFERENCES HealthcareProvider (HealthcareProviderID),
+    PRIMARY KEY (InsurancePlanName, HealthcareProviderID)
+);
+CREATE TABLE Policy (
+    PolicyNumber INT PRIMARY KEY,
+    InsurancePlanName VARCHAR(60) NOT NULL REFERENCES InsurancePlan (InsurancePlanName),
+    StartDate DATE NOT NULL,
+    EndDate DATE NOT NULL,
+    ExactCost NUMERIC(12, 2) NOT NULL
+);
+CREATE TABLE Sell (
+    ClientID INT NOT NULL REFERENCES Client (ClientID),
+    PolicyNumber INT NOT NULL REFERENCES Policy (PolicyNumber),
+    AgentID INT NOT NULL REFERENCES Agent (AgentID),
+    PRIMARY KEY (ClientID, PolicyNumber)
+);
+CREATE TABLE Provide (
+    ProvideID BIGINT PRIMARY KEY,
+    ClientID INT NOT NULL REFERENCES Client (ClientID),
+    DoctorID INT NOT NULL,
+    ServiceID INT NOT NULL REFERENCES MedicalService (ServiceID),
+    ServiceDate DATE NOT NULL,
+    ServiceCost NUMERIC(10, 2) NOT NULL
+);
+CREATE TABLE MedicalRecords (
+    RecordID BIGINT PRIMARY KEY,
+    ClientID INT NOT NULL REFERENCES Client (ClientID),
+    ICDCode VARCHAR(10) NOT NULL,
+    ConditionName VARCHAR(100) NOT NULL,
+    DateDiagnosed DATE
+);
+CREATE TABLE RequestClaim (
+    ClaimID BIGINT PRIMARY KEY,
+    ClientID INT NOT NULL REFERENCES Client (ClientID),
+    EmployeeID INT REFERENCES Employee (EmployeeID),
+    Amount NUMERIC(12, 2) NOT NULL,
+    ApprovalStatus VARCHAR(20) NOT NULL,
+    DateCreated TIMESTAMP NOT NULL
+);
+CREATE TABLE Pays (
+    PaymentID BIGINT PRIMARY KEY,
+    ClientID INT NOT NULL REFERENCES Client (ClientID),
+    Amount NUMERIC(12, 2) NOT NULL,
+    Date DATE NOT NULL
+);
+CREATE VIEW top5monthlyservicesummary AS
+    WITH Monthly AS (
+        SELECT TO_CHAR(P.ServiceDate, 'YYYY-MM') AS ServicePeriod,
+               ED.HealthcareProviderID,
+               MS.ServiceName,
+               SUM(P.ServiceCost) AS TotalGenerated
+        FROM Provide P
+        JOIN EmployDoctor ED ON P.DoctorID = ED.DoctorID
+        JOIN MedicalService MS ON P.ServiceID = MS.ServiceID
+        GROUP BY 1, 2, 3
+    ),
+    Ranked AS (
+        SELECT *, ROW_NUMBER() OVER (PARTITION BY ServicePeriod ORDER BY TotalGenerated DESC) AS Rank
+        FROM Monthly
+    )
+    SELECT ServicePeriod, HealthcareProviderID, ServiceName, TotalGenerated
+    FROM Ranked
+    WHERE Rank <= 5;
+"""
+
+# Skewed picks: skew(n, k) returns 1..n, concentrating more of the picks on low ids as k grows
+FUNCTIONS = """
+CREATE OR REPLACE FUNCTION pg_temp.skew(n BIGINT, k FLOAT8) RETURNS BIGINT AS $$
+    SELECT LEAST(n, 1 + FLOOR(n * POWER(random(), k)))::BIGINT
+$$ LANGUAGE SQL VOLATILE;
+CREATE OR REPLACE FUNCTION pg_temp.pick(options TEXT[]) RETURNS TEXT AS $$
+    SELECT options[1 + FLOOR(random() * array_length(options, 1))::INT]
+$$ LANGUAGE SQL VOLATILE;
+"""
+
+FIRST_NAMES = "ARRAY['Kamel','Lama','Omar','Rami','Nour','Maya','Karim','Lea','Hadi','Sara','Ziad','Rita','Jad','Yara','Fadi','Dana']"
+LAST_NAMES = "ARRAY['Soubra','Hasbini','Succar','Khoury','Haddad','Nassar','Saab','Aoun','Salem','Fares','Karam','Tannous']"
+
+# Each statement receives the scale counts as bind parameters
+DATA = [
+    ("HealthcareProvider", f"""
+        INSERT INTO HealthcareProvider
+        SELECT g, 'Provider ' || g || ' ' || pg_temp.pick({LAST_NAMES})
+        FROM generate_series(1, :providers) g
+    """),
+    ("InsurancePlan", """
+        INSERT INTO InsurancePlan
+        SELECT 'Plan ' || g, (ARRAY['Basic','Silver','Gold','Platinum'])[1 + g % 4]
+        FROM generate_series(1, :plans) g
+    """),
+    ("MedicalService", """
+        INSERT INTO MedicalService
+        SELECT g, 'Service ' || g FROM generate_series(1, :services) g
+    """),
+    ("Employee", f"""
+        INSERT INTO Employee
+        SELECT g, pg_temp.pick({FIRST_NAMES}), CASE WHEN random() < 0.3 THEN pg_temp.pick({FIRST_NAMES}) END,
+               pg_temp.pick({LAST_NAMES}), ROUND((1500 + random() * 4000)::NUMERIC, 2)
+        FROM generate_series(1, :employees) g
+    """),
+    ("Agent", f"""
+        INSERT INTO Agent
+        SELECT g, pg_temp.pick({FIRST_NAMES}) || ' ' || pg_temp.pick({LAST_NAMES}) || ' ' || g,
+               ROUND((2 + random() * 13)::NUMERIC, 2)
+        FROM generate_series(1, :agents) g
+    """),
+    ("Client", f"""
+        INSERT INTO Client
+        SELECT g, pg_temp.pick({FIRST_NAMES}), CASE WHEN random() < 0.4 THEN pg_temp.pick({FIRST_NAMES}) END,
+               pg_temp.pick({LAST_NAMES}) || '-' || g, DATE '1940-01-01' + (random() * 25000)::INT
+        FROM generate_series(1, :clients) g
+    """),
+    ("ClientDependent", f"""
+        INSERT INTO ClientDependent
+        SELECT DISTINCT ON (c, n) c, n, pg_temp.pick(ARRAY['Spouse','Child','Parent'])
+        FROM (
+            SELECT pg_temp.skew(:clients, 2) AS c, pg_temp.pick({FIRST_NAMES}) || ' ' || (g % 4) AS n
+            FROM generate_series(1, :dependents) g
+        ) d
+    """),
+    ("EmployDoctor", """
+        INSERT INTO EmployDoctor
+        SELECT g, pg_temp.skew(:providers, 1.5) FROM generate_series(1, :doctors) g
+    """),
+    # The last two plans are retired (no policies are written against them) and
+    # the last 2% of providers are only covered by those, so they go unused
+    ("Covers", """
+        INSERT INTO Covers
+        SELECT DISTINCT 'Plan ' || p, h
+        FROM generate_series(1, :plans) p, generate_series(1, :providers) h
+        WHERE CASE WHEN h > :providers * 0.98 THEN p > :plans - 2 ELSE random() < 0.35 END
+    """),
+    ("Policy", """
+        INSERT INTO Policy
+        SELECT g, 'Plan ' || pg_temp.skew(:plans - 2, 1.5), s, s + 365, ROUND((300 + random() * 4700)::NUMERIC, 2)
+        FROM (SELECT g, CURRENT_DATE - (random() * 1460)::INT AS s FROM generate_series(1, :policies) g) p
+    """),
+    ("Sell", """
+        INSERT INTO Sell
+        SELECT 1 + (g - 1) % :clients, g, pg_temp.skew(:agents, 2) FROM generate_series(1, :policies) g
+    """),
+    ("Provide", """
+        INSERT INTO Provide
+        SELECT g, pg_temp.skew(:clients, 3), pg_temp.skew(:doctors, 2), pg_temp.skew(:services, 2),
+               CURRENT_DATE - (random() * 1095)::INT, ROUND((20 + POWER(random(), 3) * 5000)::NUMERIC, 2)
+        FROM generate_series(1, :provide) g
+    """),
+    ("MedicalRecords", """
+        INSERT INTO MedicalRecords
+        SELECT g, c, 'ICD' || LPAD(k::TEXT, 4, '0'), 'Condition ' || k, CURRENT_DATE - (random() * 3650)::INT
+        FROM (SELECT g, pg_temp.skew(:clients, 3) AS c, pg_temp.skew(200, 2) AS k FROM generate_series(1, :records) g) r
+    """),
+    ("RequestClaim", """
+        INSERT INTO RequestClaim
+        SELECT g, pg_temp.skew(:clients, 4), pg_temp.skew(:employees, 1.5),
+               ROUND((50 + POWER(random(), 4) * 40000)::NUMERIC, 2),
+               pg_temp.pick(ARRAY['Approved','Approved','Approved','Pending','Rejected']),
+               NOW() - random() * INTERVAL '730 days'
+        FROM generate_series(1, :claims) g
+    """),
+    ("Pays", """
+        INSERT INTO Pays
+        SELECT g, pg_temp.skew(:clients, 2), ROUND((20 + random() * 800)::NUMERIC, 2),
+               CURRENT_DATE - (random() * 730)::INT
+        FROM generate_series(1, :payments) g
+    """)
+]
+
+
+def generate(engine, scale, seed):
+    counts = SCALES[scale]
+    with engine.begin() as conn:
+        for table in TABLES:
+            conn.execute(text(f"DROP TABLE IF EXISTS {table} CASCADE"))
+        conn.execute(text("DROP VIEW IF EXISTS top5monthlyservicesummary CASCADE"))
+        conn.exec_driver_sql(SCHEMA)
+        conn.exec_driver_sql(FUNCTIONS)
+        conn.execute(text("SELECT setseed(:seed)"), {"seed": seed})
+        for table, statement in DATA:
+            started = time.perf_counter()
+            conn.execute(text(statement), counts)
+            print(f"{table:<20} {time.perf_counter() - started:8.2f}s")
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("ANALYZE"))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic ProCare data")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="10k")
+    parser.add_argument("--seed", type=float, default=0.42, help="setseed() value between -1 and 1")
+    args = parser.parse_args(argv)
+    engine = create_engine(procare.database_url())
+    generate(engine, args.scale, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,64 @@
+import time
+
+# Startup profiler clock, read before the imports so the first run in a process can report their cost
+SCRIPT_STARTED = time.perf_counter()
+
 import streamlit as st
 import pandas as pd
-from sqlalchemy import create_engine
-import plotly.express as px
+import numpy as np
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import URL
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.util.queue import Queue as PoolQueue
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import os
+import sys
+import argparse
+import atexit
 import base64
+import contextvars
+import functools
+import heapq
+import importlib
+import importlib.util
+import io
+import json
+import logging
+import threading
+import uuid
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout, as_completed
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal, ROUND_HALF_UP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# The COPY fetch backend needs psycopg 3 and pyarrow; without them every query uses the row fetch
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pa_parquet
+except ImportError:
+    pa = pa_csv = pa_parquet = None
+
+# Import a module on first attribute access. Reruns find it in sys.modules after that.
+class LazyModule:
+    def __init__(self, name):
+        self.name = name
+
+    def __getattr__(self, attribute):
+        return getattr(importlib.import_module(self.name), attribute)
+
+# The engine imports psycopg when main() builds it after painting the header, and only the chart views
+# need plotly.express, so neither is imported up front
+psycopg = LazyModule("psycopg") if pa is not None and importlib.util.find_spec("psycopg") else None
+px = LazyModule("plotly.express")
 
+IMPORTS_FINISHED = time.perf_counter()
+
+
+logger = logging.getLogger("procare")
 
 # Set the path for the logo
 logo_path = "logo.png"  # Assuming the logo file is in the same directory as your script
@@ -31,7 +85,8 @@ def display_logo():
     else:
         st.warning("Logo not found. Please check the file path.")
 
-# Function to get the base64 encoding of the logo
+# Function to get the base64 encoding of the logo, read and encoded once per process
+@st.cache_resource(show_spinner=False)
 def get_image_base64(image_path):
     with open(image_path, "rb") as image_file:
         return base64.b64encode(image_file.read()).decode()
@@ -64,73 +119,2442 @@ def display_team_names():
         """,
         unsafe_allow_html=True,
     )
+# Read a PROCARE_* setting from the environment, falling back to a default
+def env_setting(name, default, cast=str):
+    value = os.environ.get(f"PROCARE_{name}")
+    if value is None or value == "":
+        return default
+    return cast(value)
+
+# Interpret "1"/"true"/"yes"/"on" style environment values as booleans
+def as_bool(value):
+    return str(value).strip().lower() in ("1", "true", "yes", "on")
+
 # Database connection configuration
 DB_CONFIG = {
-    "dbname": "project2",
-    "user": "postgres",
-    "password": "kamel",
-    "host": "localhost",
-    "port": "5432"
+    "driver": env_setting("DB_DRIVER", "postgresql"),
+    "dbname": env_setting("DB_NAME", "project2"),
+    "user": env_setting("DB_USER", "postgres"),
+    "password": env_setting("DB_PASSWORD", "kamel"),
+    "host": env_setting("DB_HOST", "localhost"),
+    "port": env_setting("DB_PORT", "5432")
 }
 
-# Connect to the database
-def connect_db():
+# Connection pool configuration, shared by every session in the process
+POOL_CONFIG = {
+    "pool_size": env_setting("POOL_SIZE", 5, int),
+    "max_overflow": env_setting("POOL_MAX_OVERFLOW", 10, int),
+    "pool_timeout": env_setting("POOL_TIMEOUT", 30, float),
+    "pool_recycle": env_setting("POOL_RECYCLE", 1800, int),
+    "pool_pre_ping": env_setting("POOL_PRE_PING", True, as_bool),
+    "statement_timeout_ms": env_setting("STATEMENT_TIMEOUT_MS", 60000, int),
+    "prepare_threshold": env_setting("PREPARE_THRESHOLD", 1, int)
+}
+
+# Counters describing how the shared pool is being used
+class PoolStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def increment(self, counter):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    # A checkout that found no idle connection and no overflow left, and blocked until a checkin
+    def record_wait(self, seconds):
+        with self.lock:
+            self.waits += 1
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+    def snapshot(self, engine):
+        pool = engine.pool
+        with self.lock:
+            return {
+                "pool_size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "overflow": max(pool.overflow(), 0),
+                "connects": self.connects,
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "invalidations": self.invalidations,
+                "waits": self.waits,
+                "wait_seconds": round(self.wait_seconds, 4),
+                "max_wait_seconds": round(self.max_wait_seconds, 4)
+            }
+
+# One set of counters per pool and process; the script module itself is re-executed on every rerun
+@st.cache_resource
+def get_pool_stats(name="primary"):
+    return PoolStats()
+
+# Build the connection URL from DB_CONFIG
+def database_url(config=DB_CONFIG):
+    return URL.create(
+        config["driver"],
+        username=config["user"],
+        password=config["password"],
+        host=config["host"],
+        port=int(config["port"]),
+        database=config["dbname"]
+    )
+
+# Seconds the current thread's latest checkout spent blocked on the pool queue, or None
+checkout_wait = threading.local()
+
+# Pool queue that notes when a checkout had to block. The pool only asks to block once its overflow
+# is used up, and the queue's lock is re-entrant, so finding it empty under the lock means the
+# checkout really waited for another session's checkin.
+class WaitTrackingQueue(PoolQueue):
+    def get(self, block=True, timeout=None):
+        with self.not_empty:
+            if not block or not self._empty():
+                return super().get(block, timeout)
+            started = time.perf_counter()
+            try:
+                return super().get(block, timeout)
+            finally:
+                checkout_wait.seconds = time.perf_counter() - started
+
+class WaitTrackingQueuePool(QueuePool):
+    _queue_class = WaitTrackingQueue
+
+# Build a pooled engine for one server. The pool's logging name keeps the counters of the primary
+# and each replica apart.
+def create_pooled_engine(config, name, connect_args=None):
     engine = create_engine(
-        f"postgresql://{DB_CONFIG['user']}:{DB_CONFIG['password']}@{DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['dbname']}"
+        database_url(config),
+        pool_size=POOL_CONFIG["pool_size"],
+        max_overflow=POOL_CONFIG["max_overflow"],
+        pool_timeout=POOL_CONFIG["pool_timeout"],
+        pool_recycle=POOL_CONFIG["pool_recycle"],
+        pool_pre_ping=POOL_CONFIG["pool_pre_ping"],
+        pool_logging_name=name,
+        poolclass=WaitTrackingQueuePool,
+        connect_args={"options": f"-c statement_timeout={POOL_CONFIG['statement_timeout_ms']}", **(connect_args or {})}
     )
+    # psycopg 3 prepares a statement server-side once it has run this many times on a connection
+    if engine.dialect.driver == "psycopg":
+        event.listen(
+            engine, "connect",
+            lambda dbapi_connection, record: setattr(dbapi_connection, "prepare_threshold", POOL_CONFIG["prepare_threshold"])
+        )
+    stats = get_pool_stats(name)
+    event.listen(engine.pool, "connect", lambda *args: stats.increment("connects"))
+    event.listen(engine.pool, "checkout", lambda *args: stats.increment("checkouts"))
+    event.listen(engine.pool, "checkin", lambda *args: stats.increment("checkins"))
+    event.listen(engine.pool, "invalidate", lambda *args: stats.increment("invalidations"))
     return engine
 
+# Connect to the database once per process; Streamlit reruns reuse the same pooled engine
+@st.cache_resource
+def connect_db():
+    return create_pooled_engine(DB_CONFIG, "primary")
+
+# Check a connection out of the pool, counting the checkout as a wait only when it blocked
+@contextmanager
+def db_connection(engine):
+    checkout_wait.seconds = None
+    try:
+        conn = engine.connect()
+    finally:
+        if checkout_wait.seconds is not None:
+            get_pool_stats(engine.pool.logging_name).record_wait(checkout_wait.seconds)
+    try:
+        yield conn
+        # psycopg forgets its prepared statements on ROLLBACK, so end successful work with COMMIT
+        conn.commit()
+    finally:
+        conn.close()
+
+# Read replicas for the report queries. REPLICA_HOSTS lists host:port pairs that share the primary's
+# database, user and password; reports go to a healthy replica whose replay lag is within
+# max_lag_seconds, picked round-robin or by the lowest health-check latency, and to the primary
+# when no replica qualifies.
+REPLICA_CONFIG = {
+    "hosts": [host.strip() for host in env_setting("REPLICA_HOSTS", "").split(",") if host.strip()],
+    "strategy": env_setting("REPLICA_STRATEGY", "round_robin"),
+    "max_lag_seconds": env_setting("REPLICA_MAX_LAG_SECONDS", 30, float),
+    "check_interval": env_setting("REPLICA_CHECK_INTERVAL", 10, float),
+    "connect_timeout": env_setting("REPLICA_CONNECT_TIMEOUT", 5, int)
+}
+
+# Replay lag in seconds. A standby that has replayed everything it received is not behind, however
+# old its last replayed transaction is; a server that is not in recovery reports no lag.
+REPLICA_LAG_QUERY = text("""
+    SELECT pg_is_in_recovery(),
+           CASE
+               WHEN NOT pg_is_in_recovery() THEN 0
+               WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+               ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+           END
+""")
+
+class Replica:
+    def __init__(self, name, engine):
+        self.name = name
+        self.engine = engine
+        # Unknown until the first health check
+        self.healthy = None
+        self.in_recovery = None
+        self.lag_seconds = None
+        self.latency_seconds = None
+        self.checked_at = None
+        self.error = None
+        self.routed = 0
+        self.fallbacks = 0
+
+# Health state of every replica and the choice of where the next report runs
+class ReplicaRouter:
+    def __init__(self, replicas, strategy, max_lag_seconds):
+        self.lock = threading.Lock()
+        self.replicas = replicas
+        self.strategy = strategy
+        self.max_lag_seconds = max_lag_seconds
+        self.turn = 0
+        self.primary_routed = 0
+
+    # Time a lag query on the replica; latency is smoothed over checks, and a failed check marks it down
+    def check(self, replica):
+        started = time.perf_counter()
+        try:
+            with db_connection(replica.engine) as conn:
+                in_recovery, lag = conn.execute(REPLICA_LAG_QUERY).one()
+            error = None
+        except Exception as raised:
+            in_recovery, lag, error = None, None, f"{type(raised).__name__}: {str(raised).splitlines()[0]}"
+        latency = time.perf_counter() - started
+        with self.lock:
+            replica.checked_at = datetime.now(timezone.utc)
+            replica.healthy = error is None
+            replica.error = error
+            if error is None:
+                replica.in_recovery = in_recovery
+                # Still catching up with no transaction replayed yet
+                replica.lag_seconds = float(lag) if lag is not None else float("inf")
+                replica.latency_seconds = latency if replica.latency_seconds is None else 0.7 * replica.latency_seconds + 0.3 * latency
+        if error is not None:
+            logger.warning("Replica %s failed its health check: %s", replica.name, error)
+
+    def check_all(self):
+        for replica in self.replicas:
+            self.check(replica)
+
+    def usable(self):
+        return [
+            replica for replica in self.replicas
+            if replica.healthy and replica.lag_seconds <= self.max_lag_seconds
+        ]
+
+    # The replica the next report should run on, or None for the primary
+    def choose(self):
+        with self.lock:
+            usable = self.usable()
+            if not usable:
+                self.primary_routed += 1
+                return None
+            if self.strategy == "least_latency":
+                replica = min(usable, key=lambda candidate: candidate.latency_seconds)
+            else:
+                replica = usable[self.turn % len(usable)]
+                self.turn += 1
+            replica.routed += 1
+            return replica
+
+    def record_fallback(self, replica):
+        with self.lock:
+            replica.fallbacks += 1
+
+    def status(self):
+        with self.lock:
+            usable = self.usable()
+            return [
+                {
+                    "replica": replica.name,
+                    "healthy": replica.healthy,
+                    "in recovery": replica.in_recovery,
+                    "lag s": None if replica.lag_seconds is None else round(replica.lag_seconds, 3),
+                    "latency ms": None if replica.latency_seconds is None else round(replica.latency_seconds * 1000, 2),
+                    "routing": replica in usable,
+                    "routed": replica.routed,
+                    "fallbacks": replica.fallbacks,
+                    "checked at": replica.checked_at.isoformat() if replica.checked_at else None,
+                    "error": replica.error
+                }
+                for replica in self.replicas
+            ]
+
+def replica_health_loop(router):
+    while True:
+        time.sleep(REPLICA_CONFIG["check_interval"])
+        router.check_all()
+
+# Build the replica engines once per process and check them before the first report is routed,
+# then keep checking in the background; None when no replica is configured
+@st.cache_resource
+def get_replica_router():
+    if not REPLICA_CONFIG["hosts"]:
+        return None
+    replicas = []
+    for index, address in enumerate(REPLICA_CONFIG["hosts"], start=1):
+        host, _, port = address.rpartition(":") if ":" in address else (address, "", DB_CONFIG["port"])
+        engine = create_pooled_engine(
+            dict(DB_CONFIG, host=host, port=port), f"replica-{index}",
+            {"connect_timeout": REPLICA_CONFIG["connect_timeout"]}
+        )
+        replicas.append(Replica(address, engine))
+    router = ReplicaRouter(replicas, REPLICA_CONFIG["strategy"], REPLICA_CONFIG["max_lag_seconds"])
+    router.check_all()
+    threading.Thread(target=replica_health_loop, args=(router,), name="replica-health", daemon=True).start()
+    return router
+
+# Run a report on a replica when the router has a usable one. When the replica drops the connection
+# or cancels the statement over a recovery conflict (40001), the report is run again on the primary
+# and the replica is checked straight away.
+def run_routed(report, func, engine, params):
+    router = get_replica_router()
+    replica = router.choose() if router else None
+    if replica is None:
+        return instrument_report(report, func, engine, params)
+    try:
+        return instrument_report(report, func, replica.engine, params)
+    except Exception as error:
+        if not retryable(error):
+            raise
+        logger.warning("Report %s failed on replica %s (%s), running it on the primary", report, replica.name, type(error).__name__)
+        router.record_fallback(replica)
+        router.check(replica)
+        return instrument_report(report, func, engine, params)
+
+# Function to display the replica health and routing counters in the sidebar
+def display_replica_status():
+    router = get_replica_router()
+    if router is None:
+        return
+    with st.sidebar.expander("Read Replicas"):
+        st.dataframe(pd.DataFrame(router.status()), hide_index=True)
+        st.caption(
+            f"Strategy {router.strategy}, lag limit {router.max_lag_seconds:g}s; "
+            f"{router.primary_routed} reports ran on the primary for want of a usable replica"
+        )
+
+# Instrumentation settings: where to publish Prometheus metrics, and which queries get EXPLAIN ANALYZE
+METRICS_CONFIG = {
+    "file": env_setting("METRICS_FILE", ""),
+    "file_interval": env_setting("METRICS_FILE_INTERVAL", 15, float),
+    "host": env_setting("METRICS_HOST", "127.0.0.1"),
+    "port": env_setting("METRICS_PORT", 0, int),
+    "explain_slow_ms": env_setting("EXPLAIN_SLOW_MS", 0, int)
+}
+
+# Timings of the statements run by the report currently executing on this thread
+query_timings = contextvars.ContextVar("query_timings", default=None)
+
+# When set to a list, run_query only plans its statements: it appends each EXPLAIN (FORMAT JSON) plan
+# and returns an empty frame with the statement's columns
+plan_capture = contextvars.ContextVar("plan_capture", default=None)
+
+# With plan capture on, run the statements under EXPLAIN ANALYZE so the plans carry actual row counts
+plan_analyze = contextvars.ContextVar("plan_analyze", default=False)
+
+# Statement timeouts for reports run from the dashboard, in milliseconds; reports not listed, batch
+# exports and prefetches use STATEMENT_TIMEOUT_MS
+REPORT_TIMEOUTS_MS = {
+    "client_search": 5000,
+    "client_spending_count": 10000,
+    "client_spending_page": 10000,
+    "healthcare_providers": 10000,
+    "policy_start_years": 10000,
+    "fraud_claims": 20000,
+    "medical_conditions_insights": 30000,
+    "unused_providers_analysis": 30000
+}
+
+# Statement timeout in milliseconds for the report running on this thread, applied with SET LOCAL
+report_timeout = contextvars.ContextVar("report_timeout", default=None)
+
+class ReportCancelled(Exception):
+    pass
+
+# Lets another thread cancel the statement a report is running, server-side
+class QueryCancel:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connection = None
+        self.cancelled = False
+
+    def attach(self, connection):
+        with self.lock:
+            if self.cancelled:
+                raise ReportCancelled()
+            self.connection = connection
+
+    def detach(self):
+        with self.lock:
+            self.connection = None
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            if self.connection is not None:
+                self.connection.cancel()
+
+# The cancel handle of the report running on this thread
+active_cancel = contextvars.ContextVar("active_cancel", default=None)
+
+# Expose the connection a statement runs on to the report's cancel handle, if it has one
+@contextmanager
+def cancellable(conn):
+    cancel = active_cancel.get()
+    if cancel is None:
+        yield
+        return
+    cancel.attach(conn.connection.driver_connection)
+    try:
+        yield
+    finally:
+        cancel.detach()
+
+# How report results are fetched: "rows" builds the frame from result rows, "copy" streams
+# COPY (query) TO STDOUT as CSV and parses it column-wise with pyarrow using the report's dtypes
+FETCH_CONFIG = {
+    "backend": env_setting("FETCH_BACKEND", "rows"),
+    # COPY output is parsed in blocks of this size, which bounds the CSV text held at once
+    "block_bytes": 1 << 20
+}
+
+# Column types of each report for the COPY fetch backend; columns not listed are inferred
+REPORT_DTYPES = {
+    "top_5_monthly_services": {
+        "serviceperiod": "string", "healthcareproviderid": "int64", "servicename": "string",
+        "totalgenerated": "float64"
+    },
+    "client_spending": {
+        "healthcareproviderid": "int64", "healthcareprovidername": "string", "clientid": "int64",
+        "clientfullname": "string", "totalspending": "float64"
+    },
+    "client_search": {"clientid": "int64", "clientfullname": "string"},
+    "client_spending_count": {"total": "int64"},
+    "fraud_claims": {
+        "clientid": "int64", "clientname": "string", "totalclaims": "int64", "totalamount": "float64",
+        "rejectionrate": "float64"
+    },
+    "high_risk_clients": {
+        "clientid": "int64", "clientname": "string", "medicalrecordcount": "int64",
+        "totalclaimamount": "float64", "numberofdependents": "int64"
+    },
+    "risk_features": {
+        "clientid": "int64", "clientname": "string", "icd_codes": "int64", "medical_records": "int64",
+        "claims": "int64", "approved_amount": "float64", "pending_amount": "float64",
+        "rejected_amount": "float64", "dependents": "int64"
+    },
+    "insurance_plan_distribution": {
+        "healthcareproviderid": "int64", "healthcareprovidername": "string", "insuranceplanlevel": "string",
+        "clientcount": "int64"
+    },
+    "healthcare_providers": {"healthcareproviderid": "int64", "healthcareprovidername": "string"},
+    "policy_start_years": {"year": "int64"},
+    "revenue_contribution_by_agent": {
+        "agentid": "int64", "agentname": "string", "year": "float64", "totalclients": "int64",
+        "totalrevenue": "float64", "totalcommission": "float64", "netprofit": "float64"
+    },
+    "medical_conditions_insights": {
+        "conditionname": "string", "conditioncount": "int64", "servicename": "string",
+        "coveragelevel": "string", "clientsserved": "int64"
+    },
+    "company_profits": {"totalrevenue": "float64", "totalexpenses": "float64", "netprofit": "float64"},
+    "finance_period_comparison": {
+        "period": "string", "firstday": "date32", "lastday": "date32", "revenue": "float64",
+        "expenses": "float64", "netprofit": "float64"
+    },
+    "finance_ledger": {
+        "day": "date32", "policy_revenue": "float64", "payment_revenue": "float64", "approved_claims": "float64",
+        "salaries": "float64"
+    },
+    "unused_providers_analysis": {
+        "unusedprovider": "string", "coveredplan": "string", "clientscovered": "int64", "clientsutilizing": "int64"
+    },
+    "employee_claim_handling": {
+        "employeeid": "int64", "employeename": "string", "approvalstatus": "string", "claimcount": "int64",
+        "totalclaimamount": "float64", "percentageoftotalclaims": "float64"
+    }
+}
+
+def copy_supported(conn):
+    return psycopg is not None and isinstance(conn.connection.driver_connection, psycopg.Connection)
+
+# Read-only file over a COPY TO STDOUT stream, handing out each chunk as psycopg receives it
+class CopyStream(io.RawIOBase):
+    def __init__(self, copy):
+        self.copy = copy
+        self.pending = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.pending:
+            chunk = self.copy.read()
+            if not chunk:
+                return 0
+            self.pending = memoryview(chunk)
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+# Stream the statement's result as CSV through COPY and parse it into an Arrow table block by block
+# as it arrives, so the CSV text is never held in memory whole. COPY takes no bind parameters, so
+# they are interpolated client-side by psycopg. NULLs are unquoted empty fields, empty strings are
+# quoted. Raises pyarrow.ArrowInvalid when a value does not parse as its column's type.
+def copy_query(conn, statement, params, dtypes):
+    compiled = statement.compile(dialect=conn.dialect)
+    raw = conn.connection.driver_connection
+    with psycopg.ClientCursor(raw) as cursor:
+        sql = cursor.mogrify(compiled.string, compiled.construct_params(params))
+    if not conn.in_transaction():
+        conn.begin()
+    convert_options = pa_csv.ConvertOptions(
+        column_types={column: pa.type_for_alias(dtype) for column, dtype in (dtypes or {}).items()},
+        strings_can_be_null=True,
+        quoted_strings_can_be_null=False,
+        true_values=["t"],
+        false_values=["f"]
+    )
+    # Leaving COPY early when a value does not parse aborts the transaction; rolling back to the
+    # savepoint keeps the connection usable for the row fetch fallback
+    with conn.begin_nested(), raw.cursor() as cursor:
+        with cursor.copy(f"COPY ({sql}) TO STDOUT WITH (FORMAT csv, HEADER)") as copy:
+            stream = io.BufferedReader(CopyStream(copy), buffer_size=FETCH_CONFIG["block_bytes"])
+            reader = pa_csv.open_csv(
+                stream, read_options=pa_csv.ReadOptions(block_size=FETCH_CONFIG["block_bytes"]), convert_options=convert_options
+            )
+            return reader.read_all()
+
+# Run a report query on a pooled connection and return the result as a DataFrame.
+# Execution (DB time) and fetching rows into the frame (fetch time) are timed separately;
+# with the COPY backend, DB time includes streaming the result and parsing it into Arrow.
+def run_query(engine, query, params=None, dtypes=None):
+    statement = text(query.strip().rstrip(";"))
+    with db_connection(engine) as conn, cancellable(conn):
+        if report_timeout.get():
+            conn.execute(text("SELECT set_config('statement_timeout', :timeout, true)"), {"timeout": str(report_timeout.get())})
+        captured = plan_capture.get()
+        if captured is not None:
+            options = "ANALYZE, FORMAT JSON" if plan_analyze.get() else "FORMAT JSON"
+            captured.append(conn.execute(text(f"EXPLAIN ({options}) {query}"), params or {}).scalar())
+            statement = text(f"SELECT * FROM ({query.strip().rstrip(';')}) AS planned LIMIT 0")
+        data = None
+        started = time.perf_counter()
+        if captured is None and FETCH_CONFIG["backend"] == "copy" and copy_supported(conn):
+            try:
+                table = copy_query(conn, statement, params or {}, dtypes)
+                executed = time.perf_counter()
+                data = table.to_pandas()
+            except pa.ArrowInvalid:
+                logger.warning("Could not parse COPY output with the report dtypes, fetching rows instead", exc_info=True)
+                started = time.perf_counter()
+        if data is None:
+            result = conn.execute(statement, params or {})
+            executed = time.perf_counter()
+            data = pd.DataFrame.from_records(result.fetchall(), columns=list(result.keys()), coerce_float=True)
+        fetched = time.perf_counter()
+        plan = None
+        if 0 < METRICS_CONFIG["explain_slow_ms"] <= (executed - started) * 1000:
+            plan = "\n".join(conn.execute(text(f"EXPLAIN (ANALYZE, BUFFERS) {query}"), params or {}).scalars())
+    timings = query_timings.get()
+    if timings is not None:
+        timings.append({
+            "db": executed - started,
+            "fetch": fetched - executed,
+            "plan": plan,
+            "explain": time.perf_counter() - fetched if plan else 0.0
+        })
+    return data
+
+# Turn optional (condition, parameter, value) filters into a WHERE clause and bound parameters.
+# Each combination of filters always yields the same statement text, so it is prepared once per connection.
+def apply_filters(filters):
+    conditions, params = [], {}
+    for condition, name, value in filters:
+        if value is not None:
+            conditions.append(condition)
+            params[name] = value
+    return ("WHERE " + " AND ".join(conditions) if conditions else ""), params
+
+# Per-report execution statistics, shared by every session in the process
+class QueryMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reports = {}
+
+    def _stats(self, report):
+        return self.reports.setdefault(report, {
+            "runs": 0, "errors": 0, "wall_seconds": 0.0, "db_seconds": 0.0, "fetch_seconds": 0.0,
+            "last_wall_seconds": 0.0, "max_wall_seconds": 0.0, "rows": 0, "memory_bytes": 0, "raw_memory_bytes": 0,
+            "plan": None, "displays": 0, "sent_bytes": 0, "last_sent_bytes": 0, "shown_rows": 0
+        })
+
+    def record(self, report, wall, db, fetch, rows, memory, raw_memory, plan=None):
+        with self.lock:
+            stats = self._stats(report)
+            stats["runs"] += 1
+            stats["wall_seconds"] += wall
+            stats["db_seconds"] += db
+            stats["fetch_seconds"] += fetch
+            stats["last_wall_seconds"] = wall
+            stats["max_wall_seconds"] = max(stats["max_wall_seconds"], wall)
+            stats["rows"] = rows
+            stats["memory_bytes"] = memory
+            stats["raw_memory_bytes"] = raw_memory
+            if plan is not None:
+                stats["plan"] = plan
+
+    def record_error(self, report):
+        with self.lock:
+            self._stats(report)["errors"] += 1
+
+    # Rows of the report shown by one render and the Arrow bytes they took to the browser
+    def record_display(self, report, rows, sent):
+        with self.lock:
+            stats = self._stats(report)
+            stats["displays"] += 1
+            stats["sent_bytes"] += sent
+            stats["last_sent_bytes"] = sent
+            stats["shown_rows"] = rows
+
+    def snapshot(self):
+        with self.lock:
+            return {report: dict(stats) for report, stats in self.reports.items()}
+
+@st.cache_resource
+def get_query_metrics():
+    return QueryMetrics()
+
+# Frame compaction configuration: text columns whose distinct values are at most this share
+# of the rows become categoricals
+COMPACT_CONFIG = {
+    "enabled": env_setting("COMPACT_FRAMES", True, as_bool),
+    "category_ratio": 0.5
+}
+
+# Shrink a freshly fetched frame in place: repeated text becomes categorical, integers that fit
+# become int32 and Decimal columns become float64. Amounts are therefore no longer exact decimals:
+# each holds the nearest double, and sums over many rows can be off in the last cent of what the
+# database would return. Integers are not narrowed further so arithmetic on them cannot silently
+# wrap, and floats stay float64 since float32 cannot hold amounts above about 167,000 to the cent.
+def compact_frame(data):
+    int32 = np.iinfo(np.int32)
+    for column in data.columns:
+        series = data[column]
+        if pd.api.types.is_integer_dtype(series.dtype):
+            if series.dtype.itemsize > 4 and not series.empty and int32.min <= series.min() and series.max() <= int32.max:
+                data[column] = series.astype("int32")
+            continue
+        if series.dtype != object and not isinstance(series.dtype, pd.StringDtype):
+            continue
+        values = series.dropna()
+        if values.empty:
+            continue
+        if isinstance(values.iloc[0], Decimal):
+            data[column] = series.astype("float64")
+        elif isinstance(values.iloc[0], str) and values.nunique() <= len(series) * COMPACT_CONFIG["category_ratio"]:
+            data[column] = series.astype("category")
+    return data
+
+# Run one report function, compact its result and record its wall, DB and fetch time,
+# row count and result memory before and after compaction
+def instrument_report(report, func, engine, params):
+    metrics = get_query_metrics()
+    token = query_timings.set([])
+    started = time.perf_counter()
+    try:
+        data = func(engine, **params)
+    except Exception:
+        # A report cancelled because the user moved on did not fail
+        cancel = active_cancel.get()
+        if cancel is None or not cancel.cancelled:
+            metrics.record_error(report)
+        raise
+    finally:
+        timings = query_timings.get()
+        query_timings.reset(token)
+    plans = [timing["plan"] for timing in timings if timing["plan"]]
+    raw_memory = frame_bytes(data)
+    if COMPACT_CONFIG["enabled"]:
+        data = compact_frame(data)
+    metrics.record(
+        report,
+        # EXPLAIN ANALYZE runs the query a second time; that is not part of the report's cost
+        wall=time.perf_counter() - started - sum(timing["explain"] for timing in timings),
+        db=sum(timing["db"] for timing in timings),
+        fetch=sum(timing["fetch"] for timing in timings),
+        rows=len(data),
+        memory=frame_bytes(data),
+        raw_memory=raw_memory,
+        plan="\n\n".join(plans) if plans else None
+    )
+    if METRICS_CONFIG["file"]:
+        get_metrics_file_writer().mark()
+    return data
+
+# Render report, pool and cache statistics in the Prometheus text exposition format
+def prometheus_metrics():
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            label_text = ",".join(f'{key}="{label}"' for key, label in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+    reports = get_query_metrics().snapshot()
+    metric("procare_report_runs_total", "counter", "Report executions that reached the database",
+           [({"report": report}, stats["runs"]) for report, stats in reports.items()])
+    metric("procare_report_errors_total", "counter", "Report executions that raised an error",
+           [({"report": report}, stats["errors"]) for report, stats in reports.items()])
+    metric("procare_report_seconds_total", "counter", "Time spent running reports, by phase",
+           [({"report": report, "phase": phase}, round(stats[f"{phase}_seconds"], 6))
+            for report, stats in reports.items() for phase in ("wall", "db", "fetch")])
+    metric("procare_report_last_seconds", "gauge", "Wall time of the latest execution",
+           [({"report": report}, round(stats["last_wall_seconds"], 6)) for report, stats in reports.items()])
+    metric("procare_report_rows", "gauge", "Rows returned by the latest execution",
+           [({"report": report}, stats["rows"]) for report, stats in reports.items()])
+    metric("procare_report_memory_bytes", "gauge", "DataFrame memory of the latest result",
+           [({"report": report}, stats["memory_bytes"]) for report, stats in reports.items()])
+    metric("procare_report_raw_memory_bytes", "gauge", "DataFrame memory of the latest result before compaction",
+           [({"report": report}, stats["raw_memory_bytes"]) for report, stats in reports.items()])
+    metric("procare_report_displays_total", "counter", "Renders of the report's table",
+           [({"report": report}, stats["displays"]) for report, stats in reports.items()])
+    metric("procare_report_sent_bytes_total", "counter", "Arrow bytes of table rows sent to the browser",
+           [({"report": report}, stats["sent_bytes"]) for report, stats in reports.items()])
+    metric("procare_report_last_sent_bytes", "gauge", "Arrow bytes sent by the latest render of the table",
+           [({"report": report}, stats["last_sent_bytes"]) for report, stats in reports.items()])
+
+    engine = connect_db()
+    for key, value in get_pool_stats().snapshot(engine).items():
+        kind = "gauge" if key in ("pool_size", "checked_out", "overflow", "max_wait_seconds") else "counter"
+        name = f"procare_pool_{key}" + ("_total" if kind == "counter" else "")
+        metric(name, kind, f"Connection pool {key.replace('_', ' ')}", [({}, value)])
+    for key, value in get_report_cache().stats().items():
+        kind = "counter" if key in ("hits", "misses", "expirations", "evictions", "rejections") else "gauge"
+        name = f"procare_cache_{key}" + ("_total" if kind == "counter" else "")
+        metric(name, kind, f"Result cache {key.replace('_', ' ')}", [({}, value)])
+    router = get_replica_router()
+    if router is not None:
+        replicas = router.status()
+        metric("procare_replica_usable", "gauge", "Whether reports are routed to the replica",
+               [({"replica": replica["replica"]}, int(replica["routing"])) for replica in replicas])
+        metric("procare_replica_lag_seconds", "gauge", "Replay lag at the latest health check",
+               [({"replica": replica["replica"]}, "+Inf" if replica["lag s"] == float("inf") else replica["lag s"])
+                for replica in replicas if replica["lag s"] is not None])
+        metric("procare_replica_latency_seconds", "gauge", "Smoothed health check round trip",
+               [({"replica": replica["replica"]}, replica["latency ms"] / 1000) for replica in replicas
+                if replica["latency ms"] is not None])
+        metric("procare_replica_routed_total", "counter", "Reports routed to the replica",
+               [({"replica": replica["replica"]}, replica["routed"]) for replica in replicas])
+        metric("procare_replica_fallbacks_total", "counter", "Reports re-run on the primary after failing on the replica",
+               [({"replica": replica["replica"]}, replica["fallbacks"]) for replica in replicas])
+        metric("procare_replica_primary_routed_total", "counter", "Reports run on the primary because no replica was usable",
+               [({}, router.primary_routed)])
+    return "\n".join(lines) + "\n"
+
+# A uniquely named temporary path in the same directory as path, renamed over it once the block
+# completes, so a reader never sees the file half-written and concurrent writers never rename each
+# other's temporary files
+@contextmanager
+def replaced_atomically(path):
+    temporary = os.path.join(
+        os.path.dirname(os.path.abspath(path)), f".{os.path.basename(path)}.{uuid.uuid4().hex}.tmp"
+    )
+    try:
+        yield temporary
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.unlink(temporary)
+        raise
+
+def write_atomically(path, content, mode="w"):
+    with replaced_atomically(path) as temporary:
+        with open(temporary, mode) as temporary_file:
+            temporary_file.write(content)
+
+# Rewrites the metrics file from a background thread, at most once per interval and only after a
+# report ran, so report runs neither wait on the export nor fail with it
+class MetricsFileWriter:
+    def __init__(self, path, interval):
+        self.path = path
+        self.interval = interval
+        # Held from taking the changes to writing them, so a flush waits for a write in progress
+        self.lock = threading.RLock()
+        self.changed = threading.Event()
+
+    def mark(self):
+        self.changed.set()
+
+    def write(self):
+        with self.lock:
+            try:
+                write_atomically(self.path, prometheus_metrics())
+            except Exception:
+                logger.warning("Writing metrics to %s failed", self.path, exc_info=True)
+
+    def run(self):
+        while True:
+            self.changed.wait()
+            self.flush()
+            time.sleep(self.interval)
+
+    # Write the runs not written yet; also called before the process exits, as batch runs do
+    def flush(self):
+        with self.lock:
+            if self.changed.is_set():
+                self.changed.clear()
+                self.write()
+
+@st.cache_resource
+def get_metrics_file_writer():
+    writer = MetricsFileWriter(METRICS_CONFIG["file"], METRICS_CONFIG["file_interval"])
+    threading.Thread(target=writer.run, name="metrics-file", daemon=True).start()
+    atexit.register(writer.flush)
+    return writer
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = prometheus_metrics().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+# Serve /metrics once per process when a metrics port is configured
+@st.cache_resource
+def start_metrics_server():
+    if not METRICS_CONFIG["port"]:
+        return None
+    server = ThreadingHTTPServer((METRICS_CONFIG["host"], METRICS_CONFIG["port"]), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+# Function to display the per-report performance panel in the sidebar
+def display_performance_panel(report):
+    reports = get_query_metrics().snapshot()
+    with st.sidebar.expander("Performance"):
+        if not reports:
+            st.caption("No report has been run yet.")
+            return
+        st.dataframe(pd.DataFrame([
+            {
+                "report": name,
+                "runs": stats["runs"],
+                "errors": stats["errors"],
+                "last ms": round(stats["last_wall_seconds"] * 1000, 1),
+                "avg ms": round(stats["wall_seconds"] / stats["runs"] * 1000, 1) if stats["runs"] else 0.0,
+                "avg db ms": round(stats["db_seconds"] / stats["runs"] * 1000, 1) if stats["runs"] else 0.0,
+                "avg fetch ms": round(stats["fetch_seconds"] / stats["runs"] * 1000, 1) if stats["runs"] else 0.0,
+                "rows": stats["rows"],
+                "memory MB": round(stats["memory_bytes"] / 1e6, 2),
+                "raw memory MB": round(stats["raw_memory_bytes"] / 1e6, 2),
+                "rows shown": stats["shown_rows"],
+                "last sent KB": round(stats["last_sent_bytes"] / 1024, 1)
+            }
+            for name, stats in reports.items()
+        ]), hide_index=True)
+        plan = reports.get(report, {}).get("plan")
+        if plan:
+            st.caption("Latest slow-query plan for this report")
+            st.code(plan)
+
+# Function to display the connection pool counters in the sidebar
+def display_pool_stats(engine):
+    with st.sidebar.expander("Connection Pool"):
+        st.json(get_pool_stats().snapshot(engine))
+
+# Startup and rerun profiling: PROCARE_PROFILE=1 times every phase of each script run, logs it and
+# shows it in the sidebar; PROCARE_PROFILE_OUTPUT also appends each run to a JSON lines file
+PROFILE_CONFIG = {
+    "enabled": env_setting("PROFILE", False, as_bool),
+    "output": env_setting("PROFILE_OUTPUT", ""),
+    "history": env_setting("PROFILE_HISTORY", 200, int)
+}
+
+# Phase timings of one script run. "imports" only costs anything on the first run in a process, and
+# the header is the first element the browser receives, so time to first paint ends with that phase.
+class RunProfile:
+    def __init__(self):
+        now = time.perf_counter()
+        self.phases = {"imports": IMPORTS_FINISHED - SCRIPT_STARTED, "definitions": now - IMPORTS_FINISHED}
+        self.last = now
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self.last
+        self.last = now
+
+    def result(self, view):
+        elapsed, first_paint = 0.0, None
+        for phase, seconds in self.phases.items():
+            elapsed += seconds
+            if phase == "header":
+                first_paint = elapsed
+        return {
+            "view": view,
+            "total_ms": round(elapsed * 1000, 2),
+            "first_paint_ms": round(first_paint * 1000, 2) if first_paint is not None else None,
+            "phases_ms": {phase: round(seconds * 1000, 2) for phase, seconds in self.phases.items()}
+        }
+
+# Profiled runs of every session in the process; the first one is the cold start
+class ProfileStore:
+    def __init__(self, history):
+        self.lock = threading.Lock()
+        self.cold = None
+        self.reruns = deque(maxlen=history)
+
+    def record(self, run):
+        with self.lock:
+            run["kind"] = "rerun" if self.cold else "cold"
+            if self.cold:
+                self.reruns.append(run)
+            else:
+                self.cold = run
+            if PROFILE_CONFIG["output"]:
+                with open(PROFILE_CONFIG["output"], "a") as output:
+                    output.write(json.dumps(run) + "\n")
+        logger.info(
+            "%s run of %s: %.1fms, first paint %sms, phases %s",
+            run["kind"], run["view"], run["total_ms"], run["first_paint_ms"], run["phases_ms"]
+        )
+
+    def summary(self):
+        with self.lock:
+            totals = [run["total_ms"] for run in self.reruns]
+            return {
+                "cold_total_ms": self.cold["total_ms"] if self.cold else None,
+                "cold_first_paint_ms": self.cold["first_paint_ms"] if self.cold else None,
+                "reruns": len(totals),
+                "rerun_p50_ms": round(float(np.percentile(totals, 50)), 2) if totals else None,
+                "rerun_p95_ms": round(float(np.percentile(totals, 95)), 2) if totals else None
+            }
+
+@st.cache_resource
+def get_profile_store():
+    return ProfileStore(PROFILE_CONFIG["history"])
+
+# Function to record this run's profile and display it in the sidebar
+def display_profile(profile, view):
+    store = get_profile_store()
+    store.record(profile.result(view))
+    with st.sidebar.expander("Startup Profile"):
+        st.dataframe(pd.DataFrame(
+            [{"phase": phase, "ms": round(seconds * 1000, 2)} for phase, seconds in profile.phases.items()]
+        ), hide_index=True)
+        st.json(store.summary())
+
+# Result cache configuration
+CACHE_CONFIG = {
+    "max_bytes": env_setting("CACHE_MAX_MB", 256, int) * 1024 * 1024,
+    "default_ttl": env_setting("CACHE_TTL", 300, int)
+}
+
+# Seconds each report's results stay cached before the query runs again
+REPORT_TTLS = {
+    "top_5_monthly_services": 3600,
+    "client_spending_by_hcp": 900,
+    "fraud_claims": 120,
+    "high_risk_clients": 900,
+    "insurance_plan_distribution": 1800,
+    "revenue_contribution_by_agent": 3600,
+    "medical_conditions_insights": 3600,
+    "company_profits": 3600,
+    "finance_period_comparison": 3600,
+    "finance_ledger": 3600,
+    "risk_features": 900,
+    "unused_providers_analysis": 3600,
+    "employee_claim_handling": 600
+}
+
+# Size of a cached result, measured the same way pandas reports DataFrame memory
+def frame_bytes(data):
+    return int(data.memory_usage(index=True, deep=True).sum())
+
+# LRU cache of report results, bounded by total DataFrame memory and a TTL per entry
+class ReportCache:
+    def __init__(self, max_bytes):
+        self.lock = threading.Lock()
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (expires_at, nbytes, data)
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.rejections = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key, data, ttl):
+        nbytes = frame_bytes(data)
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            if nbytes > self.max_bytes:
+                self.rejections += 1
+                return
+            while self.entries and self.total_bytes + nbytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+            self.entries[key] = (time.monotonic() + ttl, nbytes, data)
+            self.total_bytes += nbytes
+
+    # Drop every entry for one report, or the whole cache when no report is given
+    def invalidate(self, report=None):
+        with self.lock:
+            for key in [k for k in self.entries if report is None or k[0] == report]:
+                self._remove(key)
+
+    # Whether a fresh entry exists, without touching the LRU order or the hit and miss counters
+    def contains(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry is not None and entry[0] >= time.monotonic()
+
+    def _remove(self, key):
+        self.total_bytes -= self.entries.pop(key)[1]
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+                "rejections": self.rejections
+            }
+
+@st.cache_resource
+def get_report_cache():
+    return ReportCache(CACHE_CONFIG["max_bytes"])
+
+# Threads that run reports for dashboard sessions while the script thread waits on them
+@st.cache_resource
+def get_report_executor():
+    return ThreadPoolExecutor(
+        max_workers=POOL_CONFIG["pool_size"] + POOL_CONFIG["max_overflow"], thread_name_prefix="report"
+    )
+
+def run_with_cancel(cancel, timeout, report, func, engine, params):
+    active_cancel.set(cancel)
+    report_timeout.set(timeout)
+    return run_routed(report, func, engine, params)
+
+# Run a report for the current session on a worker thread, showing the elapsed time while waiting.
+# Streamlit interrupts the script with an exception when the user changes the selection or the
+# session ends; the finally block then cancels the statement so it stops holding a backend and a
+# pooled connection.
+def run_cancellable(report, func, engine, params):
+    cancel = QueryCancel()
+    timeout = REPORT_TIMEOUTS_MS.get(report, POOL_CONFIG["statement_timeout_ms"])
+    future = get_report_executor().submit(run_with_cancel, cancel, timeout, report, func, engine, params)
+    name = report.replace("_", " ")
+    status = st.empty()
+    started = time.monotonic()
+    try:
+        while True:
+            try:
+                return future.result(timeout=0.25)
+            except FutureTimeout:
+                status.caption(f"Running the {name} query: {time.monotonic() - started:.0f}s elapsed (stops after {timeout / 1000:.0f}s)")
+    except Exception as error:
+        if query_timed_out(error):
+            status.empty()
+            st.error(f"The {name} query did not finish within {timeout / 1000:.0f} seconds and was stopped. Try narrower filters or try again later.")
+            st.stop()
+        raise
+    finally:
+        if not future.done():
+            cancel.cancel()
+        status.empty()
+
+# SQLSTATE 57014 (query_canceled): the statement timeout fired, or the statement was cancelled
+def query_timed_out(error):
+    original = getattr(error, "orig", error)
+    return (getattr(original, "sqlstate", None) or getattr(original, "pgcode", None)) == "57014"
+
+# Read a report from the current snapshot; in a dashboard session a missing export is shown as
+# a warning instead of a traceback
+def read_snapshot(report, params):
+    try:
+        snapshot = get_snapshot(snapshot_path())
+        return instrument_report(report, functools.partial(read_snapshot_report, report=report), snapshot, params)
+    except SnapshotUnavailable as error:
+        if get_script_run_ctx() is None:
+            raise
+        st.warning(f"{error}. Switch PROCARE_DATA_SOURCE to live for this view.")
+        st.stop()
+
+def report_cache_key(report, params):
+    return (report, tuple(sorted(params.items())))
+
+# Serve a report function from the result cache, keyed on the report name and its parameters
+def cached_report(func):
+    @functools.wraps(func)
+    def wrapper(engine, **params):
+        cache = get_report_cache()
+        key = report_cache_key(func.__name__, params)
+        data = cache.get(key)
+        if data is None:
+            # Dashboard sessions run the report cancellably; batch, prefetch and CLI callers run it inline
+            if DATA_CONFIG["source"] == "snapshot":
+                data = read_snapshot(func.__name__, params)
+            elif get_script_run_ctx() is not None:
+                data = run_cancellable(func.__name__, func, engine, params)
+            else:
+                data = run_routed(func.__name__, func, engine, params)
+            cache.put(key, data, report_ttl(func.__name__))
+        # Callers rename and convert columns, so hand out a copy that leaves the cached frame untouched
+        return data.copy(deep=False)
+
+    return wrapper
+
+# Function to display the result cache statistics and a manual refresh control in the sidebar
+def display_cache_controls(reports):
+    cache = get_report_cache()
+    if st.sidebar.button("Refresh data", help="Discard cached results for this view and query the database again"):
+        for report in reports:
+            cache.invalidate(report)
+    with st.sidebar.expander("Result Cache"):
+        st.json(cache.stats())
+        if PREFETCH_CONFIG["connections"] > 0:
+            st.caption("Prefetch")
+            st.json(get_prefetcher().stats())
+        if CDC_CONFIG["enabled"] and DATA_CONFIG["source"] == "live":
+            st.caption("Change feed")
+            st.json(get_change_listener().stats())
+
+# Materialized view refresh configuration; an interval of 0 disables the background refresher
+MV_CONFIG = {
+    "refresh_interval": env_setting("MV_REFRESH_INTERVAL", 900, int),
+    "poll_interval": env_setting("MV_POLL_INTERVAL", 30, int)
+}
+
+# Materialized views behind the heaviest reports, with the unique index REFRESH ... CONCURRENTLY requires
+MATERIALIZED_VIEWS = {
+    "mv_top5monthlyservicesummary": {
+        "report": "top_5_monthly_services",
+        "query": """
+            SELECT ServicePeriod, HealthcareProviderID, ServiceName, TotalGenerated
+            FROM top5monthlyservicesummary
+        """,
+        "unique_index": ["ServicePeriod", "HealthcareProviderID", "ServiceName"]
+    },
+    "mv_client_spending_by_hcp": {
+        "report": "client_spending_by_hcp",
+        "query": """
+            SELECT 
+                H.HealthcareProviderID, 
+                H.ProviderName AS HealthcareProviderName, 
+                C.ClientID, 
+                CONCAT(C.FirstName, ' ', COALESCE(C.MiddleName, ''), ' ', C.LastName) AS ClientFullName, 
+                SUM(P.ServiceCost) AS TotalSpending
+            FROM Provide P 
+            JOIN Client C ON P.ClientID = C.ClientID 
+            JOIN EmployDoctor ED ON P.DoctorID = ED.DoctorID 
+            JOIN HealthcareProvider H ON ED.HealthcareProviderID = H.HealthcareProviderID 
+            GROUP BY H.HealthcareProviderID, H.ProviderName, C.ClientID, C.FirstName, C.MiddleName, C.LastName
+        """,
+        "unique_index": ["HealthcareProviderID", "ClientID"],
+        # Keyset pagination walks this index backwards from the highest spending
+        "indexes": {"keyset": ["TotalSpending", "ClientID", "HealthcareProviderID"], "client": ["ClientID"]}
+    },
+    "mv_insurance_plan_distribution": {
+        "report": "insurance_plan_distribution",
+        "query": """
+            SELECT 
+                H.HealthcareProviderID,
+                H.ProviderName AS HealthcareProviderName,
+                IP.CoverageLevel AS InsurancePlanLevel,
+                COUNT(DISTINCT C.ClientID) AS ClientCount
+            FROM Provide P
+            JOIN Client C ON P.ClientID = C.ClientID
+            JOIN Sell S ON C.ClientID = S.ClientID
+            JOIN Policy L ON S.PolicyNumber = L.PolicyNumber
+            JOIN InsurancePlan IP ON L.InsurancePlanName = IP.InsurancePlanName
+            JOIN EmployDoctor ED ON P.DoctorID = ED.DoctorID
+            JOIN HealthcareProvider H ON ED.HealthcareProviderID = H.HealthcareProviderID
+            GROUP BY H.HealthcareProviderID, H.ProviderName, IP.CoverageLevel
+        """,
+        "unique_index": ["HealthcareProviderID", "InsurancePlanLevel"]
+    }
+}
+
+# Columns of an index in key order, or None when it does not exist
+def index_columns(conn, index):
+    return conn.execute(text("""
+        SELECT array_agg(a.attname ORDER BY k.position)
+        FROM pg_index i
+        CROSS JOIN LATERAL unnest(i.indkey) WITH ORDINALITY AS k(attnum, position)
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+        WHERE i.indexrelid = to_regclass(:index)
+    """), {"index": index}).scalar()
+
+# Create the materialized views, their unique indexes and the refresh log if they are missing. A view
+# whose unique index no longer matches its spec was built from an older query and is rebuilt.
+def ensure_materialized_views(engine):
+    with engine.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('procare_mv_refresh'))"))
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS procare_mv_refresh (
+                view_name TEXT PRIMARY KEY,
+                refreshed_at TIMESTAMPTZ NOT NULL,
+                duration_ms INTEGER NOT NULL
+            )
+        """))
+        for view, spec in MATERIALIZED_VIEWS.items():
+            exists = conn.execute(text("SELECT to_regclass(:view) IS NOT NULL"), {"view": view}).scalar()
+            key = index_columns(conn, f"{view}_key")
+            if exists and key is not None and key != [column.lower() for column in spec["unique_index"]]:
+                conn.execute(text(f"DROP MATERIALIZED VIEW {view}"))
+                exists = False
+            if not exists:
+                started = time.perf_counter()
+                conn.execute(text(f"CREATE MATERIALIZED VIEW {view} AS {spec['query']} WITH DATA"))
+                record_mv_refresh(conn, view, time.perf_counter() - started)
+            conn.execute(text(
+                f"CREATE UNIQUE INDEX IF NOT EXISTS {view}_key ON {view} ({', '.join(spec['unique_index'])})"
+            ))
+            for name, columns in spec.get("indexes", {}).items():
+                conn.execute(text(f"CREATE INDEX IF NOT EXISTS {view}_{name} ON {view} ({', '.join(columns)})"))
+
+def record_mv_refresh(conn, view, seconds):
+    conn.execute(text("""
+        INSERT INTO procare_mv_refresh (view_name, refreshed_at, duration_ms)
+        VALUES (:view, now(), :duration_ms)
+        ON CONFLICT (view_name) DO UPDATE
+        SET refreshed_at = EXCLUDED.refreshed_at, duration_ms = EXCLUDED.duration_ms
+    """), {"view": view, "duration_ms": int(seconds * 1000)})
+
+# Refresh one materialized view without blocking readers, then drop the cached results built from it,
+# here and, through the change feed, in the other dashboard processes
+def refresh_materialized_view(engine, view):
+    started = time.perf_counter()
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {view}"))
+        record_mv_refresh(conn, view, time.perf_counter() - started)
+        conn.execute(text("SELECT pg_notify(:channel, :view)"), {"channel": CDC_CONFIG["channel"], "view": view})
+    get_report_cache().invalidate(MATERIALIZED_VIEWS[view]["report"])
+
+# Refresh every view whose last refresh is older than the configured interval.
+# The advisory lock keeps several dashboard processes from refreshing the same views at once.
+def refresh_due_materialized_views(engine):
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if not conn.execute(text("SELECT pg_try_advisory_lock(hashtext('procare_mv_refresh'))")).scalar():
+            return
+        try:
+            due = conn.execute(text("""
+                SELECT view_name FROM procare_mv_refresh
+                WHERE refreshed_at <= now() - make_interval(secs => :interval)
+            """), {"interval": MV_CONFIG["refresh_interval"]}).scalars().all()
+            for view in due:
+                if view in MATERIALIZED_VIEWS:
+                    refresh_materialized_view(engine, view)
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(hashtext('procare_mv_refresh'))"))
+
+def materialized_view_refresher(engine):
+    while True:
+        try:
+            refresh_due_materialized_views(engine)
+        except Exception:
+            logger.exception("Materialized view refresh failed")
+        time.sleep(MV_CONFIG["poll_interval"])
+
+# Create the views and start the background refresher once per process
+@st.cache_resource
+def start_materialized_views(_engine):
+    ensure_materialized_views(_engine)
+    if MV_CONFIG["refresh_interval"] > 0:
+        threading.Thread(
+            target=materialized_view_refresher, args=(_engine,), name="mv-refresher", daemon=True
+        ).start()
+    return True
+
+# When a materialized view was last refreshed, or None if it has never been built
+def materialized_view_refreshed_at(engine, view):
+    with db_connection(engine) as conn:
+        return conn.execute(
+            text("SELECT refreshed_at FROM procare_mv_refresh WHERE view_name = :view"), {"view": view}
+        ).scalar()
+
+# Function to show how stale a report's materialized view is
+def display_staleness(engine, view):
+    if DATA_CONFIG["source"] == "snapshot":
+        return
+    refreshed_at = materialized_view_refreshed_at(engine, view)
+    if refreshed_at is None:
+        st.caption("Data freshness unknown: the materialized view has not been refreshed yet.")
+        return
+    age = int((datetime.now(timezone.utc) - refreshed_at).total_seconds())
+    st.caption(
+        f"Data as of {refreshed_at.astimezone():%Y-%m-%d %H:%M:%S} "
+        f"({age // 3600}h {age % 3600 // 60}m {age % 60}s ago)"
+    )
+
+# Change data capture. Statement triggers on the tables the reports read publish the table's name on a
+# NOTIFY channel when a statement changed rows, and a listener thread in each dashboard process drops
+# the cached results of only the reports that read it. Notifications arriving within one debounce
+# window are handled together. While the listener is connected, reports that read nothing but tables
+# stay cached for cache_ttl seconds instead of their TTL, and open sessions rerun within live_refresh
+# seconds when their view's data changed (0 leaves them as they are until the next interaction).
+CDC_CONFIG = {
+    "enabled": env_setting("CDC_ENABLED", True, as_bool),
+    "channel": env_setting("CDC_CHANNEL", "procare_changes"),
+    "debounce": env_setting("CDC_DEBOUNCE", 1.0, float),
+    "cache_ttl": env_setting("CDC_CACHE_TTL", 86400, int),
+    "live_refresh": env_setting("CDC_LIVE_REFRESH", 5, int),
+    "keepalive": 30
+}
+
+# Relations each report reads. "clock" marks reports over a window that moves with the current date,
+# which keep their TTL; `python procare.py check-changes` compares the rest with the report plans.
+REPORT_DEPENDENCIES = {
+    "top_5_monthly_services": {"mv_top5monthlyservicesummary"},
+    "client_spending_by_hcp": {"mv_client_spending_by_hcp"},
+    "client_spending_page": {"mv_client_spending_by_hcp"},
+    "client_spending_count": {"mv_client_spending_by_hcp"},
+    "client_search": {"client"},
+    "fraud_claims": {"requestclaim", "client", "clock"},
+    "high_risk_clients": {"client", "medicalrecords", "requestclaim", "clientdependent"},
+    "risk_features": {"client_risk_features"},
+    "insurance_plan_distribution": {"mv_insurance_plan_distribution"},
+    "healthcare_providers": {"healthcareprovider"},
+    "policy_start_years": {"policy"},
+    "revenue_contribution_by_agent": {"sell", "policy", "agent"},
+    "medical_conditions_insights": {"medicalrecords", "insuranceplan", "sell", "policy", "provide", "medicalservice"},
+    "company_profits": {"finance_daily_ledger", "clock"},
+    "finance_period_comparison": {"finance_daily_ledger"},
+    "finance_ledger": {"finance_daily_ledger"},
+    "unused_providers_analysis": {"policy", "sell", "covers", "healthcareprovider", "clock"},
+    "employee_claim_handling": {"requestclaim", "employee"}
+}
+
+# The tables that publish their changes: every table a report reads, and the tables the finance ledger
+# and the risk feature store fold in, so their maintainers start as soon as one changes. Materialized
+# views cannot have triggers; refresh_materialized_view publishes their refreshes itself.
+def change_feed_tables():
+    tables = set().union(*REPORT_DEPENDENCIES.values())
+    tables |= {table.lower() for table in [*LEDGER_SOURCES, *RISK_SOURCES]}
+    return sorted(tables - set(MATERIALIZED_VIEWS) - {"clock"})
+
+# Statement triggers that publish a table's name when a statement changed any of its rows; the
+# transition tables tell an upsert that left every row as it was from one that did not. Tables that do
+# not exist yet are skipped, and the ledger and the risk store add them when they create their tables.
+def ensure_change_notifications(conn, tables):
+    channel = CDC_CONFIG["channel"]
+    conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('procare_change_feed'))"))
+    conn.execute(text(f"""
+        CREATE OR REPLACE FUNCTION procare_notify_change() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'TRUNCATE' THEN
+                PERFORM pg_notify('{channel}', TG_TABLE_NAME || ':' || TG_OP);
+            ELSIF TG_OP = 'DELETE' THEN
+                IF EXISTS (SELECT 1 FROM old_rows) THEN
+                    PERFORM pg_notify('{channel}', TG_TABLE_NAME || ':' || TG_OP);
+                END IF;
+            ELSIF EXISTS (SELECT 1 FROM new_rows) THEN
+                PERFORM pg_notify('{channel}', TG_TABLE_NAME || ':' || TG_OP);
+            END IF;
+            RETURN NULL;
+        END
+        $$
+    """))
+    for table in tables:
+        count = conn.execute(text("""
+            SELECT count(*) FROM pg_trigger
+            WHERE tgrelid = to_regclass(:table) AND tgname LIKE 'procare\\_notify\\_%'
+        """), {"table": table}).scalar()
+        if count == 4 or conn.execute(text("SELECT to_regclass(:table) IS NULL"), {"table": table}).scalar():
+            continue
+        for event, referencing in (
+            ("INSERT", "REFERENCING NEW TABLE AS new_rows"),
+            ("UPDATE", "REFERENCING NEW TABLE AS new_rows"),
+            ("DELETE", "REFERENCING OLD TABLE AS old_rows"),
+            ("TRUNCATE", "")
+        ):
+            trigger = f"procare_notify_{event.lower()}"
+            conn.execute(text(f"DROP TRIGGER IF EXISTS {trigger} ON {table}"))
+            conn.execute(text(f"""
+                CREATE TRIGGER {trigger} AFTER {event} ON {table} {referencing}
+                FOR EACH STATEMENT EXECUTE FUNCTION procare_notify_change()
+            """))
+
+# The table and operation of a change notification, whose payload is "<table>:<TG_OP>"
+def parse_change(payload):
+    table, _, operation = payload.partition(":")
+    return table, operation
+
+# Hears the change notifications and invalidates the cached reports that read the changed tables.
+# Maintainer threads subscribe an event to the tables they fold in and are woken on a change; those
+# that only read new rows can pass a second event, set when rows of the tables were updated or deleted.
+class ChangeListener:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connected = False
+        self.subscribers = []  # (tables, wake event, rewrite event or None)
+        self.versions = Counter()
+        self.invalidations = Counter()
+        self.notifications = 0
+        self.connects = 0
+        self.changed_at = {}
+        self.error = None
+
+    def subscribe(self, tables, wake, rewrite=None):
+        with self.lock:
+            self.subscribers.append(({table.lower() for table in tables}, wake, rewrite))
+
+    # Results built from the changed tables, of which rewritten were updated, deleted or truncated; None
+    # means changes may have been missed, so everything is dropped. A replica may not have replayed the change when a report is queried again, so the same
+    # reports are dropped once more after the replica lag limit.
+    def apply(self, tables, rewritten=frozenset()):
+        if tables is None:
+            get_report_cache().invalidate()
+        reports = [
+            report for report, relations in REPORT_DEPENDENCIES.items() if tables is None or relations & tables
+        ]
+        with self.lock:
+            changed_at = datetime.now(timezone.utc)
+            self.changed_at.update((table, changed_at) for table in tables or ())
+            woken = [wake for subscribed, wake, _ in self.subscribers if tables is None or subscribed & tables]
+            rewrites = [rewrite for subscribed, _, rewrite in self.subscribers if rewrite and subscribed & rewritten]
+        for rewrite in rewrites:
+            rewrite.set()
+        for wake in woken:
+            wake.set()
+        self.invalidate(reports)
+        router = get_replica_router()
+        if router is not None and reports:
+            timer = threading.Timer(router.max_lag_seconds, self.invalidate, args=(reports,))
+            timer.daemon = True
+            timer.start()
+
+    def invalidate(self, reports):
+        cache = get_report_cache()
+        for report in reports:
+            cache.invalidate(report)
+        with self.lock:
+            self.versions.update(reports)
+            self.invalidations.update(reports)
+
+    # How many times each report's results were invalidated; a session compares it with what it rendered
+    def version(self, reports):
+        with self.lock:
+            return tuple(self.versions[report] for report in reports)
+
+    # Listen on a dedicated connection outside the pool, reconnecting after a failure. Whatever was
+    # cached is dropped on every (re)connect, since changes committed meanwhile were never heard, and
+    # when the connection is lost, since entries cached for cache_ttl would no longer be invalidated.
+    def listen(self, engine):
+        cargs, cparams = engine.dialect.create_connect_args(engine.url)
+        while True:
+            try:
+                with engine.dialect.connect(*cargs, **cparams) as conn:
+                    conn.autocommit = True
+                    conn.execute(f"LISTEN {CDC_CONFIG['channel']}")
+                    with self.lock:
+                        self.connected = True
+                        self.connects += 1
+                        self.error = None
+                    self.apply(None)
+                    checked = time.monotonic()
+                    while True:
+                        tables, rewritten = set(), set()
+                        for notify in conn.notifies(timeout=CDC_CONFIG["debounce"]):
+                            table, operation = parse_change(notify.payload)
+                            tables.add(table)
+                            if operation != "INSERT":
+                                rewritten.add(table)
+                            with self.lock:
+                                self.notifications += 1
+                        if tables:
+                            self.apply(tables, rewritten)
+                        elif time.monotonic() - checked >= CDC_CONFIG["keepalive"]:
+                            conn.execute("SELECT 1")
+                            checked = time.monotonic()
+            except Exception as raised:
+                logger.warning("Change listener disconnected: %s", raised)
+                with self.lock:
+                    was_connected, self.connected = self.connected, False
+                    self.error = f"{type(raised).__name__}: {(str(raised).splitlines() or [''])[0]}"
+                if was_connected:
+                    get_report_cache().invalidate()
+                time.sleep(5)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "connected": self.connected,
+                "connects": self.connects,
+                "notifications": self.notifications,
+                "invalidations": dict(self.invalidations),
+                "changed_at": {table: at.isoformat() for table, at in sorted(self.changed_at.items())},
+                "error": self.error
+            }
+
+@st.cache_resource
+def get_change_listener():
+    return ChangeListener()
+
+# Create the notification triggers and start listening once per process; None when the change feed is
+# off, in which case cached reports expire by their TTL
+@st.cache_resource
+def start_change_listener(_engine):
+    if not CDC_CONFIG["enabled"] or DATA_CONFIG["source"] == "snapshot":
+        return None
+    if _engine.dialect.driver != "psycopg":
+        logger.warning("The change feed needs the psycopg driver; cached reports expire by their TTL instead")
+        return None
+    with _engine.begin() as conn:
+        ensure_change_notifications(conn, change_feed_tables())
+    listener = get_change_listener()
+    threading.Thread(target=listener.listen, args=(_engine,), name="change-listener", daemon=True).start()
+    return listener
+
+# Seconds to cache a report's results: its TTL, or cache_ttl while the change feed will invalidate them
+def report_ttl(report):
+    ttl = REPORT_TTLS.get(report, CACHE_CONFIG["default_ttl"])
+    relations = REPORT_DEPENDENCIES.get(report)
+    if relations and "clock" not in relations and get_change_listener().connected:
+        return max(ttl, CDC_CONFIG["cache_ttl"])
+    return ttl
+
+# The reports a view reads, when it renders and on demand
+def view_reports(label):
+    calls = VIEW_REPORTS.get(label) or [(QUERY_OPTIONS[label], {})]
+    return tuple(func.__name__ for func, _ in calls) + tuple(
+        func.__name__ for func in VIEW_ON_DEMAND_REPORTS.get(label, [])
+    )
+
+# Rerun the session when a report behind the view it shows was invalidated since it rendered; checking
+# costs a dictionary lookup, so every open session can do it every few seconds
+@st.fragment(run_every=CDC_CONFIG["live_refresh"] or None)
+def watch_view_changes():
+    reports, rendered = st.session_state.view_versions
+    if get_change_listener().version(reports) != rendered:
+        st.rerun(scope="app")
+
+# Per-day finance ledger behind company_profits. Triggers on the source tables queue the days each
+# statement touched, and the maintainer re-aggregates only those days; a poll interval of 0 leaves
+# the queue to be folded in by `procare.py batch` and `check-ledger`.
+LEDGER_CONFIG = {
+    "poll_interval": env_setting("LEDGER_POLL_INTERVAL", 30, int)
+}
+
+# The ledger days a change to each source table affects, selected from a trigger transition table
+LEDGER_SOURCES = {
+    "Policy": "SELECT StartDate FROM {rows}",
+    "Sell": "SELECT p.StartDate FROM {rows} r JOIN Policy p ON p.PolicyNumber = r.PolicyNumber",
+    "Agent": """
+        SELECT p.StartDate FROM {rows} r
+        JOIN Sell s ON s.AgentID = r.AgentID
+        JOIN Policy p ON p.PolicyNumber = s.PolicyNumber
+    """,
+    "Pays": "SELECT Date FROM {rows}",
+    "RequestClaim": "SELECT DateCreated::date FROM {rows}"
+}
+
+# Reports read from the ledger, whose cached results an update makes stale
+LEDGER_REPORTS = ["company_profits", "finance_period_comparison", "finance_ledger"]
+
+# Policy revenue net of the selling agent's commission by start date, payments by date and approved
+# claims by creation date, summed per day. With days given, only those days are aggregated, and
+# days that no longer have any entries come back as zeros.
+def ledger_days_query(days):
+    policy_filter = payment_filter = claim_filter = empty_days = ""
+    if days is not None:
+        policy_filter = "WHERE p.StartDate = ANY(CAST(:days AS DATE[]))"
+        payment_filter = "WHERE py.Date = ANY(CAST(:days AS DATE[]))"
+        claim_filter = """
+            AND rc.DateCreated >= CAST(:first_day AS DATE) AND rc.DateCreated < CAST(:last_day AS DATE) + 1
+            AND rc.DateCreated::date = ANY(CAST(:days AS DATE[]))
+        """
+        empty_days = "UNION ALL SELECT day, NULL, NULL, NULL FROM unnest(CAST(:days AS DATE[])) day"
+    return f"""
+        SELECT day,
+               COALESCE(SUM(policy_revenue), 0) AS policy_revenue,
+               COALESCE(SUM(payment_revenue), 0) AS payment_revenue,
+               COALESCE(SUM(approved_claims), 0) AS approved_claims
+        FROM (
+            SELECT p.StartDate AS day, p.ExactCost - (a.CommissionRate / 100) * p.ExactCost AS policy_revenue,
+                   NULL::NUMERIC AS payment_revenue, NULL::NUMERIC AS approved_claims
+            FROM Policy p
+            JOIN Sell s ON p.PolicyNumber = s.PolicyNumber
+            JOIN Agent a ON s.AgentID = a.AgentID
+            {policy_filter}
+            UNION ALL
+            SELECT py.Date, NULL, py.Amount, NULL FROM Pays py {payment_filter}
+            UNION ALL
+            SELECT rc.DateCreated::date, NULL, NULL, rc.Amount
+            FROM RequestClaim rc
+            WHERE rc.ApprovalStatus = 'Approved' {claim_filter}
+            {empty_days}
+        ) entries
+        GROUP BY day
+    """
+
+def upsert_ledger_days(conn, days):
+    params = {"days": days, "first_day": min(days), "last_day": max(days)} if days is not None else {}
+    conn.execute(text(f"""
+        INSERT INTO finance_daily_ledger (day, policy_revenue, payment_revenue, approved_claims, updated_at)
+        SELECT day, policy_revenue, payment_revenue, approved_claims, now() FROM ({ledger_days_query(days)}) days
+        ON CONFLICT (day) DO UPDATE
+        SET policy_revenue = EXCLUDED.policy_revenue, payment_revenue = EXCLUDED.payment_revenue,
+            approved_claims = EXCLUDED.approved_claims, updated_at = EXCLUDED.updated_at
+    """), params)
+
+# Accrue salaries for every ended day that has none yet: the monthly payroll spread over the days
+# of the month, so twelve whole months add up to the annual payroll. An accrued day keeps its
+# amount when salaries change later.
+def accrue_ledger_salaries(conn):
+    return conn.execute(text("""
+        INSERT INTO finance_daily_ledger (day, policy_revenue, payment_revenue, approved_claims, salaries, updated_at)
+        SELECT day::date, 0, 0, 0,
+               payroll.total / EXTRACT(DAY FROM date_trunc('month', day) + INTERVAL '1 month - 1 day'), now()
+        FROM generate_series(
+                 CAST((SELECT MIN(day) FROM finance_daily_ledger) AS TIMESTAMP),
+                 CAST(CURRENT_DATE - 1 AS TIMESTAMP), INTERVAL '1 day'
+             ) day,
+             (SELECT COALESCE(SUM(Salary), 0) AS total FROM Employee) payroll
+        ON CONFLICT (day) DO UPDATE
+        SET salaries = EXCLUDED.salaries, updated_at = EXCLUDED.updated_at
+        WHERE finance_daily_ledger.salaries IS NULL
+    """)).rowcount
+
+# Statement triggers that queue the keys each change to a source table affects into a queue table
+# with that key column. Returns whether any table's triggers had to be created, meaning whatever is
+# derived from the queue may have missed changes and should be rebuilt.
+def ensure_change_triggers(conn, name, queue, column, sources):
+    created = False
+    for table, keys in sources.items():
+        function = f"{name}_mark_{table.lower()}"
+        if conn.execute(text("""
+            SELECT count(*) FROM pg_trigger
+            WHERE tgrelid = to_regclass(:table) AND tgname LIKE :pattern
+        """), {"table": table, "pattern": f"{name}\\_%"}).scalar() == 3:
+            continue
+        created = True
+        # One statement-level function per table; PostgreSQL allows transition tables only on
+        # single-event triggers, so each event gets its own trigger
+        conn.execute(text(f"""
+            CREATE OR REPLACE FUNCTION {function}() RETURNS trigger LANGUAGE plpgsql AS $$
+            BEGIN
+                IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                    INSERT INTO {queue} ({column})
+                    SELECT DISTINCT key FROM ({keys.format(rows="new_rows")}) changed (key)
+                    WHERE key IS NOT NULL
+                    ON CONFLICT DO NOTHING;
+                END IF;
+                IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                    INSERT INTO {queue} ({column})
+                    SELECT DISTINCT key FROM ({keys.format(rows="old_rows")}) changed (key)
+                    WHERE key IS NOT NULL
+                    ON CONFLICT DO NOTHING;
+                END IF;
+                RETURN NULL;
+            END
+            $$
+        """))
+        for event, referencing in (
+            ("INSERT", "NEW TABLE AS new_rows"),
+            ("UPDATE", "OLD TABLE AS old_rows NEW TABLE AS new_rows"),
+            ("DELETE", "OLD TABLE AS old_rows")
+        ):
+            trigger = f"{name}_{event.lower()}"
+            conn.execute(text(f"DROP TRIGGER IF EXISTS {trigger} ON {table}"))
+            conn.execute(text(f"""
+                CREATE TRIGGER {trigger} AFTER {event} ON {table}
+                REFERENCING {referencing}
+                FOR EACH STATEMENT EXECUTE FUNCTION {function}()
+            """))
+    return created
+
+# Create the ledger, its queue of changed days and the source table triggers if they are missing.
+# Missing triggers mean the ledger is new or the source tables were recreated, so it is rebuilt.
+# Its update time is logged in procare_mv_refresh, which ensure_materialized_views creates.
+def ensure_finance_ledger(engine):
+    with engine.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('procare_finance_ledger'))"))
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS finance_daily_ledger (
+                day DATE PRIMARY KEY,
+                policy_revenue NUMERIC NOT NULL,
+                payment_revenue NUMERIC NOT NULL,
+                approved_claims NUMERIC NOT NULL,
+                salaries NUMERIC,
+                updated_at TIMESTAMPTZ NOT NULL
+            )
+        """))
+        conn.execute(text("CREATE TABLE IF NOT EXISTS finance_ledger_dirty (day DATE PRIMARY KEY)"))
+        rebuild = ensure_change_triggers(conn, "finance_ledger", "finance_ledger_dirty", "day", LEDGER_SOURCES)
+        ensure_change_notifications(conn, ["finance_daily_ledger"])
+        if rebuild or not conn.execute(text("SELECT EXISTS (SELECT 1 FROM finance_daily_ledger)")).scalar():
+            started = time.perf_counter()
+            conn.execute(text("TRUNCATE finance_daily_ledger, finance_ledger_dirty"))
+            upsert_ledger_days(conn, None)
+            accrue_ledger_salaries(conn)
+            record_mv_refresh(conn, "finance_daily_ledger", time.perf_counter() - started)
+
+# Fold the queued days into the ledger and accrue the days that have ended since the last update.
+# Taking the queue and re-aggregating happen in one transaction, so a change committed meanwhile
+# stays queued for the next update. Returns the number of days re-aggregated.
+def update_finance_ledger(engine):
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        if not conn.execute(text("SELECT pg_try_advisory_xact_lock(hashtext('procare_finance_ledger'))")).scalar():
+            return 0
+        days = conn.execute(text("DELETE FROM finance_ledger_dirty RETURNING day")).scalars().all()
+        if days:
+            upsert_ledger_days(conn, days)
+        accrued = accrue_ledger_salaries(conn)
+        record_mv_refresh(conn, "finance_daily_ledger", time.perf_counter() - started)
+    if days or accrued:
+        cache = get_report_cache()
+        for report in LEDGER_REPORTS:
+            cache.invalidate(report)
+    return len(days)
+
+# Fold every poll interval, or as soon as the change feed reports a write to a source table
+def finance_ledger_maintainer(engine, wake):
+    while True:
+        try:
+            update_finance_ledger(engine)
+        except Exception:
+            logger.exception("Finance ledger update failed")
+        wake.wait(LEDGER_CONFIG["poll_interval"])
+        wake.clear()
+
+# Create or rebuild the ledger and start the background maintainer once per process
+@st.cache_resource
+def start_finance_ledger(_engine):
+    ensure_finance_ledger(_engine)
+    update_finance_ledger(_engine)
+    if LEDGER_CONFIG["poll_interval"] > 0:
+        wake = threading.Event()
+        get_change_listener().subscribe(LEDGER_SOURCES, wake)
+        threading.Thread(
+            target=finance_ledger_maintainer, args=(_engine, wake), name="finance-ledger", daemon=True
+        ).start()
+    return True
+
+# Incremental fraud detection configuration; a poll interval of 0 disables the detector
+# and the Fraud Claims view falls back to the fraud_claims query
+FRAUD_CONFIG = {
+    "poll_interval": env_setting("FRAUD_POLL_INTERVAL", 30, int),
+    "resync_interval": env_setting("FRAUD_RESYNC_INTERVAL", 120, int),
+    "checkpoint": env_setting("FRAUD_CHECKPOINT", ""),
+    "checkpoint_interval": env_setting("FRAUD_CHECKPOINT_INTERVAL", 300, int),
+    "min_claims": 10,
+    "min_amount": Decimal(100000)
+}
+
+# Claims still inside the 3-month window that were created after the claim id watermark
+FRAUD_CLAIMS_QUERY = text("""
+    SELECT ClaimID, ClientID, DateCreated, COALESCE(Amount, 0) AS Amount,
+           CASE WHEN ApprovalStatus = 'Rejected' THEN 1 ELSE 0 END AS Rejected
+    FROM RequestClaim
+    WHERE ClaimID > :after AND DateCreated >= :cutoff
+    ORDER BY ClaimID
+""")
+
+# Rolling per-client claim counts, amounts and rejections over the 3-month window.
+# Claims are kept in a heap ordered by creation time so they can be expired as the window moves.
+class FraudWindow:
+    def __init__(self, min_claims, min_amount):
+        self.min_claims = min_claims
+        self.min_amount = min_amount
+        self.claims = []
+        self.totals = {}
+        self.flagged = set()
+        self.names = {}
+        self.watermark = 0
+        self.result = None
+
+    def add(self, claim_id, client_id, created, amount, rejected):
+        heapq.heappush(self.claims, (created, claim_id, client_id, amount, rejected))
+        totals = self.totals.setdefault(client_id, [0, Decimal(0), 0])
+        totals[0] += 1
+        totals[1] += amount
+        totals[2] += rejected
+        self.watermark = max(self.watermark, claim_id)
+        self.update_flag(client_id)
+        self.result = None
+
+    def expire(self, cutoff):
+        expired = 0
+        while self.claims and self.claims[0][0] < cutoff:
+            created, claim_id, client_id, amount, rejected = heapq.heappop(self.claims)
+            totals = self.totals[client_id]
+            totals[0] -= 1
+            totals[1] -= amount
+            totals[2] -= rejected
+            if totals[0] == 0:
+                del self.totals[client_id]
+            self.update_flag(client_id)
+            self.result = None
+            expired += 1
+        return expired
+
+    def update_flag(self, client_id):
+        totals = self.totals.get(client_id)
+        if totals and totals[0] > self.min_claims and totals[1] > self.min_amount:
+            self.flagged.add(client_id)
+        else:
+            self.flagged.discard(client_id)
+
+    # Same columns and order as the fraud_claims query, rebuilt only after the window changed
+    def frame(self):
+        if self.result is not None:
+            return self.result.copy(deep=False)
+        rows = []
+        for client_id in self.flagged:
+            claims, amount, rejected = self.totals[client_id]
+            rate = (Decimal(rejected * 100) / claims).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+            rows.append((client_id, self.names.get(client_id), claims, amount, rate))
+        rows.sort(key=lambda row: (-row[2], row[0]))
+        self.result = pd.DataFrame.from_records(
+            rows, columns=["clientid", "clientname", "totalclaims", "totalamount", "rejectionrate"], coerce_float=True
+        )
+        if COMPACT_CONFIG["enabled"]:
+            self.result = compact_frame(self.result)
+        return self.result.copy(deep=False)
+
+    # JSON-ready data: one list per claim column, amounts as exact decimal strings, times in ISO format
+    def state(self):
+        created, claim_ids, client_ids, amounts, rejected = zip(*self.claims) if self.claims else ((),) * 5
+        return {
+            "watermark": self.watermark,
+            "claims": {
+                "created": [value.isoformat() for value in created],
+                "claim_id": list(claim_ids),
+                "client_id": list(client_ids),
+                "amount": [str(value) for value in amounts],
+                "rejected": list(rejected)
+            },
+            "names": [[client_id, name] for client_id, name in self.names.items()]
+        }
+
+    @classmethod
+    def from_state(cls, state, min_claims, min_amount):
+        window = cls(min_claims, min_amount)
+        claims = state["claims"]
+        for created, claim_id, client_id, amount, rejected in zip(
+            claims["created"], claims["claim_id"], claims["client_id"], claims["amount"], claims["rejected"]
+        ):
+            window.add(claim_id, client_id, datetime.fromisoformat(created), Decimal(amount), rejected)
+        window.watermark = state["watermark"]
+        window.names = {client_id: name for client_id, name in state["names"]}
+        return window
+
+class FraudDetector:
+    def __init__(self, checkpoint=""):
+        self.lock = threading.Lock()
+        self.checkpoint = checkpoint
+        self.window = None
+        self.synced_at = None
+        self.resynced_at = 0
+        self.checkpoint_pending = False
+        self.checkpointed_at = 0
+
+    def new_window(self):
+        return FraudWindow(FRAUD_CONFIG["min_claims"], FRAUD_CONFIG["min_amount"])
+
+    # Read the claims past the window's watermark, expire the ones that fell out of it
+    # and look up the names of newly flagged clients
+    def advance(self, engine, window):
+        with db_connection(engine) as conn:
+            cutoff = conn.execute(text("SELECT LOCALTIMESTAMP - INTERVAL '3 MONTH'")).scalar()
+            claims = conn.execute(FRAUD_CLAIMS_QUERY, {"after": window.watermark, "cutoff": cutoff}).fetchall()
+            with self.lock:
+                for claim_id, client_id, created, amount, rejected in claims:
+                    window.add(claim_id, client_id, created, amount, rejected)
+                expired = window.expire(cutoff)
+                unnamed = [client_id for client_id in window.flagged if client_id not in window.names]
+            if unnamed:
+                names = conn.execute(text("""
+                    SELECT ClientID, CONCAT(FirstName, ' ', COALESCE(MiddleName, ''), ' ', LastName)
+                    FROM Client
+                    WHERE ClientID = ANY(:clients)
+                """), {"clients": unnamed}).fetchall()
+                with self.lock:
+                    window.names.update(names)
+                    window.result = None
+        return len(claims), expired
+
+    # Rebuild the window from scratch every resync interval, and after the change feed reports updated or
+    # deleted claims, so changed statuses and claims inserted below the watermark are picked up; advance it
+    # in between
+    def sync(self, engine):
+        started = time.perf_counter()
+        if self.window is None or time.time() - self.resynced_at >= FRAUD_CONFIG["resync_interval"]:
+            window = self.new_window()
+            added, expired = self.advance(engine, window)
+            with self.lock:
+                self.window = window
+            self.resynced_at = time.time()
+        else:
+            added, expired = self.advance(engine, self.window)
+        self.synced_at = datetime.now(timezone.utc)
+        # A checkpoint only saves the restart from re-reading claims, so it is written at most once
+        # per checkpoint interval rather than after every change
+        if self.checkpoint and (added or expired):
+            self.checkpoint_pending = True
+        if self.checkpoint_pending and time.time() - self.checkpointed_at >= FRAUD_CONFIG["checkpoint_interval"]:
+            self.save_checkpoint()
+        logger.debug(
+            "Fraud detector read %d claims and expired %d in %.2fs",
+            added, expired, time.perf_counter() - started
+        )
+
+    # Saved as JSON, which unlike a pickle cannot run code when a shared checkpoint file is loaded
+    def save_checkpoint(self):
+        with self.lock:
+            state = {"synced_at": self.synced_at.isoformat(), "window": self.window.state()}
+        try:
+            write_atomically(self.checkpoint, json.dumps(state))
+        except OSError:
+            logger.warning("Writing fraud detector checkpoint %s failed", self.checkpoint, exc_info=True)
+            return
+        self.checkpoint_pending = False
+        self.checkpointed_at = time.time()
+
+    # Resume from the checkpoint; the next sync only reads the claims created since it was written
+    def load_checkpoint(self):
+        if not self.checkpoint or not os.path.exists(self.checkpoint):
+            return False
+        try:
+            with open(self.checkpoint) as checkpoint_file:
+                saved = json.load(checkpoint_file)
+            self.window = FraudWindow.from_state(
+                saved["window"], FRAUD_CONFIG["min_claims"], FRAUD_CONFIG["min_amount"]
+            )
+        except Exception:
+            logger.exception("Ignoring unreadable fraud detector checkpoint %s", self.checkpoint)
+            return False
+        self.synced_at = datetime.fromisoformat(saved["synced_at"])
+        self.checkpointed_at = time.time()
+        self.resynced_at = time.time()
+        return True
+
+    def loaded(self):
+        with self.lock:
+            return self.window is not None
+
+    # Flagged clients, or None until the window has been loaded
+    def flagged(self):
+        with self.lock:
+            if self.window is None:
+                return None
+            return self.window.frame()
+
+def fraud_detector_loop(detector, engine, wake, rewrite):
+    while True:
+        # The watermark only finds new claims, so updated or deleted claims need the window rebuilt
+        if rewrite.is_set():
+            rewrite.clear()
+            detector.resynced_at = 0
+        try:
+            detector.sync(engine)
+        except Exception:
+            logger.exception("Fraud detector update failed")
+        wake.wait(FRAUD_CONFIG["poll_interval"])
+        wake.clear()
+
+# Function to show how far the fraud detector has read
+def display_fraud_detector_status(detector):
+    age = int((datetime.now(timezone.utc) - detector.synced_at).total_seconds())
+    st.caption(
+        f"Claims processed up to {detector.synced_at.astimezone():%Y-%m-%d %H:%M:%S} "
+        f"({age // 60}m {age % 60}s ago)"
+    )
+
+# Start the fraud detector once per process
+@st.cache_resource
+def start_fraud_detector(_engine):
+    if FRAUD_CONFIG["poll_interval"] <= 0 or DATA_CONFIG["source"] == "snapshot":
+        return None
+    detector = FraudDetector(FRAUD_CONFIG["checkpoint"])
+    detector.load_checkpoint()
+    wake, rewrite = threading.Event(), threading.Event()
+    get_change_listener().subscribe(["RequestClaim", "Client"], wake, rewrite)
+    threading.Thread(
+        target=fraud_detector_loop, args=(detector, _engine, wake, rewrite), name="fraud-detector", daemon=True
+    ).start()
+    return detector
+
+# Per-client risk features behind the High-Risk Clients view. Triggers queue the clients each change
+# touched and client_risk_features is re-aggregated for those clients only; every dashboard process
+# mirrors the table into NumPy arrays, so moving a threshold slider filters in memory. A poll interval
+# of 0 disables the store and the view runs the high_risk_clients query for each threshold instead.
+RISK_CONFIG = {
+    "poll_interval": env_setting("RISK_POLL_INTERVAL", 30, int),
+    "resync_interval": env_setting("RISK_RESYNC_INTERVAL", 3600, int)
+}
+
+# Thresholds of the original High-Risk Clients query: more than 10 distinct ICD codes, more than
+# 100000 in approved or pending claims and at least one dependent
+RISK_DEFAULTS = {
+    "min_icd_codes": 10, "min_claim_amount": 100000, "min_dependents": 0, "statuses": ("Approved", "Pending")
+}
+
+CLAIM_STATUSES = ["Approved", "Pending", "Rejected"]
+
+# The clients a change to each source table affects, selected from a trigger transition table
+RISK_SOURCES = {
+    "Client": "SELECT ClientID FROM {rows}",
+    "MedicalRecords": "SELECT ClientID FROM {rows}",
+    "RequestClaim": "SELECT ClientID FROM {rows}",
+    "ClientDependent": "SELECT ClientID FROM {rows}"
+}
+
+# Array type of each feature in the in-memory store. Claim amounts are held in cents, so summing the
+# selected statuses and comparing against a threshold is exact integer arithmetic.
+RISK_FEATURES = {
+    "icd_codes": np.int32, "medical_records": np.int32, "claims": np.int32, "dependents": np.int32,
+    "approved_cents": np.int64, "pending_cents": np.int64, "rejected_cents": np.int64
+}
+
+# Orderings offered by the High-Risk Clients view, by the feature they sort on (descending)
+RISK_SORTS = {
+    "Claim amount": "claim_cents",
+    "Distinct ICD codes": "icd_codes",
+    "Dependents": "dependents",
+    "Medical records": "medical_records",
+    "Claims": "claims"
+}
+
+# One row per client: distinct ICD codes and records, claims with their amounts by status, and
+# dependents. With clients given, only those clients are aggregated.
+def risk_features_query(clients):
+    client_filter = "WHERE ClientID = ANY(CAST(:clients AS INT[]))" if clients is not None else ""
+    return f"""
+        SELECT c.ClientID AS clientid,
+               CONCAT(c.FirstName, ' ', COALESCE(c.MiddleName, ''), ' ', c.LastName) AS clientname,
+               COALESCE(mr.icd_codes, 0) AS icd_codes,
+               COALESCE(mr.medical_records, 0) AS medical_records,
+               COALESCE(rc.claims, 0) AS claims,
+               COALESCE(rc.approved_amount, 0) AS approved_amount,
+               COALESCE(rc.pending_amount, 0) AS pending_amount,
+               COALESCE(rc.rejected_amount, 0) AS rejected_amount,
+               COALESCE(dep.dependents, 0) AS dependents
+        FROM Client c
+        LEFT JOIN (
+            SELECT ClientID, COUNT(DISTINCT ICDCode) AS icd_codes, COUNT(*) AS medical_records
+            FROM MedicalRecords {client_filter}
+            GROUP BY ClientID
+        ) mr ON mr.ClientID = c.ClientID
+        LEFT JOIN (
+            SELECT ClientID, COUNT(*) AS claims,
+                   SUM(CASE WHEN ApprovalStatus = 'Approved' THEN Amount ELSE 0 END) AS approved_amount,
+                   SUM(CASE WHEN ApprovalStatus = 'Pending' THEN Amount ELSE 0 END) AS pending_amount,
+                   SUM(CASE WHEN ApprovalStatus = 'Rejected' THEN Amount ELSE 0 END) AS rejected_amount
+            FROM RequestClaim {client_filter}
+            GROUP BY ClientID
+        ) rc ON rc.ClientID = c.ClientID
+        LEFT JOIN (
+            SELECT ClientID, COUNT(*) AS dependents
+            FROM ClientDependent {client_filter}
+            GROUP BY ClientID
+        ) dep ON dep.ClientID = c.ClientID
+        {client_filter.replace("ClientID", "c.ClientID")}
+    """
+
+# Rows are only rewritten when a feature changed. updated_at is the clock time after the feature lock
+# was taken, so it grows in commit order and stores can read past the newest value they have seen.
+# Clients that no longer exist are removed; stores drop them at their next full resync.
+def upsert_risk_features(conn, clients):
+    params = {"clients": clients} if clients is not None else {}
+    conn.execute(text(f"""
+        INSERT INTO client_risk_features (
+            clientid, clientname, icd_codes, medical_records, claims, approved_amount, pending_amount,
+            rejected_amount, dependents, updated_at
+        )
+        SELECT *, clock_timestamp() FROM ({risk_features_query(clients)}) features
+        ON CONFLICT (clientid) DO UPDATE
+        SET clientname = EXCLUDED.clientname, icd_codes = EXCLUDED.icd_codes,
+            medical_records = EXCLUDED.medical_records, claims = EXCLUDED.claims,
+            approved_amount = EXCLUDED.approved_amount, pending_amount = EXCLUDED.pending_amount,
+            rejected_amount = EXCLUDED.rejected_amount, dependents = EXCLUDED.dependents,
+            updated_at = EXCLUDED.updated_at
+        WHERE (
+            client_risk_features.clientname, client_risk_features.icd_codes, client_risk_features.medical_records,
+            client_risk_features.claims, client_risk_features.approved_amount, client_risk_features.pending_amount,
+            client_risk_features.rejected_amount, client_risk_features.dependents
+        ) IS DISTINCT FROM (
+            EXCLUDED.clientname, EXCLUDED.icd_codes, EXCLUDED.medical_records, EXCLUDED.claims,
+            EXCLUDED.approved_amount, EXCLUDED.pending_amount, EXCLUDED.rejected_amount, EXCLUDED.dependents
+        )
+    """), params)
+    if clients is not None:
+        conn.execute(text("""
+            DELETE FROM client_risk_features f
+            WHERE f.clientid = ANY(CAST(:clients AS INT[]))
+              AND NOT EXISTS (SELECT 1 FROM Client c WHERE c.ClientID = f.clientid)
+        """), params)
+
+# Create the feature table, its queue of changed clients and the source table triggers if they are
+# missing, rebuilding the table when triggers had to be created, as ensure_finance_ledger does
+def ensure_risk_features(engine):
+    with engine.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('procare_risk_features'))"))
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS client_risk_features (
+                clientid INT PRIMARY KEY,
+                clientname TEXT NOT NULL,
+                icd_codes INT NOT NULL,
+                medical_records INT NOT NULL,
+                claims INT NOT NULL,
+                approved_amount NUMERIC NOT NULL,
+                pending_amount NUMERIC NOT NULL,
+                rejected_amount NUMERIC NOT NULL,
+                dependents INT NOT NULL,
+                updated_at TIMESTAMPTZ NOT NULL
+            )
+        """))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS client_risk_features_updated_at ON client_risk_features (updated_at)"
+        ))
+        conn.execute(text("CREATE TABLE IF NOT EXISTS risk_features_dirty (clientid INT PRIMARY KEY)"))
+        rebuild = ensure_change_triggers(conn, "risk_features", "risk_features_dirty", "clientid", RISK_SOURCES)
+        ensure_change_notifications(conn, ["client_risk_features"])
+        if rebuild or not conn.execute(text("SELECT EXISTS (SELECT 1 FROM client_risk_features)")).scalar():
+            started = time.perf_counter()
+            conn.execute(text("TRUNCATE client_risk_features, risk_features_dirty"))
+            upsert_risk_features(conn, None)
+            record_mv_refresh(conn, "client_risk_features", time.perf_counter() - started)
+
+# Re-aggregate the queued clients. Returns the number of clients re-aggregated.
+def update_risk_features(engine):
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        if not conn.execute(text("SELECT pg_try_advisory_xact_lock(hashtext('procare_risk_features'))")).scalar():
+            return 0
+        clients = conn.execute(text("DELETE FROM risk_features_dirty RETURNING clientid")).scalars().all()
+        if clients:
+            upsert_risk_features(conn, clients)
+            record_mv_refresh(conn, "client_risk_features", time.perf_counter() - started)
+    if clients:
+        get_report_cache().invalidate("high_risk_clients")
+    return len(clients)
+
+# Clients over every threshold, ordered by the chosen feature (descending, then by client id), with
+# the columns of the high_risk_clients query. features maps clientid, clientname and every
+# RISK_FEATURES name to an array with one entry per client.
+def select_risk_clients(features, min_icd_codes, min_claim_amount, min_dependents, statuses, sort_by="Claim amount"):
+    claim_cents = np.zeros(len(features["clientid"]), dtype=np.int64)
+    for status in statuses:
+        claim_cents += features[f"{status.lower()}_cents"]
+    mask = (
+        (features["icd_codes"] > min_icd_codes)
+        & (claim_cents > int(round(min_claim_amount * 100)))
+        & (features["dependents"] > min_dependents)
+    )
+    selected = np.flatnonzero(mask)
+    key = claim_cents if RISK_SORTS[sort_by] == "claim_cents" else features[RISK_SORTS[sort_by]]
+    # lexsort sorts by its last key first; negate in int64 so int32 counts cannot overflow
+    order = selected[np.lexsort((features["clientid"][selected], -key[selected].astype(np.int64)))]
+    return pd.DataFrame({
+        "clientid": features["clientid"][order],
+        "clientname": features["clientname"][order],
+        "medicalrecordcount": features["icd_codes"][order].astype(np.int64),
+        "totalclaimamount": claim_cents[order] / 100,
+        "numberofdependents": features["dependents"][order].astype(np.int64)
+    })
+
+# Feature arrays sorted by client id, from client_risk_features rows read in cents or from its
+# snapshot export, whose amounts are in currency units
+def risk_feature_arrays(data):
+    data = data.sort_values("clientid")
+    features = {
+        "clientid": data["clientid"].to_numpy(dtype=np.int64),
+        "clientname": data["clientname"].to_numpy(dtype=object)
+    }
+    for name, dtype in RISK_FEATURES.items():
+        if name not in data:
+            amounts = data[name.replace("_cents", "_amount")].to_numpy(dtype=np.float64)
+            features[name] = np.rint(amounts * 100).astype(dtype)
+        else:
+            features[name] = data[name].to_numpy(dtype=dtype)
+    return features
+
+# In-process copy of client_risk_features as one array per feature, sorted by client id. A sync
+# reads only the rows updated since the newest one it has, and merges them into new arrays that
+# replace the old ones under the lock, so a filter running meanwhile keeps a consistent set.
+class RiskFeatureStore:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.features = None
+        self.watermark = None
+        self.synced_at = None
+        self.resynced_at = 0
+
+    # Writers hold the feature lock until they commit, so waiting on it in shared mode means every
+    # update up to the newest updated_at read here is visible
+    def read(self, engine, after):
+        with db_connection(engine) as conn:
+            conn.execute(text("SELECT pg_advisory_xact_lock_shared(hashtext('procare_risk_features'))"))
+            result = conn.execute(text("""
+                SELECT clientid, clientname, icd_codes, medical_records, claims, dependents,
+                       CAST(ROUND(approved_amount * 100) AS BIGINT) AS approved_cents,
+                       CAST(ROUND(pending_amount * 100) AS BIGINT) AS pending_cents,
+                       CAST(ROUND(rejected_amount * 100) AS BIGINT) AS rejected_cents, updated_at
+                FROM client_risk_features
+                WHERE CAST(:after AS TIMESTAMPTZ) IS NULL OR updated_at > CAST(:after AS TIMESTAMPTZ)
+            """), {"after": after})
+            return pd.DataFrame.from_records(result.fetchall(), columns=list(result.keys()), coerce_float=True)
+
+    def sync(self, engine):
+        started = time.perf_counter()
+        resync = self.features is None or time.time() - self.resynced_at >= RISK_CONFIG["resync_interval"]
+        changed = self.read(engine, None if resync else self.watermark)
+        if resync or not changed.empty:
+            arrays = risk_feature_arrays(changed)
+            with self.lock:
+                self.features = arrays if resync else merge_risk_features(self.features, arrays)
+                if not changed.empty:
+                    self.watermark = changed["updated_at"].max().to_pydatetime()
+        if resync:
+            self.resynced_at = time.time()
+        self.synced_at = datetime.now(timezone.utc)
+        logger.debug("Risk feature store read %d clients in %.2fs", len(changed), time.perf_counter() - started)
+
+    def size(self):
+        with self.lock:
+            return 0 if self.features is None else len(self.features["clientid"])
+
+    def select(self, min_icd_codes, min_claim_amount, min_dependents, statuses, sort_by):
+        with self.lock:
+            features = self.features
+        if features is None:
+            return None
+        return select_risk_clients(features, min_icd_codes, min_claim_amount, min_dependents, statuses, sort_by)
+
+    # Largest ICD code count, dependent count and claim total (in whole currency units) of any client
+    def maxima(self):
+        with self.lock:
+            features = self.features
+        if features is None or not len(features["clientid"]):
+            return None
+        claim_cents = features["approved_cents"] + features["pending_cents"] + features["rejected_cents"]
+        return {
+            "icd_codes": int(features["icd_codes"].max()), "dependents": int(features["dependents"].max()),
+            "claim_amount": int(claim_cents.max() // 100) + 1
+        }
+
+# Replace the rows of clients already in the arrays and insert the new ones, keeping client id order
+def merge_risk_features(features, changed):
+    positions = np.searchsorted(features["clientid"], changed["clientid"])
+    existing = positions < len(features["clientid"])
+    existing[existing] = features["clientid"][positions[existing]] == changed["clientid"][existing]
+    merged = {name: values.copy() for name, values in features.items()}
+    for name, values in changed.items():
+        merged[name][positions[existing]] = values[existing]
+    if not existing.all():
+        added = ~existing
+        merged = {name: np.concatenate([values, changed[name][added]]) for name, values in merged.items()}
+        order = np.argsort(merged["clientid"], kind="stable")
+        merged = {name: values[order] for name, values in merged.items()}
+    return merged
+
+def risk_feature_loop(store, engine, wake):
+    while True:
+        wake.wait(RISK_CONFIG["poll_interval"])
+        wake.clear()
+        try:
+            update_risk_features(engine)
+            store.sync(engine)
+        except Exception:
+            logger.exception("Risk feature store update failed")
+
+# Function to show how current the risk feature store is
+def display_risk_store_status(store, shown, seconds):
+    age = int((datetime.now(timezone.utc) - store.synced_at).total_seconds())
+    st.caption(
+        f"{shown} of {store.size()} clients, filtered in memory in {seconds * 1000:.1f}ms; "
+        f"features synced {store.synced_at.astimezone():%Y-%m-%d %H:%M:%S} ({age // 60}m {age % 60}s ago)"
+    )
+
+# Function to show the threshold sliders, ranging up to the largest value any client has
+def risk_threshold_inputs(maxima):
+    maxima = maxima or {"icd_codes": 50, "dependents": 10, "claim_amount": 1000000}
+    columns = st.columns(3)
+    min_icd_codes = columns[0].slider(
+        "More distinct ICD codes than", 0, max(maxima["icd_codes"], RISK_DEFAULTS["min_icd_codes"]),
+        RISK_DEFAULTS["min_icd_codes"]
+    )
+    min_claim_amount = columns[1].slider(
+        "Claims totalling more than", 0, max(maxima["claim_amount"], RISK_DEFAULTS["min_claim_amount"]),
+        RISK_DEFAULTS["min_claim_amount"], step=1000
+    )
+    min_dependents = columns[2].slider(
+        "More dependents than", 0, max(maxima["dependents"], RISK_DEFAULTS["min_dependents"] + 1),
+        RISK_DEFAULTS["min_dependents"]
+    )
+    statuses = st.multiselect("Claim statuses counted", CLAIM_STATUSES, default=list(RISK_DEFAULTS["statuses"]))
+    return {
+        "min_icd_codes": min_icd_codes, "min_claim_amount": min_claim_amount, "min_dependents": min_dependents,
+        "statuses": tuple(statuses)
+    }
+
+# Build the feature table if needed, load it and keep it current, once per process
+@st.cache_resource
+def start_risk_store(_engine):
+    if RISK_CONFIG["poll_interval"] <= 0 or DATA_CONFIG["source"] == "snapshot":
+        return None
+    ensure_risk_features(_engine)
+    update_risk_features(_engine)
+    store = RiskFeatureStore()
+    store.sync(_engine)
+    wake = threading.Event()
+    # Woken by a write to a source table, and by another process folding one into the feature table
+    get_change_listener().subscribe([*RISK_SOURCES, "client_risk_features"], wake)
+    threading.Thread(
+        target=risk_feature_loop, args=(store, _engine, wake), name="risk-features", daemon=True
+    ).start()
+    return store
+
 # Define SQL queries as functions
+@cached_report
 def top_5_monthly_services(engine):
     query = """
-        SELECT * FROM top5monthlyservicesummary
+        SELECT * FROM mv_top5monthlyservicesummary
+        ORDER BY ServicePeriod, TotalGenerated DESC, HealthcareProviderID, ServiceName
     """
-    return pd.read_sql(query, engine)
+    return run_query(engine, query, dtypes=REPORT_DTYPES["top_5_monthly_services"])
 
-def client_spending_by_hcp(engine):
-    query = """
-        SELECT 
-            H.HealthcareProviderID, 
-            H.ProviderName AS HealthcareProviderName, 
-            C.ClientID, 
-            CONCAT(C.FirstName, ' ', COALESCE(C.MiddleName, ''), ' ', C.LastName) AS ClientFullName, 
-            SUM(P.ServiceCost) AS TotalSpending
-        FROM Provide P 
-        JOIN Client C ON P.ClientID = C.ClientID 
-        JOIN EmployDoctor ED ON P.DoctorID = ED.DoctorID 
-        JOIN HealthcareProvider H ON ED.HealthcareProviderID = H.HealthcareProviderID 
-        GROUP BY H.HealthcareProviderID, H.ProviderName, C.ClientID, C.FirstName, C.MiddleName, C.LastName 
+@cached_report
+def client_spending_by_hcp(engine, client_id=None):
+    where, params = apply_filters([("ClientID = :client_id", "client_id", client_id)])
+    query = f"""
+        SELECT HealthcareProviderID, HealthcareProviderName, ClientID, ClientFullName, TotalSpending
+        FROM mv_client_spending_by_hcp
+        {where}
         ORDER BY TotalSpending DESC;
     """
-    return pd.read_sql(query, engine)
+    return run_query(engine, query, params, REPORT_DTYPES["client_spending"])
 
-def fraud_claims(engine):
+# One page of client spending, ordered by (TotalSpending, ClientID) descending.
+# "after" is the (TotalSpending, ClientID, HealthcareProviderID) key of the previous page's last row;
+# the provider id breaks ties between the rows of a client with the same total at several providers.
+@cached_report
+def client_spending_page(engine, after=None, page_size=50):
+    if after is None:
+        query = """
+            SELECT HealthcareProviderID, HealthcareProviderName, ClientID, ClientFullName, TotalSpending
+            FROM mv_client_spending_by_hcp
+            ORDER BY TotalSpending DESC, ClientID DESC, HealthcareProviderID DESC
+            LIMIT :page_size;
+        """
+        return run_query(engine, query, {"page_size": page_size}, REPORT_DTYPES["client_spending"])
     query = """
-        SELECT 
-            rc.ClientID,
-            CONCAT(c.FirstName, ' ', COALESCE(c.MiddleName, ''), ' ', c.LastName) AS ClientName,
-            COUNT(*) AS TotalClaims,
-            SUM(rc.Amount) AS TotalAmount,
-            ROUND(SUM(CASE WHEN rc.ApprovalStatus = 'Rejected' THEN 1 ELSE 0 END) * 100.0 / COUNT(*), 2) AS RejectionRate
-        FROM RequestClaim rc
-        JOIN Client c ON rc.ClientID = c.ClientID
-        WHERE rc.DateCreated >= NOW() - INTERVAL '3 MONTH'
-        GROUP BY rc.ClientID, c.FirstName, c.MiddleName, c.LastName
-        HAVING COUNT(*) > 10 AND SUM(rc.Amount) > 100000 
-        ORDER BY TotalClaims DESC;
+        SELECT HealthcareProviderID, HealthcareProviderName, ClientID, ClientFullName, TotalSpending
+        FROM mv_client_spending_by_hcp
+        WHERE (TotalSpending, ClientID, HealthcareProviderID) < (CAST(:spending AS NUMERIC), :client_id, :provider_id)
+        ORDER BY TotalSpending DESC, ClientID DESC, HealthcareProviderID DESC
+        LIMIT :page_size;
     """
-    data = pd.read_sql(query, engine)
+    spending, client_id, provider_id = after
+    return run_query(engine, query, {
+        "spending": spending, "client_id": client_id, "provider_id": provider_id, "page_size": page_size
+    }, REPORT_DTYPES["client_spending"])
 
-    # Debugging output: Check if the dataset is empty
-    if data.empty:
-        print("Debug: Fraud Claims query returned no data.")
+# Clients whose ID matches the search term exactly, or whose name contains it
+@cached_report
+def client_search(engine, term):
+    if term.isdigit():
+        where, params = "WHERE ClientID = :client_id", {"client_id": int(term)}
     else:
-        print(f"Debug: Retrieved {len(data)} rows from Fraud Claims query.")
+        where, params = "WHERE CONCAT(FirstName, ' ', COALESCE(MiddleName, ''), ' ', LastName) ILIKE :pattern", {"pattern": f"%{term}%"}
+    query = f"""
+        SELECT ClientID, CONCAT(FirstName, ' ', COALESCE(MiddleName, ''), ' ', LastName) AS ClientFullName
+        FROM Client
+        {where}
+        ORDER BY ClientID
+        LIMIT 50;
+    """
+    return run_query(engine, query, params, REPORT_DTYPES["client_search"])
 
-    return data
+@cached_report
+def client_spending_count(engine):
+    query = """
+        SELECT COUNT(*) AS total FROM mv_client_spending_by_hcp;
+    """
+    return run_query(engine, query, dtypes=REPORT_DTYPES["client_spending_count"])
 
-def high_risk_clients(engine):
+@cached_report
+def fraud_claims(engine):
+    # Aggregate the recent claims first, so only flagged clients are looked up in Client
     query = """
+        WITH RecentClaims AS (
+            SELECT 
+                rc.ClientID,
+                COUNT(*) AS TotalClaims,
+                SUM(rc.Amount) AS TotalAmount,
+                ROUND(SUM(CASE WHEN rc.ApprovalStatus = 'Rejected' THEN 1 ELSE 0 END) * 100.0 / COUNT(*), 2) AS RejectionRate
+            FROM RequestClaim rc
+            WHERE rc.DateCreated >= NOW() - INTERVAL '3 MONTH'
+            GROUP BY rc.ClientID
+            HAVING COUNT(*) > 10 AND SUM(rc.Amount) > 100000
+        )
+        SELECT 
+            f.ClientID,
+            CONCAT(c.FirstName, ' ', COALESCE(c.MiddleName, ''), ' ', c.LastName) AS ClientName,
+            f.TotalClaims,
+            f.TotalAmount,
+            f.RejectionRate
+        FROM RecentClaims f
+        JOIN Client c ON f.ClientID = c.ClientID
+        ORDER BY f.TotalClaims DESC;
+    """
+    return run_query(engine, query, dtypes=REPORT_DTYPES["fraud_claims"])
+
+# Clients over every threshold; the High-Risk Clients view asks the feature store first and runs this
+# query only when the store is disabled
+@cached_report
+def high_risk_clients(
+    engine, min_icd_codes=10, min_claim_amount=100000, min_dependents=0, statuses=("Approved", "Pending")
+):
+    # Statuses are written into the statement, so the default pair can use the partial claims index
+    statuses = ", ".join(f"'{status}'" for status in CLAIM_STATUSES if status in statuses) or "NULL"
+    query = f"""
         WITH AggregatedMedicalRecords AS (
             SELECT ClientID, 
                 COUNT(DISTINCT ICDCode) AS MedicalRecordCount
@@ -138,12 +2562,9 @@ def high_risk_clients(engine):
             GROUP BY ClientID
         ),
         AggregatedRequestClaims AS (
-            SELECT ClientID, 
-                SUM(CASE 
-                    WHEN ApprovalStatus IN ('Approved', 'Pending') THEN Amount 
-                    ELSE 0 
-                END) AS TotalClaimAmount
+            SELECT ClientID, SUM(Amount) AS TotalClaimAmount
             FROM RequestClaim
+            WHERE ApprovalStatus IN ({statuses})
             GROUP BY ClientID
         ),
         AggregatedDependents AS (
@@ -160,39 +2581,63 @@ def high_risk_clients(engine):
         LEFT JOIN AggregatedMedicalRecords mr ON c.ClientID = mr.ClientID
         LEFT JOIN AggregatedRequestClaims rc ON c.ClientID = rc.ClientID
         LEFT JOIN AggregatedDependents dep ON c.ClientID = dep.ClientID
-        WHERE COALESCE(mr.MedicalRecordCount, 0) > 10 
-            AND COALESCE(rc.TotalClaimAmount, 0) > 100000
-            AND COALESCE(dep.NumberOfDependents, 0) > 0
-        ORDER BY rc.TotalClaimAmount DESC;
+        WHERE COALESCE(mr.MedicalRecordCount, 0) > :min_icd_codes
+            AND COALESCE(rc.TotalClaimAmount, 0) > :min_claim_amount
+            AND COALESCE(dep.NumberOfDependents, 0) > :min_dependents
+        ORDER BY rc.TotalClaimAmount DESC, c.ClientID;
     """
-    return pd.read_sql(query, engine)
+    params = {"min_icd_codes": min_icd_codes, "min_claim_amount": min_claim_amount, "min_dependents": min_dependents}
+    return run_query(engine, query, params, REPORT_DTYPES["high_risk_clients"])
 
-def insurance_plan_distribution(engine):
+# Every client's risk features, exported by batch runs so snapshot mode can filter them like the store
+@cached_report
+def risk_features(engine):
     query = """
-        SELECT 
-            H.HealthcareProviderID,
-            H.ProviderName AS HealthcareProviderName,
-            IP.CoverageLevel AS InsurancePlanLevel,
-            COUNT(DISTINCT C.ClientID) AS ClientCount
-        FROM Provide P
-        JOIN Client C ON P.ClientID = C.ClientID
-        JOIN Sell S ON C.ClientID = S.ClientID
-        JOIN Policy L ON S.PolicyNumber = L.PolicyNumber
-        JOIN InsurancePlan IP ON L.InsurancePlanName = IP.InsurancePlanName
-        JOIN EmployDoctor ED ON P.DoctorID = ED.DoctorID
-        JOIN HealthcareProvider H ON ED.HealthcareProviderID = H.HealthcareProviderID
-        GROUP BY H.HealthcareProviderID, H.ProviderName, IP.CoverageLevel
-        ORDER BY H.HealthcareProviderID, IP.CoverageLevel;
+        SELECT clientid, clientname, icd_codes, medical_records, claims, approved_amount, pending_amount,
+               rejected_amount, dependents
+        FROM client_risk_features
+        ORDER BY clientid;
     """
-    data = pd.read_sql(query, engine)
-    if data.empty:
-        print("Debug: Insurance Plan Distribution query returned no data.")
-    else:
-        print(f"Debug: Retrieved {len(data)} rows from Insurance Plan Distribution query.")
-    return data
+    return run_query(engine, query, dtypes=REPORT_DTYPES["risk_features"])
+
+@cached_report
+def insurance_plan_distribution(engine, provider_id=None):
+    where, params = apply_filters([("HealthcareProviderID = :provider_id", "provider_id", provider_id)])
+    query = f"""
+        SELECT HealthcareProviderID, HealthcareProviderName, InsurancePlanLevel, ClientCount
+        FROM mv_insurance_plan_distribution
+        {where}
+        ORDER BY HealthcareProviderID, InsurancePlanLevel;
+    """
+    return run_query(engine, query, params, REPORT_DTYPES["insurance_plan_distribution"])
+
+@cached_report
+def healthcare_providers(engine):
+    query = """
+        SELECT HealthcareProviderID, ProviderName AS HealthcareProviderName
+        FROM HealthcareProvider
+        ORDER BY ProviderName;
+    """
+    return run_query(engine, query, dtypes=REPORT_DTYPES["healthcare_providers"])
 
-def revenue_contribution_by_agent(engine):
+@cached_report
+def policy_start_years(engine):
     query = """
+        SELECT DISTINCT EXTRACT(YEAR FROM StartDate)::INT AS Year
+        FROM Policy
+        ORDER BY Year;
+    """
+    return run_query(engine, query, dtypes=REPORT_DTYPES["policy_start_years"])
+
+# Optionally limited to policies starting in one year and/or within a date range
+@cached_report
+def revenue_contribution_by_agent(engine, year=None, start_date=None, end_date=None):
+    where, params = apply_filters([
+        ("p.StartDate >= make_date(:year, 1, 1) AND p.StartDate < make_date(:year + 1, 1, 1)", "year", year),
+        ("p.StartDate >= :start_date", "start_date", start_date),
+        ("p.StartDate <= :end_date", "end_date", end_date)
+    ])
+    query = f"""
         SELECT 
             s.AgentID,
             a.AgentName,
@@ -204,140 +2649,189 @@ def revenue_contribution_by_agent(engine):
         FROM Sell s
         JOIN Policy p ON s.PolicyNumber = p.PolicyNumber
         JOIN Agent a ON s.AgentID = a.AgentID
+        {where}
         GROUP BY s.AgentID, a.AgentName, EXTRACT(YEAR FROM p.StartDate)
         ORDER BY TotalRevenue DESC;
     """
-    return pd.read_sql(query, engine)
+    return run_query(engine, query, params, REPORT_DTYPES["revenue_contribution_by_agent"])
+
+# Coverage levels a BIGINT bit mask holds; with more, medical_conditions_insights keeps arrays of level ids
+COVERAGE_MASK_LEVELS = 63
 
+@cached_report
 def medical_conditions_insights(engine):
-    query = """
+    # Built from deduplicated client -> condition, client -> service and client -> coverage relations, so
+    # a client's records, services and policies never multiply each other. Coverage levels are kept as a
+    # bit mask per client, or a sorted array of level ids when they do not fit one, and only expanded once
+    # the clients are counted, and ConditionCount and ClientsServed count distinct clients.
+    with db_connection(engine) as conn:
+        levels = conn.execute(text("SELECT COUNT(DISTINCT CoverageLevel) FROM InsurancePlan")).scalar()
+    if levels <= COVERAGE_MASK_LEVELS:
+        level_id = "CAST(1 AS BIGINT) << CAST(ROW_NUMBER() OVER (ORDER BY Levels.CoverageLevel) - 1 AS INT)"
+        coverage = "BIT_OR(cl.LevelID)"
+        covered = "s.Coverage & cl.LevelID <> 0"
+    else:
+        level_id = "ROW_NUMBER() OVER (ORDER BY Levels.CoverageLevel)"
+        coverage = "ARRAY_AGG(DISTINCT cl.LevelID ORDER BY cl.LevelID)"
+        covered = "cl.LevelID = ANY(s.Coverage)"
+    query = f"""
         WITH ConditionFrequency AS (
-            SELECT mr.ConditionName, COUNT(mr.ClientID) AS ConditionCount
+            SELECT mr.ConditionName, COUNT(DISTINCT mr.ClientID) AS ConditionCount
             FROM MedicalRecords mr
-            GROUP BY mr.ConditionName
-            ORDER BY ConditionCount DESC
-            LIMIT 10
-        ),
-        ServicesForConditions AS (
-            SELECT 
-                cf.ConditionName,
-                cf.ConditionCount,
-                ms.ServiceName,
-                ip.CoverageLevel,
-                COUNT(DISTINCT pr.ClientID) AS ClientsServed
-            FROM ConditionFrequency cf
-            JOIN MedicalRecords mr ON cf.ConditionName = mr.ConditionName
-            JOIN Provide pr ON mr.ClientID = pr.ClientID
-            JOIN MedicalService ms ON pr.ServiceID = ms.ServiceID
-            JOIN Sell sl ON mr.ClientID = sl.ClientID
-            JOIN Policy pl ON sl.PolicyNumber = pl.PolicyNumber
-            JOIN InsurancePlan ip ON pl.InsurancePlanName = ip.InsurancePlanName
-            GROUP BY 
-                cf.ConditionName, 
-                cf.ConditionCount, 
-                ms.ServiceName, 
-                ip.CoverageLevel
-        )
-        SELECT 
-            ConditionName,
-            ConditionCount,
-            ServiceName,
-            CoverageLevel,
-            ClientsServed
-        FROM ServicesForConditions
-        ORDER BY ConditionCount DESC, ConditionName, CoverageLevel, ClientsServed DESC;
-    """
-    return pd.read_sql(query, engine)
-
-def company_profits(engine):
-    query = """
-    WITH RevenueFromPolicies AS (
-        SELECT SUM(p.ExactCost - (a.CommissionRate / 100) * p.ExactCost) AS PoliciesRevenue
-        FROM Policy p
-        JOIN Sell s ON p.PolicyNumber = s.PolicyNumber
-        JOIN Agent a ON s.AgentID = a.AgentID
-        WHERE p.StartDate >= CURRENT_DATE - INTERVAL '1 year'
-    ),
-    RevenueFromPayments AS (
-        SELECT SUM(py.Amount) AS PaymentRevenue
-        FROM Pays py
-        WHERE py.Date >= CURRENT_DATE - INTERVAL '1 year'
-    ),
-    NetRevenue AS (
-        SELECT ROUND(
-            (SELECT PoliciesRevenue FROM RevenueFromPolicies) + 
-            (SELECT PaymentRevenue FROM RevenueFromPayments), 
-            2
-        ) AS TotalRevenue
-    ),
-    TotalEmployeeSalary AS (
-        SELECT SUM(e.Salary * 12) AS TotalEmployeeSalaries
-        FROM Employee e
-    ),
-    TotalClaimAmount AS (
-        SELECT SUM(CASE WHEN rc.ApprovalStatus = 'Approved' THEN rc.Amount ELSE 0 END) AS TotalClaims
-        FROM RequestClaim rc
-        WHERE rc.DateCreated >= CURRENT_DATE - INTERVAL '1 year'
-    ),
-    NetExpenses AS (
-        SELECT ROUND(
-            (SELECT TotalEmployeeSalaries FROM TotalEmployeeSalary) + 
-            (SELECT TotalClaims FROM TotalClaimAmount), 
-            2
-        ) AS TotalExpenses
+            GROUP BY mr.ConditionName
+            ORDER BY ConditionCount DESC, mr.ConditionName
+            LIMIT 10
+        ),
+        Conditions AS (
+            SELECT cf.ConditionName, cf.ConditionCount, ROW_NUMBER() OVER (ORDER BY cf.ConditionCount DESC, cf.ConditionName) AS ConditionID
+            FROM ConditionFrequency cf
+        ),
+        ConditionClients AS (
+            SELECT DISTINCT c.ConditionID, mr.ClientID
+            FROM Conditions c
+            JOIN MedicalRecords mr ON mr.ConditionName = c.ConditionName
+        ),
+        CoverageLevels AS (
+            SELECT Levels.CoverageLevel, {level_id} AS LevelID
+            FROM (SELECT DISTINCT CoverageLevel FROM InsurancePlan) Levels
+        ),
+        Clients AS (
+            SELECT sl.ClientID, {coverage} AS Coverage
+            FROM Sell sl
+            JOIN Policy pl ON sl.PolicyNumber = pl.PolicyNumber
+            JOIN InsurancePlan ip ON pl.InsurancePlanName = ip.InsurancePlanName
+            JOIN CoverageLevels cl ON cl.CoverageLevel = ip.CoverageLevel
+            WHERE sl.ClientID IN (SELECT ClientID FROM ConditionClients)
+            GROUP BY sl.ClientID
+        ),
+        ClientServices AS (
+            SELECT c.ClientID, c.Coverage, s.ServiceName
+            FROM Clients c
+            CROSS JOIN LATERAL (
+                SELECT DISTINCT ms.ServiceName
+                FROM Provide pr
+                JOIN MedicalService ms ON pr.ServiceID = ms.ServiceID
+                WHERE pr.ClientID = c.ClientID
+            ) s
+        ),
+        Served AS (
+            SELECT cc.ConditionID, cs.ServiceName, cs.Coverage, COUNT(*) AS Clients
+            FROM ConditionClients cc
+            JOIN ClientServices cs ON cs.ClientID = cc.ClientID
+            GROUP BY cc.ConditionID, cs.ServiceName, cs.Coverage
+        )
+        SELECT c.ConditionName, c.ConditionCount, s.ServiceName, cl.CoverageLevel, SUM(s.Clients) AS ClientsServed
+        FROM Served s
+        JOIN Conditions c ON c.ConditionID = s.ConditionID
+        JOIN CoverageLevels cl ON {covered}
+        GROUP BY c.ConditionName, c.ConditionCount, s.ServiceName, cl.CoverageLevel
+        ORDER BY ConditionCount DESC, ConditionName, CoverageLevel, ClientsServed DESC;
+    """
+    return run_query(engine, query, dtypes=REPORT_DTYPES["medical_conditions_insights"])
+
+# Revenue, expenses and profit summed from the finance ledger. Without a start date the window is
+# the last year, including future-dated policies, as in the original query over the raw tables.
+@cached_report
+def company_profits(engine, start_date=None, end_date=None):
+    query = """
+    WITH Totals AS (
+        SELECT ROUND(SUM(policy_revenue) + SUM(payment_revenue), 2) AS TotalRevenue,
+               ROUND(SUM(salaries) + SUM(approved_claims), 2) AS TotalExpenses
+        FROM finance_daily_ledger
+        WHERE day >= COALESCE(CAST(:start_date AS DATE), CURRENT_DATE - INTERVAL '1 year')
+          AND (CAST(:end_date AS DATE) IS NULL OR day <= CAST(:end_date AS DATE))
+    )
+    SELECT TotalRevenue, TotalExpenses, ROUND(TotalRevenue - TotalExpenses, 2) AS NetProfit
+    FROM Totals;
+    """
+    return run_query(
+        engine, query, {"start_date": start_date, "end_date": end_date}, dtypes=REPORT_DTYPES["company_profits"]
+    )
+
+# The selected range, the range of the same length just before it and the same dates a year earlier
+def finance_periods(start_date, end_date):
+    length = end_date - start_date + timedelta(days=1)
+    year = pd.DateOffset(years=1)
+    return [
+        ("Selected period", start_date, end_date),
+        ("Previous period", start_date - length, start_date - timedelta(days=1)),
+        ("Same period last year", (pd.Timestamp(start_date) - year).date(), (pd.Timestamp(end_date) - year).date())
+    ]
+
+# The dashboard's default range: the last year up to today
+def default_finance_period():
+    today = datetime.now().date()
+    return {"start_date": (pd.Timestamp(today) - pd.DateOffset(years=1)).date(), "end_date": today}
+
+# Revenue, expenses and profit of each finance period, summed from one ledger row per day
+@cached_report
+def finance_period_comparison(engine, start_date, end_date):
+    periods = finance_periods(start_date, end_date)
+    query = f"""
+    WITH Periods (Position, Period, FirstDay, LastDay) AS (
+        VALUES {", ".join(
+            f"({index}, CAST(:period_{index} AS TEXT), CAST(:first_{index} AS DATE), CAST(:last_{index} AS DATE))"
+            for index in range(len(periods))
+        )}
     ),
-    Profit AS (
-        SELECT ROUND(
-            (SELECT TotalRevenue FROM NetRevenue) - 
-            (SELECT TotalExpenses FROM NetExpenses), 
-            2
-        ) AS NetProfit
+    Totals AS (
+        SELECT p.Position, p.Period, p.FirstDay, p.LastDay,
+               ROUND(COALESCE(SUM(l.policy_revenue + l.payment_revenue), 0), 2) AS Revenue,
+               ROUND(COALESCE(SUM(COALESCE(l.salaries, 0) + l.approved_claims), 0), 2) AS Expenses
+        FROM Periods p
+        LEFT JOIN finance_daily_ledger l ON l.day BETWEEN p.FirstDay AND p.LastDay
+        GROUP BY p.Position, p.Period, p.FirstDay, p.LastDay
     )
-    SELECT 
-        (SELECT TotalRevenue FROM NetRevenue) AS TotalRevenue,
-        (SELECT TotalExpenses FROM NetExpenses) AS TotalExpenses,
-        (SELECT NetProfit FROM Profit) AS NetProfit;
+    SELECT Period, FirstDay, LastDay, Revenue, Expenses, Revenue - Expenses AS NetProfit
+    FROM Totals
+    ORDER BY Position;
+    """
+    params = {}
+    for index, (period, first_day, last_day) in enumerate(periods):
+        params.update({f"period_{index}": period, f"first_{index}": first_day, f"last_{index}": last_day})
+    return run_query(engine, query, params, dtypes=REPORT_DTYPES["finance_period_comparison"])
+
+# Every ledger day, exported by `procare.py batch` so snapshot mode can compare any period
+@cached_report
+def finance_ledger(engine):
+    query = """
+    SELECT day, policy_revenue, payment_revenue, approved_claims, salaries
+    FROM finance_daily_ledger
+    ORDER BY day;
     """
-    return pd.read_sql(query, engine)
+    return run_query(engine, query, dtypes=REPORT_DTYPES["finance_ledger"])
 
+@cached_report
 def unused_providers_analysis(engine):
+    # A provider is in use once any plan covering it has an active, sold policy;
+    # the remaining providers have no active clients, so both counts are zero
     query = """
-        WITH ActivePolicies AS (
-            SELECT s.ClientID, s.PolicyNumber, p.StartDate, p.EndDate, c.InsurancePlanName, c.HealthcareProviderID
-            FROM Sell s
-            INNER JOIN Policy p ON s.PolicyNumber = p.PolicyNumber
-            INNER JOIN Covers c ON p.InsurancePlanName = c.InsurancePlanName
+        WITH ActivePlans AS (
+            SELECT DISTINCT p.InsurancePlanName
+            FROM Policy p
             WHERE p.EndDate >= CURRENT_DATE
+              AND EXISTS (SELECT 1 FROM Sell s WHERE s.PolicyNumber = p.PolicyNumber)
         ),
-        ProviderUsage AS (
-            SELECT ap.ClientID, ap.HealthcareProviderID, h.ProviderName, COUNT(DISTINCT pr.ServiceID) AS ServicesUsed
-            FROM ActivePolicies ap
-            LEFT JOIN Provide pr ON ap.ClientID = pr.ClientID
-            AND pr.DoctorID IN (
-                SELECT DoctorID FROM EmployDoctor WHERE HealthcareProviderID = ap.HealthcareProviderID
-            )
-            LEFT JOIN HealthcareProvider h ON ap.HealthcareProviderID = h.HealthcareProviderID
-            GROUP BY ap.ClientID, ap.HealthcareProviderID, h.ProviderName
-        ),
-        UnusedProviders AS (
-            SELECT DISTINCT h.HealthcareProviderID, h.ProviderName, c.InsurancePlanName
+        ProvidersInUse AS (
+            SELECT DISTINCT c.HealthcareProviderID
             FROM Covers c
-            LEFT JOIN ProviderUsage pu ON c.HealthcareProviderID = pu.HealthcareProviderID
-            LEFT JOIN HealthcareProvider h ON c.HealthcareProviderID = h.HealthcareProviderID
-            WHERE pu.ServicesUsed IS NULL
+            INNER JOIN ActivePlans ap ON c.InsurancePlanName = ap.InsurancePlanName
         )
-        SELECT up.ProviderName AS UnusedProvider,
-               up.InsurancePlanName AS CoveredPlan,
-               COUNT(DISTINCT ap.ClientID) AS ClientsCovered,
-               COUNT(DISTINCT ap.ClientID) AS ClientsUtilizing
-        FROM UnusedProviders up
-        LEFT JOIN ActivePolicies ap ON up.HealthcareProviderID = ap.HealthcareProviderID
-        LEFT JOIN Provide pr ON ap.ClientID = pr.ClientID
-        GROUP BY up.ProviderName, up.InsurancePlanName
+        SELECT h.ProviderName AS UnusedProvider,
+               c.InsurancePlanName AS CoveredPlan,
+               0::BIGINT AS ClientsCovered,
+               0::BIGINT AS ClientsUtilizing
+        FROM Covers c
+        LEFT JOIN HealthcareProvider h ON c.HealthcareProviderID = h.HealthcareProviderID
+        WHERE NOT EXISTS (
+            SELECT 1 FROM ProvidersInUse u WHERE u.HealthcareProviderID = c.HealthcareProviderID
+        )
+        GROUP BY h.ProviderName, c.InsurancePlanName
         ORDER BY ClientsCovered DESC;
     """
-    return pd.read_sql(query, engine)
+    return run_query(engine, query, dtypes=REPORT_DTYPES["unused_providers_analysis"])
 
+@cached_report
 def employee_claim_handling(engine):
     query = """
         WITH EmployeeClaimStats AS (
@@ -364,53 +2858,352 @@ def employee_claim_handling(engine):
         FROM EmployeeClaimStats ecs
         ORDER BY ecs.EmployeeID, ecs.ApprovalStatus;
     """
-    return pd.read_sql(query, engine)
+    return run_query(engine, query, dtypes=REPORT_DTYPES["employee_claim_handling"])
+
+# Limits for the chart reduction stage applied to high-cardinality bar charts
+CHART_CONFIG = {
+    "top_n": env_setting("CHART_TOP_N", 20, int),
+    "max_categories": env_setting("CHART_MAX_CATEGORIES", 50, int),
+    "max_bars": env_setting("CHART_MAX_BARS", 1000, int)
+}
+
+# Keep the largest top_n values of a text column and relabel the rest as "Other"
+def fold_to_top(data, column, y, top_n, other_label="Other"):
+    labels = data[column].astype(str)
+    top = data.groupby(labels, sort=False)[y].sum().nlargest(top_n).index
+    return labels.where(labels.isin(top), other_label)
+
+# Shrink a frame before plotting: keep the top_n color series and the max_categories largest x values,
+# folding the rest into "Other", and bin numeric x axes with too many distinct values. When the x
+# categories times the color series would still exceed max_bars, fewer series are kept, and rows
+# sharing an x value and series are summed into one bar.
+# Returns the reduced frame and whether anything was folded.
+def reduce_for_chart(data, x, y, color=None, top_n=None, max_categories=None, max_bars=None):
+    top_n = CHART_CONFIG["top_n"] if top_n is None else top_n
+    max_bars = CHART_CONFIG["max_bars"] if max_bars is None else max_bars
+    # "Other" takes one more category and one more series
+    max_categories = min(CHART_CONFIG["max_categories"] if max_categories is None else max_categories, max_bars - 1)
+    frame = data[[x, y] + ([color] if color else [])]
+    numeric_color = color is not None and pd.api.types.is_numeric_dtype(frame[color])
+    reduced = False
+
+    if color and not numeric_color and frame[color].nunique() > top_n:
+        frame = frame.assign(**{color: fold_to_top(frame, color, y, top_n)})
+        reduced = True
+    if frame[x].nunique() > max_categories:
+        if pd.api.types.is_numeric_dtype(frame[x]):
+            frame = frame.assign(**{x: pd.cut(frame[x], max_categories).astype(str)})
+        else:
+            frame = frame.assign(**{x: fold_to_top(frame, x, y, max_categories)})
+        reduced = True
+    if color and not numeric_color:
+        series = max(max_bars // max(frame[x].nunique(), 1) - 1, 1)
+        if frame[color].nunique() > series:
+            frame = frame.assign(**{color: fold_to_top(frame, color, y, series)})
+            reduced = True
+
+    if reduced or len(frame) > max_bars:
+        group = [x] + ([color] if color and not numeric_color else [])
+        aggregations = {y: "sum"}
+        if numeric_color:
+            aggregations[color] = "mean"
+        frame = frame.groupby(group, sort=False, observed=True).agg(aggregations).reset_index()
+    return frame, reduced
+
+# Build a bar chart through the reduction stage, which keeps it within max_bars bars
+def bar_chart(data, x, y, color=None, title=None, **kwargs):
+    frame, reduced = reduce_for_chart(data, x, y, color)
+    if reduced:
+        title = f"{title} (largest values shown, the rest grouped as Other)"
+    return px.bar(frame, x=x, y=y, color=color, title=title, **kwargs)
+
+# Rows of a report table sent to the browser at a time; longer results get a row window control
+DISPLAY_CONFIG = {
+    "page_rows": env_setting("TABLE_PAGE_ROWS", 100, int)
+}
+
+# Display formats by column name. The browser applies them, so a result is never cast or copied
+# to format it; None hides the column.
+TABLE_FORMATS = {
+    "year": st.column_config.NumberColumn(format="%d"),
+    "totalgenerated": st.column_config.NumberColumn(format="dollar"),
+    "totalspending": st.column_config.NumberColumn(format="dollar"),
+    "totalamount": st.column_config.NumberColumn(format="dollar"),
+    "totalclaimamount": st.column_config.NumberColumn(format="dollar"),
+    "totalrevenue": st.column_config.NumberColumn(format="dollar"),
+    "totalcommission": st.column_config.NumberColumn(format="dollar"),
+    "netprofit": st.column_config.NumberColumn(format="dollar"),
+    "revenue": st.column_config.NumberColumn(format="dollar"),
+    "expenses": st.column_config.NumberColumn(format="dollar"),
+    "rejectionrate": st.column_config.NumberColumn(format="%.2f%%"),
+    "percentageoftotalclaims": st.column_config.NumberColumn(format="%.2f%%")
+}
+
+# One window of a report's rows as the Arrow table st.dataframe sends. A sliced categorical column
+# keeps the dictionary of the whole result, so the categories the window does not use are dropped.
+def window_table(data, start, rows):
+    window = data.iloc[start:start + rows]
+    categorical = [column for column in window.columns if isinstance(window[column].dtype, pd.CategoricalDtype)]
+    if categorical:
+        window = window.assign(**{column: window[column].cat.remove_unused_categories() for column in categorical})
+    return pa.Table.from_pandas(window)
+
+# Size of a table as an Arrow IPC stream, counted without writing the stream
+def arrow_stream_bytes(table):
+    sink = pa.MockOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.size()
+
+# Display one window of a report's rows. Slicing does not copy the frame and only the window is
+# converted, so a cached result of any size costs the browser page_rows rows per render. The Arrow
+# bytes sent are recorded against the report for the Performance panel and /metrics.
+def display_table(data, report, column_config=None, page_rows=None, **kwargs):
+    page_rows = page_rows or DISPLAY_CONFIG["page_rows"]
+    total = len(data)
+    start = 0
+    if total > page_rows:
+        key = f"{report}_first_row"
+        # A shorter result than the last render starts again from the top
+        if st.session_state.get(key, 1) > total:
+            st.session_state[key] = 1
+        start = st.number_input("First row", min_value=1, max_value=total, value=1, step=page_rows, key=key) - 1
+    window = window_table(data, start, page_rows)
+    formats = {column: TABLE_FORMATS[column] for column in data.columns if column in TABLE_FORMATS}
+    st.dataframe(window, column_config={**formats, **(column_config or {})}, **kwargs)
+    sent = arrow_stream_bytes(window)
+    get_query_metrics().record_display(report, window.num_rows, sent)
+    if total > page_rows:
+        st.caption(f"Rows {start + 1}-{start + window.num_rows} of {total:,}, {sent / 1024:,.1f} KB sent")
+    else:
+        st.caption(f"{total:,} rows, {sent / 1024:,.1f} KB sent")
+
+# The keyset cursor after a client spending page, or None when it was the last page
+def next_spending_cursor(data, page_size):
+    if len(data) < page_size:
+        return None
+    last = data.iloc[-1]
+    return float(last["totalspending"]), int(last["clientid"]), int(last["healthcareproviderid"])
+
+# Page through client spending with next/previous controls; only the visible page is fetched
+def display_client_spending_page(engine):
+    state = st.session_state
+    state.setdefault("spending_cursors", [None])
+    state.setdefault("spending_next", None)
+
+    def reset_pages():
+        state.spending_cursors = [None]
+
+    def next_page():
+        if state.spending_next is not None:
+            state.spending_cursors.append(state.spending_next)
+
+    def previous_page():
+        if len(state.spending_cursors) > 1:
+            state.spending_cursors.pop()
+
+    total = int(client_spending_count(engine)["total"].iloc[0])
+    page_size = st.selectbox("Rows per page", [25, 50, 100, 250], index=1, on_change=reset_pages)
+    data = client_spending_page(engine, after=state.spending_cursors[-1], page_size=page_size)
+
+    state.spending_next = next_spending_cursor(data, page_size)
+
+    first_row = (len(state.spending_cursors) - 1) * page_size
+    display_table(data, "client_spending_page", page_rows=page_size)
+    previous_col, position_col, next_col = st.columns([1, 4, 1])
+    previous_col.button("Previous", on_click=previous_page, disabled=len(state.spending_cursors) == 1)
+    position_col.caption(f"Rows {first_row + 1 if len(data) else 0}-{first_row + len(data)} of {total}")
+    next_col.button("Next", on_click=next_page, disabled=state.spending_next is None)
+    return data
+
+# Sidebar entries and the report function behind each one
+QUERY_OPTIONS = {
+    "Top 5 Monthly Services": top_5_monthly_services,
+    "Client Spending by Healthcare Provider": client_spending_by_hcp,
+    "High-Risk Clients": high_risk_clients,
+    "Insurance Plan Distribution Across Healthcare Providers": insurance_plan_distribution,
+    "Revenue Contribution by Agent": revenue_contribution_by_agent,
+    "Medical Conditions Insights": medical_conditions_insights,
+    "Company Profits": company_profits,
+    "Unused Healthcare Providers Analysis": unused_providers_analysis,
+    "Employee Claim Handling": employee_claim_handling,
+    "Fraud Claims": fraud_claims
+}
+
+# Report calls each view makes when it first renders, so prefetched results land on the keys the view
+# looks up; views not listed call their QUERY_OPTIONS function without parameters
+VIEW_REPORTS = {
+    "Client Spending by Healthcare Provider": [
+        (client_spending_count, {}),
+        (client_spending_page, {"after": None, "page_size": 50})
+    ],
+    "Insurance Plan Distribution Across Healthcare Providers": [
+        (healthcare_providers, {}),
+        (insurance_plan_distribution, {"provider_id": None})
+    ],
+    "Revenue Contribution by Agent": [
+        (policy_start_years, {}),
+        (revenue_contribution_by_agent, {"year": None, "start_date": None, "end_date": None})
+    ],
+    "Company Profits": [
+        (finance_period_comparison, default_finance_period())
+    ],
+    # With the risk feature store enabled the view answers from memory
+    "High-Risk Clients": [] if RISK_CONFIG["poll_interval"] > 0 else [
+        (high_risk_clients, dict(RISK_DEFAULTS))
+    ]
+}
+
+# Reports a view reads only after a user action, so they are not prefetched but are still refreshed
+# and watched for changes with the view
+VIEW_ON_DEMAND_REPORTS = {
+    "Client Spending by Healthcare Provider": [client_search, client_spending_by_hcp]
+}
+
+# Background prefetch configuration; 0 connections disables prefetching. Prefetch only fills the
+# result cache up to max_bytes, so it never evicts much of what users asked for themselves.
+PREFETCH_CONFIG = {
+    "connections": env_setting("PREFETCH_CONNECTIONS", 2, int),
+    "max_bytes": env_setting("PREFETCH_MAX_MB", CACHE_CONFIG["max_bytes"] // 2 // (1024 * 1024), int) * 1024 * 1024
+}
+
+# Report calls to prefetch for a view. Once the fraud detector has loaded its window the Fraud Claims
+# view reads it from memory, so running fraud_claims ahead of time would only fill the cache.
+def prefetch_reports(engine, label):
+    if label == "Fraud Claims":
+        detector = start_fraud_detector(engine)
+        if detector and detector.loaded():
+            return []
+    return VIEW_REPORTS.get(label, [(QUERY_OPTIONS[label], {})])
+
+# Warms the result cache with the views users have not opened yet in this session, the most
+# frequently opened views first, on at most `connections` pooled connections at a time
+class Prefetcher:
+    def __init__(self, connections, max_bytes):
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=connections, thread_name_prefix="prefetch")
+        self.max_bytes = max_bytes
+        self.usage = Counter()
+        self.pending = set()
+        self.prefetched = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def record_view(self, label):
+        with self.lock:
+            self.usage[label] += 1
+
+    # Sidebar labels by how often they were opened; sorted() is stable, so ties keep the sidebar order
+    def ranked_views(self):
+        with self.lock:
+            return sorted(QUERY_OPTIONS, key=lambda label: -self.usage[label])
+
+    def schedule(self, engine, current):
+        cache = get_report_cache()
+        for label in self.ranked_views():
+            if label == current:
+                continue
+            for func, params in prefetch_reports(engine, label):
+                key = report_cache_key(func.__name__, params)
+                with self.lock:
+                    if key in self.pending or cache.contains(key):
+                        continue
+                    self.pending.add(key)
+                self.executor.submit(self.prefetch, engine, func, params, key)
+
+    # Leave the pool to interactive sessions when it is busy, and skip results the memory budget
+    # cannot take, judging their size by the report's previous run
+    def within_budget(self, engine, report):
+        if engine.pool.checkedout() >= POOL_CONFIG["pool_size"]:
+            return False
+        expected = get_query_metrics().snapshot().get(report, {}).get("memory_bytes", 0)
+        return get_report_cache().stats()["bytes"] + expected <= self.max_bytes
+
+    def prefetch(self, engine, func, params, key):
+        try:
+            if not self.within_budget(engine, func.__name__):
+                with self.lock:
+                    self.skipped += 1
+                return
+            func(engine, **params)
+            with self.lock:
+                self.prefetched += 1
+        except Exception:
+            logger.warning("Prefetching %s failed", func.__name__, exc_info=True)
+            with self.lock:
+                self.failed += 1
+        finally:
+            with self.lock:
+                self.pending.discard(key)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "prefetched": self.prefetched,
+                "skipped_over_budget": self.skipped,
+                "failed": self.failed,
+                "pending": len(self.pending),
+                "views_opened": dict(self.usage)
+            }
+
+@st.cache_resource
+def get_prefetcher():
+    return Prefetcher(PREFETCH_CONFIG["connections"], PREFETCH_CONFIG["max_bytes"])
 
 # Streamlit Interface
 def main():
-    engine = connect_db()
-    
+    profile = RunProfile()
+    # Paint the header before the engine is built, so the first paint does not wait for the driver import
     display_header()
     display_logo()
+    profile.mark("header")
+
+    engine = connect_db()
+    listener = None
+    if DATA_CONFIG["source"] == "snapshot":
+        display_snapshot_source()
+    else:
+        start_materialized_views(engine)
+        start_finance_ledger(engine)
+        listener = start_change_listener(engine)
+    profile.mark("connect")
+    
     # Sidebar for query selection
     st.sidebar.title("Select Query")
-    query_options = [
-        "Top 5 Monthly Services",
-        "Client Spending by Healthcare Provider",
-        "High-Risk Clients",
-        "Insurance Plan Distribution Across Healthcare Providers", 
-        "Revenue Contribution by Agent",
-        "Medical Conditions Insights",
-        "Company Profits",
-        "Unused Healthcare Providers Analysis",
-        "Employee Claim Handling",
-        "Fraud Claims"
-    ]
-    selected_query = st.sidebar.selectbox("Choose a query to view", query_options)
+    selected_query = st.sidebar.selectbox("Choose a query to view", list(QUERY_OPTIONS))
+
+    # Taken before the view's reports are read, so a change landing while they render still reruns it
+    if listener is not None:
+        reports = view_reports(selected_query)
+        st.session_state.view_versions = (reports, listener.version(reports))
     
     display_team_names()
+    display_cache_controls(view_reports(selected_query))
+    display_pool_stats(engine)
+    if DATA_CONFIG["source"] == "live":
+        display_replica_status()
+    start_metrics_server()
+    profile.mark("sidebar")
     
     if selected_query == "Top 5 Monthly Services":
         st.subheader("Top 5 Monthly Revenue-Generating Services")
         data = top_5_monthly_services(engine)
-        st.dataframe(data)
-
-        # Convert columns to a consistent format
-        data.columns = [col.title() for col in data.columns]
+        display_staleness(engine, "mv_top5monthlyservicesummary")
+        display_table(data, "top_5_monthly_services")
 
         if not data.empty:
     # Rescale by updating the layout of the figure
             fig = px.bar(
                 data,
-                x="Serviceperiod",
-                y="Totalgenerated",
-                color="Healthcareproviderid",
+                x="serviceperiod",
+                y="totalgenerated",
+                color="healthcareproviderid",
                 barmode="group",  # Grouped bar chart
                 title="Top 5 Monthly Services by Revenue",
                 labels={
-                    "Serviceperiod": "Month",
-                    "Totalgenerated": "Revenue",
-                    "Healthcareproviderid": "Provider"
+                    "serviceperiod": "Month",
+                    "totalgenerated": "Revenue",
+                    "healthcareproviderid": "Provider"
                 }
             )
         
@@ -431,8 +3224,8 @@ def main():
 
     elif selected_query == "Client Spending by Healthcare Provider":
         st.subheader("Client Spending by Healthcare Providers")
-        data = client_spending_by_hcp(engine)
-        st.dataframe(data)
+        data = display_client_spending_page(engine)
+        display_staleness(engine, "mv_client_spending_by_hcp")
     
         if not data.empty:
             # Add an option to view either all clients or a specific client
@@ -443,14 +3236,14 @@ def main():
             )
     
             if view_option == "All Clients":
-                # Display the original bar chart for all clients
-                fig = px.bar(
+                # Display the bar chart for all clients on the page, keeping the biggest spenders as series
+                fig = bar_chart(
                     data,
                     x="healthcareprovidername",
                     y="totalspending",
                     color="clientfullname",
                     barmode="group",  # Grouped bar chart
-                    title="Client Spending by Healthcare Providers (All Clients)",
+                    title="Client Spending by Healthcare Providers (Current Page)",
                     labels={
                         "healthcareprovidername": "Provider Name",
                         "totalspending": "Spending",
@@ -468,12 +3261,22 @@ def main():
                 st.plotly_chart(fig, use_container_width=True)
     
             elif view_option == "Specific Client":
-                # Dropdown to select a specific client
-                client_names = data['clientfullname'].unique()  # Get unique client names
-                selected_client = st.selectbox("Select a Client", client_names)
+                # Search all clients, or pick one from the current page
+                search = st.text_input("Search clients by name or ID").strip()
+                matches = client_search(engine, term=search) if search else data
+                if matches.empty:
+                    st.info("No clients match your search; showing clients from the current page.")
+                    matches = data
+                matches = matches[["clientid", "clientfullname"]].drop_duplicates()
+                client_labels = dict(zip(matches["clientid"], matches["clientfullname"]))
+                selected_id = st.selectbox(
+                    "Select a Client", list(client_labels),
+                    format_func=lambda client_id: f"{client_labels[client_id]} (#{client_id})"
+                )
+                selected_client = client_labels[selected_id]
     
-                # Filter data for the selected client
-                client_data = data[data['clientfullname'] == selected_client]
+                # Fetch only the selected client's rows
+                client_data = client_spending_by_hcp(engine, client_id=int(selected_id))
     
                 # Display a bar chart for the selected client
                 st.write(f"Spending Details for {selected_client}")
@@ -502,11 +3305,19 @@ def main():
 
     elif selected_query == "High-Risk Clients":
         st.subheader("High-Risk Clients")
-        data = high_risk_clients(engine)
-        st.dataframe(data)
+        store = start_risk_store(engine)
+        thresholds = risk_threshold_inputs(store.maxima() if store else None)
+        if store is not None:
+            sort_by = st.selectbox("Sort by", list(RISK_SORTS))
+            started = time.perf_counter()
+            data = store.select(sort_by=sort_by, **thresholds)
+            display_risk_store_status(store, len(data), time.perf_counter() - started)
+        else:
+            data = high_risk_clients(engine, **thresholds)
+        display_table(data, "high_risk_clients")
 
         if not data.empty:
-            fig = px.bar(
+            fig = bar_chart(
                 data,
                 x="clientname",
                 y="totalclaimamount",
@@ -522,21 +3333,26 @@ def main():
 
     elif selected_query == "Fraud Claims":
         st.subheader("Fraud Claims")
-        data = fraud_claims(engine)
-        st.dataframe(data)
+        detector = start_fraud_detector(engine)
+        data = detector.flagged() if detector else None
+        if data is None:
+            data = fraud_claims(engine)
+        else:
+            display_fraud_detector_status(detector)
+        display_table(data, "fraud_claims")
     
         if not data.empty:
             # Visualize the fraud claims
-            fig = px.bar(
+            fig = bar_chart(
                 data,
-                x="ClientName",
-                y="TotalAmount",
-                color="RejectionRate",
+                x="clientname",
+                y="totalamount",
+                color="rejectionrate",
                 title="Fraud Claims Analysis",
                 labels={
-                    "ClientName": "Client",
-                    "TotalAmount": "Total Claimed Amount",
-                    "RejectionRate": "Rejection Rate (%)"
+                    "clientname": "Client",
+                    "totalamount": "Total Claimed Amount",
+                    "rejectionrate": "Rejection Rate (%)"
                 }
             )
             st.plotly_chart(fig)
@@ -545,28 +3361,26 @@ def main():
     
     elif selected_query == "Insurance Plan Distribution Across Healthcare Providers":
         st.subheader("Insurance Plan Distribution Across Healthcare Providers")
-        data = insurance_plan_distribution(engine)
+        providers = healthcare_providers(engine)
+        provider_names = dict(zip(providers["healthcareproviderid"], providers["healthcareprovidername"]))
+        selected_id = st.selectbox(
+            "Select a Healthcare Provider to view details:", 
+            options=["All"] + list(provider_names),
+            format_func=lambda option: provider_names.get(option, option)
+        )
+        selected_provider = provider_names.get(selected_id, "All")
+        provider_id = None if selected_id == "All" else int(selected_id)
+
+        # The provider filter runs in SQL, so only the selected provider's rows are fetched
+        data = insurance_plan_distribution(engine, provider_id=provider_id)
+        display_staleness(engine, "mv_insurance_plan_distribution")
     
         if not data.empty:
-            # Extract unique healthcare providers
-            healthcare_providers = data["healthcareprovidername"].unique()
-            selected_provider = st.selectbox(
-                "Select a Healthcare Provider to view details:", 
-                options=["All"] + list(healthcare_providers)
-            )
-    
-            # Filter data based on the selected provider
-            if selected_provider != "All":
-                filtered_data = data[data["healthcareprovidername"] == selected_provider]
-            else:
-                filtered_data = data
-    
-            # Display filtered data
-            st.dataframe(filtered_data)
+            display_table(data, "insurance_plan_distribution")
     
             # Plot the graph for the selected healthcare provider(s)
             fig = px.bar(
-                filtered_data,
+                data,
                 x="healthcareprovidername",
                 y="clientcount",
                 color="insuranceplanlevel",
@@ -595,51 +3409,51 @@ def main():
 
     elif selected_query == "Revenue Contribution by Agent":
         st.subheader("Revenue Contribution by Agent")
-        data = revenue_contribution_by_agent(engine)
+
+        # Year and date filters are passed to the query instead of filtering the full result
+        years = [int(year) for year in policy_start_years(engine)["year"]]
+        selected_year = st.selectbox("Filter by Year", options=["All Years"] + years)
+        # Snapshots hold the per-year totals only, so date ranges need the live database
+        date_range = st.date_input("Policy start date range (optional)", value=[]) if DATA_CONFIG["source"] == "live" else ()
+        start_date, end_date = (tuple(date_range) + (None, None))[:2]
+        # While a range is being picked it has a start date only
+        if start_date is not None and end_date is None:
+            st.info("Choose the end of the date range.")
+        else:
+            data = revenue_contribution_by_agent(
+                engine,
+                year=None if selected_year == "All Years" else selected_year,
+                start_date=start_date,
+                end_date=end_date
+            )
         
-        if not data.empty:
-            # Ensure 'Year' column is treated as an integer
-            data['year'] = data['year'].astype(int)
-            
-            # Format the DataFrame for display
-            formatted_data = data.copy()
-            formatted_data['year'] = formatted_data['year'].astype(str)  # Convert year to string to avoid commas
-            st.dataframe(formatted_data)
-    
-            # Display a dropdown to filter data by Year
-            years = sorted(data['year'].unique())
-            selected_year = st.selectbox("Filter by Year", options=years)
+            if not data.empty:
+                display_table(data, "revenue_contribution_by_agent")
     
-            # Filter the data based on the selected year
-            filtered_data = data[data['year'] == selected_year]
-    
-            # Plot the filtered data
-            fig = px.bar(
-                filtered_data,
-                x="agentname",
-                y="totalrevenue",
-                color="totalcommission",
-                title=f"Revenue Contribution by Agents for {selected_year}",
-                labels={
-                    "agentname": "Agent Name",
-                    "totalrevenue": "Total Revenue",
-                    "totalcommission": "Total Commission"
-                },
-                hover_data=["totalclients", "netprofit"]
-            )
-            st.plotly_chart(fig)
-        else:
-            st.warning("No data found for Revenue Contribution by Agent. Please check your database.")
+                # Plot the filtered data
+                fig = px.bar(
+                    data,
+                    x="agentname",
+                    y="totalrevenue",
+                    color="totalcommission",
+                    title=f"Revenue Contribution by Agents for {selected_year}",
+                    labels={
+                        "agentname": "Agent Name",
+                        "totalrevenue": "Total Revenue",
+                        "totalcommission": "Total Commission"
+                    },
+                    hover_data=["totalclients", "netprofit"]
+                )
+                st.plotly_chart(fig)
+            else:
+                st.warning("No data found for Revenue Contribution by Agent. Please check your database.")
     
     elif selected_query == "Medical Conditions Insights":
         st.subheader("Medical Conditions Insights")
         data = medical_conditions_insights(engine)
-        st.dataframe(data)
+        display_table(data, "medical_conditions_insights")
     
         if not data.empty:
-            # Ensure column names are consistent
-            data.columns = [col.lower() for col in data.columns]  # Standardize to lowercase
-    
             # Add a radio button for the user to select plot type
             plot_type = st.radio(
                 "Select Plot Type:",
@@ -650,7 +3464,7 @@ def main():
                 # Visualization for Medical Conditions Insights by Insurance Plan Level
                 fig = px.bar(
                     data,
-                    x="conditionname",  # Use the corrected lowercase column names
+                    x="conditionname",
                     y="clientsserved",
                     color="coveragelevel",
                     barmode="group",
@@ -665,7 +3479,7 @@ def main():
     
             elif plot_type == "Condition Count Only":
                 # Create a simpler plot for Condition and Count
-                condition_count_data = data.groupby("conditionname")["conditioncount"].sum().reset_index()
+                condition_count_data = data.groupby("conditionname", observed=True)["conditioncount"].sum().reset_index()
     
                 fig = px.bar(
                     condition_count_data,
@@ -684,41 +3498,59 @@ def main():
 
     elif selected_query == "Company Profits":
         st.subheader("Company Profits Analysis")
-        data = company_profits(engine)
-    
-        if not data.empty:
-            # Display the data in a table
-            st.dataframe(data)
-    
-            # Visualization of Revenue, Expenses, and Profits
-            fig = px.bar(
-                data.melt(var_name="Metric", value_name="Amount"),
-                x="Metric",
-                y="Amount",
-                title="Company Financial Overview",
-                labels={"Metric": "Financial Metric", "Amount": "Amount ($)"},
-                color="Metric"
-            )
-            st.plotly_chart(fig)
+
+        # Any range is answered from the per-day finance ledger, next to the previous period of the
+        # same length and the same dates a year earlier
+        default = default_finance_period()
+        date_range = st.date_input("Period", value=(default["start_date"], default["end_date"]))
+        start_date, end_date = (tuple(date_range) + (None, None))[:2]
+        # A cleared date picker leaves no period to compare
+        if start_date is None:
+            st.info("Choose a period to compare.")
         else:
-            st.warning("No data available for this query.")
+            data = finance_period_comparison(engine, start_date=start_date, end_date=end_date or start_date)
+            display_staleness(engine, "finance_daily_ledger")
+
+            if not data.empty:
+                selected, previous = data.iloc[0], data.iloc[1]
+                for column, (metric, label) in zip(
+                    st.columns(3), [("revenue", "Revenue"), ("expenses", "Expenses"), ("netprofit", "Net Profit")]
+                ):
+                    column.metric(
+                        label,
+                        f"${selected[metric]:,.2f}",
+                        delta=f"{selected[metric] - previous[metric]:,.2f} vs previous period",
+                        delta_color="inverse" if metric == "expenses" else "normal"
+                    )
+
+                # Display the data in a table
+                display_table(data, "finance_period_comparison", hide_index=True)
+
+                # Visualization of Revenue, Expenses, and Profits for each period
+                fig = px.bar(
+                    data.melt(id_vars=["period"], value_vars=["revenue", "expenses", "netprofit"], var_name="Metric", value_name="Amount"),
+                    x="Metric",
+                    y="Amount",
+                    title="Company Financial Overview",
+                    labels={"Metric": "Financial Metric", "Amount": "Amount ($)", "period": "Period"},
+                    color="period",
+                    barmode="group"
+                )
+                st.plotly_chart(fig)
+            else:
+                st.warning("No data available for this query.")
             
             
     elif selected_query == "Unused Healthcare Providers Analysis":
         st.subheader("Analysis of Unused Healthcare Providers")
         data = unused_providers_analysis(engine)
-        
-        # Debugging: Display dataframe to check column names
-        st.dataframe(data)
+        display_table(data, "unused_providers_analysis")
         
         if not data.empty:
-            # Ensure column names match exactly
-            data.columns = [col.lower() for col in data.columns]  # Convert to lowercase for consistency
-            
             # Visualizing unused providers
             fig = px.bar(
                 data,
-                x="unusedprovider",  # Use lowercase column names
+                x="unusedprovider",
                 y="clientscovered",
                 color="coveredplan",
                 title="Unused Healthcare Providers by Covered Clients",
@@ -742,12 +3574,12 @@ def main():
             
     elif selected_query == "Employee Claim Handling":
         st.subheader("Employee Claim Handling Insights")
-        data = employee_claim_handling(engine)  # Replace with your query function
-        st.dataframe(data)
+        data = employee_claim_handling(engine)
+        display_table(data, "employee_claim_handling")
         
         if not data.empty:
             # Visualization using a stacked bar chart
-            fig = px.bar(
+            fig = bar_chart(
                 data,
                 x="employeename",  # Corrected column name
                 y="claimcount",  # Corrected column name
@@ -774,7 +3606,716 @@ def main():
         else:
             st.warning("No data available for this query. Ensure the database is populated.")
 
+    profile.mark("report")
+
+    # Rendered last so it includes the timings of the report shown on this run
+    display_performance_panel(QUERY_OPTIONS[selected_query].__name__)
+
+    # Count the view once per switch rather than once per rerun, then warm the other views
+    # now that this one has rendered
+    if PREFETCH_CONFIG["connections"] > 0:
+        prefetcher = get_prefetcher()
+        if st.session_state.get("opened_view") != selected_query:
+            st.session_state.opened_view = selected_query
+            prefetcher.record_view(selected_query)
+        prefetcher.schedule(engine, selected_query)
+    profile.mark("panels")
+
+    if listener is not None and CDC_CONFIG["live_refresh"] > 0:
+        watch_view_changes()
+
+    if PROFILE_CONFIG["enabled"]:
+        display_profile(profile, selected_query)
+
     
+# Indexes supporting the report joins and date filters, created by `python procare.py migrate`
+INDEXES = {
+    "idx_provide_client": "Provide (ClientID) INCLUDE (DoctorID, ServiceID, ServiceCost)",
+    "idx_provide_doctor": "Provide (DoctorID) INCLUDE (ClientID, ServiceCost)",
+    "idx_employdoctor_doctor": "EmployDoctor (DoctorID) INCLUDE (HealthcareProviderID)",
+    "idx_employdoctor_provider": "EmployDoctor (HealthcareProviderID, DoctorID)",
+    "idx_sell_client": "Sell (ClientID) INCLUDE (PolicyNumber, AgentID)",
+    "idx_sell_policy": "Sell (PolicyNumber) INCLUDE (ClientID, AgentID)",
+    "idx_policy_plan": "Policy (InsurancePlanName) INCLUDE (PolicyNumber, EndDate)",
+    "idx_policy_end_date": "Policy (EndDate) INCLUDE (PolicyNumber, InsurancePlanName)",
+    "idx_policy_start_date": "Policy (StartDate) INCLUDE (PolicyNumber, ExactCost)",
+    "idx_medicalrecords_client": "MedicalRecords (ClientID, ICDCode)",
+    "idx_medicalrecords_condition": "MedicalRecords (ConditionName, ClientID)",
+    "idx_requestclaim_date_created": "RequestClaim (DateCreated) INCLUDE (ClientID, Amount, ApprovalStatus)",
+    "idx_requestclaim_employee": "RequestClaim (EmployeeID, ApprovalStatus) INCLUDE (Amount, ClientID)",
+    # Partial index: high-risk scoring only sums approved and pending claims
+    "idx_requestclaim_client_open": "RequestClaim (ClientID) INCLUDE (Amount) WHERE ApprovalStatus IN ('Approved', 'Pending')",
+    "idx_requestclaim_client": "RequestClaim (ClientID) INCLUDE (Amount, ApprovalStatus)",
+    "idx_clientdependent_client": "ClientDependent (ClientID)",
+    "idx_covers_provider": "Covers (HealthcareProviderID, InsurancePlanName)",
+    "idx_pays_date": "Pays (Date) INCLUDE (Amount)"
+}
+
+# Create any missing index without blocking writes. A failed CONCURRENTLY build leaves an invalid
+# index behind, so invalid ones are dropped and built again; running this repeatedly is safe.
+def migrate_indexes(engine):
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for name, definition in INDEXES.items():
+            valid = conn.execute(text("""
+                SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE c.relname = :name AND pg_catalog.pg_table_is_visible(c.oid)
+            """), {"name": name}).scalar()
+            if valid:
+                print(f"{name:<32} exists")
+                continue
+            if valid is False:
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+            started = time.perf_counter()
+            conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}"))
+            print(f"{name:<32} created in {time.perf_counter() - started:.2f}s")
+        for table in sorted({definition.split(" ", 1)[0] for definition in INDEXES.values()}):
+            conn.execute(text(f"ANALYZE {table}"))
+
+# Report calls checked by `python procare.py check-plans`, with the large relations each one may
+# legitimately read in full (whole-table aggregates); any other sequential scan of a large table fails
+PLAN_CHECKS = [
+    ("top_5_monthly_services", {}, {"mv_top5monthlyservicesummary"}),
+    ("client_spending_by_hcp", {}, {"mv_client_spending_by_hcp"}),
+    ("client_spending_by_hcp", {"client_id": 1}, set()),
+    ("client_spending_page", {"page_size": 50}, set()),
+    ("client_spending_page", {"after": (1000.0, 1, 1), "page_size": 50}, set()),
+    ("client_spending_count", {}, {"mv_client_spending_by_hcp"}),
+    ("fraud_claims", {}, {"client"}),
+    ("high_risk_clients", {}, {"client", "medicalrecords", "requestclaim", "clientdependent"}),
+    ("risk_features", {}, {"client_risk_features"}),
+    ("insurance_plan_distribution", {}, set()),
+    ("insurance_plan_distribution", {"provider_id": 1}, set()),
+    ("revenue_contribution_by_agent", {}, {"sell", "policy"}),
+    ("revenue_contribution_by_agent", {"year": datetime.now().year}, {"sell"}),
+    ("medical_conditions_insights", {}, {"medicalrecords", "sell", "policy"}),
+    ("company_profits", {}, set()),
+    ("finance_period_comparison", default_finance_period(), set()),
+    ("unused_providers_analysis", {}, {"covers", "sell", "policy"}),
+    ("employee_claim_handling", {}, {"requestclaim"})
+]
+
+# Sequential scans in an EXPLAIN (FORMAT JSON) plan tree
+def sequential_scans(node):
+    if node.get("Node Type") == "Seq Scan":
+        yield node["Relation Name"]
+    for child in node.get("Plans", []):
+        yield from sequential_scans(child)
+
+# Run every report in PLAN_CHECKS with plan capture on and list the disallowed sequential scans
+def check_plans(engine, min_rows):
+    with db_connection(engine) as conn:
+        large = set(conn.execute(text("""
+            SELECT relname FROM pg_class
+            WHERE relkind IN ('r', 'm') AND reltuples >= :min_rows AND pg_catalog.pg_table_is_visible(oid)
+        """), {"min_rows": min_rows}).scalars())
+    failures = []
+    for report, params, allowed in PLAN_CHECKS:
+        plans = []
+        token = plan_capture.set(plans)
+        try:
+            globals()[report].__wrapped__(engine, **params)
+        finally:
+            plan_capture.reset(token)
+        scans = {table for plan in plans for table in sequential_scans(plan[0]["Plan"])}
+        offending = sorted((scans & large) - allowed)
+        label = f"{report}({', '.join(f'{key}={value!r}' for key, value in params.items())})"
+        print(f"{'FAIL' if offending else 'ok':<5}{label:<70}{', '.join(offending)}")
+        if offending:
+            failures.append((label, offending))
+    return failures
+
+# Joins in an EXPLAIN (ANALYZE, FORMAT JSON) plan tree that produced at least min_rows rows and more
+# than max_fanout times the rows of their largest input, with their row counts
+def join_explosions(node, min_rows, max_fanout):
+    if node["Node Type"] in ("Hash Join", "Merge Join", "Nested Loop"):
+        rows = node["Actual Rows"] * node["Actual Loops"]
+        largest = max(child["Actual Rows"] * child["Actual Loops"] for child in node["Plans"])
+        if rows >= min_rows and rows > max_fanout * max(largest, 1):
+            yield node["Node Type"], rows, largest
+    for child in node.get("Plans", []):
+        yield from join_explosions(child, min_rows, max_fanout)
+
+# Run every report in PLAN_CHECKS under EXPLAIN ANALYZE and list the joins that multiplied their rows
+def check_joins(engine, min_rows, max_fanout):
+    failures = []
+    for report, params, _ in PLAN_CHECKS:
+        plans = []
+        tokens = plan_capture.set(plans), plan_analyze.set(True)
+        label = f"{report}({', '.join(f'{key}={value!r}' for key, value in params.items())})"
+        try:
+            globals()[report].__wrapped__(engine, **params)
+        except OperationalError as error:
+            if not query_timed_out(error):
+                raise
+            print(f"{'FAIL':<5}{label:<70}timed out")
+            failures.append((label, ["timed out"]))
+            continue
+        finally:
+            plan_capture.reset(tokens[0])
+            plan_analyze.reset(tokens[1])
+        joins = [
+            f"{node} {rows:,} rows from {largest:,}"
+            for plan in plans for node, rows, largest in join_explosions(plan[0]["Plan"], min_rows, max_fanout)
+        ]
+        print(f"{'FAIL' if joins else 'ok':<5}{label:<70}{'; '.join(joins)}")
+        if joins:
+            failures.append((label, joins))
+    return failures
+
+# Relations read anywhere in an EXPLAIN (FORMAT JSON) plan tree
+def plan_relations(node):
+    if "Relation Name" in node:
+        yield node["Relation Name"]
+    for child in node.get("Plans", []):
+        yield from plan_relations(child)
+
+# Check that REPORT_DEPENDENCIES lists every relation the reports in PLAN_CHECKS read, then update one
+# row of every change feed table to itself and check that each update is heard on the channel
+def check_change_feed(engine, timeout):
+    failures = []
+    for report, params, _ in PLAN_CHECKS:
+        plans = []
+        token = plan_capture.set(plans)
+        try:
+            globals()[report].__wrapped__(engine, **params)
+        finally:
+            plan_capture.reset(token)
+        relations = {relation for plan in plans for relation in plan_relations(plan[0]["Plan"])}
+        undeclared = sorted(relations - REPORT_DEPENDENCIES.get(report, set()))
+        label = f"{report}({', '.join(f'{key}={value!r}' for key, value in params.items())})"
+        print(f"{'FAIL' if undeclared else 'ok':<5}{label:<70}{'undeclared: ' + ', '.join(undeclared) if undeclared else ''}")
+        if undeclared:
+            failures.append((label, undeclared))
+    if engine.dialect.driver != "psycopg":
+        print(f"{'FAIL':<5}the change feed needs the psycopg driver, not {engine.dialect.driver}")
+        return failures + [("driver", [engine.dialect.driver])]
+    tables = change_feed_tables()
+    with engine.begin() as conn:
+        ensure_change_notifications(conn, tables)
+    cargs, cparams = engine.dialect.create_connect_args(engine.url)
+    with engine.dialect.connect(*cargs, **cparams) as listener:
+        listener.autocommit = True
+        listener.execute(f"LISTEN {CDC_CONFIG['channel']}")
+        updated = []
+        with engine.begin() as conn:
+            for table in tables:
+                column = conn.execute(text(
+                    "SELECT attname FROM pg_attribute WHERE attrelid = to_regclass(:table) AND attnum = 1"
+                ), {"table": table}).scalar()
+                if column is not None and conn.execute(text(
+                    f"UPDATE {table} SET {column} = {column} WHERE ctid = (SELECT ctid FROM {table} LIMIT 1)"
+                )).rowcount:
+                    updated.append(table)
+        heard = set()
+        deadline = time.monotonic() + timeout
+        while not heard >= set(updated) and time.monotonic() < deadline:
+            # notifies() only returns at its timeout, so stop reading once every table was heard
+            for notify in listener.notifies(timeout=deadline - time.monotonic()):
+                heard.add(parse_change(notify.payload)[0])
+                if heard >= set(updated):
+                    break
+    for table in tables:
+        if table not in updated:
+            print(f"{'skip':<5}{table:<70}missing or empty")
+            continue
+        print(f"{'ok' if table in heard else 'FAIL':<5}{table:<70}{'' if table in heard else 'no notification'}")
+        if table not in heard:
+            failures.append((table, ["no notification"]))
+    return failures
+
+# Build the fraud detector window from scratch and compare it with the fraud_claims query
+def check_fraud_detector(engine):
+    detector = FraudDetector()
+    started = time.perf_counter()
+    detector.sync(engine)
+    load_ms = (time.perf_counter() - started) * 1000
+    started = time.perf_counter()
+    detected = detector.flagged()
+    read_ms = (time.perf_counter() - started) * 1000
+    started = time.perf_counter()
+    expected = fraud_claims.__wrapped__(engine).sort_values(["totalclaims", "clientid"], ascending=[False, True])
+    if COMPACT_CONFIG["enabled"]:
+        expected = compact_frame(expected)
+    query_ms = (time.perf_counter() - started) * 1000
+    print(
+        f"{len(detected)} flagged clients; window load {load_ms:.0f}ms, "
+        f"detector read {read_ms:.2f}ms, fraud_claims query {query_ms:.0f}ms"
+    )
+    try:
+        pd.testing.assert_frame_equal(detected, expected.reset_index(drop=True), check_dtype=False)
+    except AssertionError as error:
+        print(f"MISMATCH {error}")
+        return True
+    return False
+
+# Thresholds the feature store is checked at: the original query's, and looser and stricter ones
+RISK_CHECKS = [
+    dict(RISK_DEFAULTS),
+    {"min_icd_codes": 5, "min_claim_amount": 50000, "min_dependents": 0, "statuses": ("Approved",)},
+    {"min_icd_codes": 15, "min_claim_amount": 150000, "min_dependents": 1, "statuses": tuple(CLAIM_STATUSES)}
+]
+
+# Load a feature store from scratch and compare its selections with the high_risk_clients query
+def check_risk_store(engine):
+    update_risk_features(engine)
+    store = RiskFeatureStore()
+    started = time.perf_counter()
+    store.sync(engine)
+    print(f"{store.size()} clients loaded in {(time.perf_counter() - started) * 1000:.0f}ms")
+    mismatched = False
+    for thresholds in RISK_CHECKS:
+        started = time.perf_counter()
+        selected = store.select(sort_by="Claim amount", **thresholds)
+        select_ms = (time.perf_counter() - started) * 1000
+        started = time.perf_counter()
+        expected = high_risk_clients.__wrapped__(engine, **thresholds)
+        query_ms = (time.perf_counter() - started) * 1000
+        try:
+            pd.testing.assert_frame_equal(selected, expected, check_dtype=False)
+            status = "ok"
+        except AssertionError as error:
+            status = f"MISMATCH {error}"
+            mismatched = True
+        print(
+            f"{status:<5}{len(selected):>7} clients  store {select_ms:.2f}ms  query {query_ms:.0f}ms  "
+            f"{', '.join(f'{key}={value}' for key, value in thresholds.items())}"
+        )
+    return mismatched
+
+# company_profits as it was computed before the ledger, straight from the source tables over the last year
+COMPANY_PROFITS_RAW_QUERY = """
+    WITH RevenueFromPolicies AS (
+        SELECT SUM(p.ExactCost - (a.CommissionRate / 100) * p.ExactCost) AS PoliciesRevenue
+        FROM Policy p
+        JOIN Sell s ON p.PolicyNumber = s.PolicyNumber
+        JOIN Agent a ON s.AgentID = a.AgentID
+        WHERE p.StartDate >= CURRENT_DATE - INTERVAL '1 year'
+    ),
+    RevenueFromPayments AS (
+        SELECT SUM(py.Amount) AS PaymentRevenue
+        FROM Pays py
+        WHERE py.Date >= CURRENT_DATE - INTERVAL '1 year'
+    ),
+    NetRevenue AS (
+        SELECT ROUND(
+            (SELECT PoliciesRevenue FROM RevenueFromPolicies) + 
+            (SELECT PaymentRevenue FROM RevenueFromPayments), 
+            2
+        ) AS TotalRevenue
+    ),
+    TotalEmployeeSalary AS (
+        SELECT SUM(e.Salary * 12) AS TotalEmployeeSalaries
+        FROM Employee e
+    ),
+    TotalClaimAmount AS (
+        SELECT SUM(CASE WHEN rc.ApprovalStatus = 'Approved' THEN rc.Amount ELSE 0 END) AS TotalClaims
+        FROM RequestClaim rc
+        WHERE rc.DateCreated >= CURRENT_DATE - INTERVAL '1 year'
+    ),
+    NetExpenses AS (
+        SELECT ROUND(
+            (SELECT TotalEmployeeSalaries FROM TotalEmployeeSalary) + 
+            (SELECT TotalClaims FROM TotalClaimAmount), 
+            2
+        ) AS TotalExpenses
+    ),
+    Profit AS (
+        SELECT ROUND(
+            (SELECT TotalRevenue FROM NetRevenue) - 
+            (SELECT TotalExpenses FROM NetExpenses), 
+            2
+        ) AS NetProfit
+    )
+    SELECT 
+        (SELECT TotalRevenue FROM NetRevenue) AS TotalRevenue,
+        (SELECT TotalExpenses FROM NetExpenses) AS TotalExpenses,
+        (SELECT NetProfit FROM Profit) AS NetProfit;
+"""
+
+# Fold in the queued days, then compare every ledger day with a fresh aggregation of the source
+# tables, look for ended days without salaries, and compare company_profits with the raw query.
+# The salary totals only match while salaries are unchanged since the days were accrued.
+def check_finance_ledger(engine):
+    update_finance_ledger(engine)
+    with db_connection(engine) as conn:
+        differing = conn.execute(text(f"""
+            SELECT COALESCE(l.day, s.day) AS day,
+                   l.policy_revenue, s.policy_revenue, l.payment_revenue, s.payment_revenue,
+                   l.approved_claims, s.approved_claims
+            FROM finance_daily_ledger l
+            FULL JOIN ({ledger_days_query(None)}) s ON s.day = l.day
+            WHERE l.policy_revenue IS DISTINCT FROM COALESCE(s.policy_revenue, 0)
+               OR l.payment_revenue IS DISTINCT FROM COALESCE(s.payment_revenue, 0)
+               OR l.approved_claims IS DISTINCT FROM COALESCE(s.approved_claims, 0)
+            ORDER BY 1
+        """)).all()
+        unaccrued = conn.execute(text("""
+            SELECT count(*) FROM generate_series(
+                CAST((SELECT MIN(day) FROM finance_daily_ledger) AS TIMESTAMP),
+                CAST(CURRENT_DATE - 1 AS TIMESTAMP), INTERVAL '1 day'
+            ) ended (day)
+            LEFT JOIN finance_daily_ledger l ON l.day = ended.day::date
+            WHERE l.salaries IS NULL
+        """)).scalar()
+    for row in differing[:20]:
+        print(f"MISMATCH day {row[0]}: ledger {row[1]}, {row[3]}, {row[5]} != source {row[2]}, {row[4]}, {row[6]}")
+    print(f"{len(differing)} ledger days differ from the source tables, {unaccrued} ended days have no salaries")
+    raw = run_query(engine, COMPANY_PROFITS_RAW_QUERY).iloc[0]
+    ledger = company_profits.__wrapped__(engine).iloc[0]
+    mismatched = False
+    for column in ("totalrevenue", "totalexpenses", "netprofit"):
+        same = raw[column] is not None and abs(float(raw[column]) - float(ledger[column])) < 0.005
+        mismatched |= not same
+        print(f"{'ok' if same else 'MISMATCH':<9}{column:<14}raw={raw[column]}  ledger={ledger[column]}")
+    return bool(differing) or bool(unaccrued) or mismatched
+
+# Print each replica's health, lag and latency; true when no replica would be routed to
+def check_replicas():
+    router = get_replica_router()
+    if router is None:
+        print("No read replicas configured (PROCARE_REPLICA_HOSTS)")
+        return True
+    for replica in router.status():
+        state = "usable" if replica["routing"] else "skipped"
+        detail = replica["error"] or f"in_recovery={replica['in recovery']} lag={replica['lag s']}s latency={replica['latency ms']}ms"
+        print(f"{state:<8}{replica['replica']:<32}{detail}")
+    return not router.usable()
+
+# Batch export configuration: worker threads default to the pool size, so every worker gets a connection
+BATCH_CONFIG = {
+    "workers": env_setting("BATCH_WORKERS", POOL_CONFIG["pool_size"], int),
+    "retries": env_setting("BATCH_RETRIES", 2, int),
+    "retry_backoff": env_setting("BATCH_RETRY_BACKOFF", 5.0, float)
+}
+
+BATCH_WRITERS = {
+    "parquet": lambda data, path: data.to_parquet(path, index=False),
+    "csv": lambda data, path: data.to_csv(path, index=False),
+    # Uncompressed and in one chunk, so snapshot mode can map the file's columns without decoding or joining them
+    "arrow": lambda data, path: data.reset_index(drop=True).to_feather(
+        path, compression="uncompressed", chunksize=max(len(data), 1)
+    )
+}
+
+# Everything the dashboard views read: the sidebar reports plus the lookups behind their filters
+def batch_reports():
+    return list(QUERY_OPTIONS.values()) + [healthcare_providers, policy_start_years, finance_ledger, risk_features]
+
+# Dropped connections, serialization failures and deadlocks are worth another attempt;
+# a statement timeout would only time out again
+def retryable(error):
+    if query_timed_out(error):
+        return False
+    original = getattr(error, "orig", error)
+    sqlstate = getattr(original, "sqlstate", None) or getattr(original, "pgcode", None)
+    if sqlstate in ("40001", "40P01") or getattr(error, "connection_invalidated", False):
+        return True
+    return isinstance(error, OperationalError) or (psycopg is not None and isinstance(error, psycopg.OperationalError))
+
+# Run one report with retries and write it next to the manifest; the file is renamed into place
+# only once it is complete
+def export_report(engine, func, output_dir, file_format, retries, backoff):
+    entry = {"attempts": 0}
+    started = time.perf_counter()
+    while True:
+        entry["attempts"] += 1
+        try:
+            data = run_routed(func.__name__, func.__wrapped__, engine, {})
+            break
+        except Exception as error:
+            if entry["attempts"] > retries or not retryable(error):
+                entry.update(status="failed", error=f"{type(error).__name__}: {str(error).splitlines()[0]}",
+                             seconds=round(time.perf_counter() - started, 3))
+                return entry
+            logger.warning("Retrying %s after %s", func.__name__, type(error).__name__)
+            time.sleep(backoff * 2 ** (entry["attempts"] - 1))
+    path = os.path.join(output_dir, f"{func.__name__}.{file_format}")
+    with replaced_atomically(path) as temporary:
+        BATCH_WRITERS[file_format](data, temporary)
+    entry.update(
+        status="ok", rows=len(data), columns=list(data.columns), file=os.path.basename(path),
+        bytes=os.path.getsize(path), seconds=round(time.perf_counter() - started, 3)
+    )
+    return entry
+
+# Export every report concurrently and write manifest.json with each report's status, timing and row count
+def run_batch(engine, output_dir, file_format, workers, retries, backoff, only=None, refresh_views=False):
+    os.makedirs(output_dir, exist_ok=True)
+    ensure_materialized_views(engine)
+    ensure_finance_ledger(engine)
+    update_finance_ledger(engine)
+    ensure_risk_features(engine)
+    update_risk_features(engine)
+    if refresh_views:
+        for view in MATERIALIZED_VIEWS:
+            refresh_materialized_view(engine, view)
+    reports = [func for func in batch_reports() if not only or func.__name__ in only]
+    # More workers than the pool can hand out connections would only queue on the pool
+    workers = max(1, min(workers, POOL_CONFIG["pool_size"] + POOL_CONFIG["max_overflow"]))
+    manifest = {
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "database": f"{DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['dbname']}",
+        "format": file_format,
+        "workers": workers,
+        "reports": {}
+    }
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch") as pool:
+        futures = {
+            pool.submit(export_report, engine, func, output_dir, file_format, retries, backoff): func.__name__
+            for func in reports
+        }
+        for future in as_completed(futures):
+            report = futures[future]
+            entry = manifest["reports"][report] = future.result()
+            detail = f"rows={entry['rows']}" if entry["status"] == "ok" else entry["error"]
+            print(f"{entry['status']:<7}{report:<32}{entry['seconds']:>9.2f}s  attempts={entry['attempts']}  {detail}")
+    manifest["finished_at"] = datetime.now(timezone.utc).isoformat()
+    manifest["seconds"] = round(time.perf_counter() - started, 3)
+    write_atomically(os.path.join(output_dir, "manifest.json"), json.dumps(manifest, indent=2))
+    return [report for report, entry in manifest["reports"].items() if entry["status"] != "ok"]
+
+# Where reports read their data: "live" queries Postgres, "snapshot" reads the files a
+# `batch --versioned` run wrote under snapshot_dir, the newest version unless one is pinned
+DATA_CONFIG = {
+    "source": env_setting("DATA_SOURCE", "live"),
+    "snapshot_dir": env_setting("SNAPSHOT_DIR", "exports"),
+    "snapshot_version": env_setting("SNAPSHOT_VERSION", "")
+}
+
+class SnapshotUnavailable(Exception):
+    pass
+
+# The snapshot version directory to read: the pinned one, or the newest one with a manifest
+def snapshot_path():
+    root = DATA_CONFIG["snapshot_dir"]
+    if DATA_CONFIG["snapshot_version"]:
+        return os.path.join(root, DATA_CONFIG["snapshot_version"])
+    versions = sorted(
+        name for name in os.listdir(root) if os.path.exists(os.path.join(root, name, "manifest.json"))
+    ) if os.path.isdir(root) else []
+    if not versions:
+        raise SnapshotUnavailable(f"No snapshot with a manifest.json under {root}")
+    return os.path.join(root, versions[-1])
+
+# One snapshot version. Arrow files are memory-mapped, so their pages are shared through the OS page
+# cache by every session and worker process, and only the columns a report touches are read from disk.
+# Parquet files are read per call, limited to the requested columns.
+class Snapshot:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "manifest.json")) as manifest_file:
+            self.manifest = json.load(manifest_file)
+        if self.manifest["format"] not in ("arrow", "parquet"):
+            raise SnapshotUnavailable(f"Snapshot {path} is {self.manifest['format']}; snapshot mode reads arrow or parquet")
+        self.lock = threading.Lock()
+        self.tables = {}
+
+    def table(self, report, columns=None):
+        entry = self.manifest["reports"].get(report)
+        if entry is None or entry["status"] != "ok":
+            raise SnapshotUnavailable(f"Snapshot {os.path.basename(self.path)} has no {report} export")
+        path = os.path.join(self.path, entry["file"])
+        if self.manifest["format"] == "parquet":
+            return pa_parquet.read_table(path, columns=columns, memory_map=True)
+        with self.lock:
+            if report not in self.tables:
+                self.tables[report] = pa.ipc.open_file(pa.memory_map(path)).read_all()
+            table = self.tables[report]
+        return table.select(columns) if columns else table
+
+    # Numeric columns without nulls become read-only NumPy views onto the mapped file; text and
+    # categorical columns are converted into pandas objects
+    def frame(self, report, columns=None):
+        table = self.table(report, columns)
+        if self.manifest["format"] == "parquet":
+            return table.to_pandas(split_blocks=True)
+        return pd.DataFrame({
+            name: column.chunk(0).to_numpy(zero_copy_only=True) if mappable(column) else column.to_pandas()
+            for name, column in zip(table.column_names, table.columns)
+        }, copy=False)
+
+def mappable(column):
+    return (
+        column.num_chunks == 1 and column.null_count == 0
+        and (pa.types.is_integer(column.type) or pa.types.is_floating(column.type))
+    )
+
+# Load a snapshot version once per process; a new version replaces the cached results of the old one
+@st.cache_resource
+def get_snapshot(path):
+    get_report_cache().invalidate()
+    return Snapshot(path)
+
+def filter_equal(data, column, value):
+    return data if value is None else data[data[column] == value].reset_index(drop=True)
+
+def snapshot_client_spending_page(snapshot, after=None, page_size=50):
+    data = snapshot.frame("client_spending_by_hcp").sort_values(
+        ["totalspending", "clientid", "healthcareproviderid"], ascending=False
+    )
+    if after is not None:
+        spending, client_id, provider_id = after
+        data = data[
+            (data["totalspending"] < spending)
+            | ((data["totalspending"] == spending) & (
+                (data["clientid"] < client_id)
+                | ((data["clientid"] == client_id) & (data["healthcareproviderid"] < provider_id))
+            ))
+        ]
+    return data.head(page_size).reset_index(drop=True)
+
+def snapshot_client_search(snapshot, term):
+    clients = snapshot.frame("client_spending_by_hcp", ["clientid", "clientfullname"]).drop_duplicates("clientid")
+    if term.isdigit():
+        clients = clients[clients["clientid"] == int(term)]
+    else:
+        clients = clients[clients["clientfullname"].astype(str).str.contains(term, case=False, regex=False)]
+    return clients.sort_values("clientid").head(50).reset_index(drop=True)
+
+def snapshot_revenue_contribution_by_agent(snapshot, year=None, start_date=None, end_date=None):
+    if start_date is not None or end_date is not None:
+        raise SnapshotUnavailable("Policy start date ranges need the live database")
+    return filter_equal(snapshot.frame("revenue_contribution_by_agent"), "year", year)
+
+# Revenue and expenses of the exported ledger days in a range, rounded like the ledger reports
+def ledger_period_totals(ledger, first_day, last_day=None):
+    days = ledger[(ledger["day"] >= first_day) & ((ledger["day"] <= last_day) if last_day is not None else True)]
+    revenue = round(float(days["policy_revenue"].sum() + days["payment_revenue"].sum()), 2)
+    expenses = round(float(days["salaries"].sum() + days["approved_claims"].sum()), 2)
+    return revenue, expenses
+
+def snapshot_company_profits(snapshot, start_date=None, end_date=None):
+    if start_date is None and end_date is None:
+        return snapshot.frame("company_profits")
+    start_date = start_date or default_finance_period()["start_date"]
+    revenue, expenses = ledger_period_totals(snapshot.frame("finance_ledger"), start_date, end_date)
+    return pd.DataFrame([{"totalrevenue": revenue, "totalexpenses": expenses, "netprofit": round(revenue - expenses, 2)}])
+
+def snapshot_finance_period_comparison(snapshot, start_date, end_date):
+    ledger = snapshot.frame("finance_ledger")
+    rows = []
+    for period, first_day, last_day in finance_periods(start_date, end_date):
+        revenue, expenses = ledger_period_totals(ledger, first_day, last_day)
+        rows.append({
+            "period": period, "firstday": first_day, "lastday": last_day,
+            "revenue": revenue, "expenses": expenses, "netprofit": round(revenue - expenses, 2)
+        })
+    return pd.DataFrame(rows)
+
+def snapshot_high_risk_clients(snapshot, **thresholds):
+    return select_risk_clients(risk_feature_arrays(snapshot.frame("risk_features")), **thresholds)
+
+# Reports with parameters, answered from the exported frames; every other report reads its own export
+SNAPSHOT_READERS = {
+    "client_spending_by_hcp": lambda snapshot, client_id=None: filter_equal(
+        snapshot.frame("client_spending_by_hcp"), "clientid", client_id
+    ),
+    "client_spending_page": snapshot_client_spending_page,
+    "client_search": snapshot_client_search,
+    "client_spending_count": lambda snapshot: pd.DataFrame(
+        {"total": [snapshot.table("client_spending_by_hcp", ["clientid"]).num_rows]}
+    ),
+    "insurance_plan_distribution": lambda snapshot, provider_id=None: filter_equal(
+        snapshot.frame("insurance_plan_distribution"), "healthcareproviderid", provider_id
+    ),
+    "revenue_contribution_by_agent": snapshot_revenue_contribution_by_agent,
+    "company_profits": snapshot_company_profits,
+    "finance_period_comparison": snapshot_finance_period_comparison,
+    "high_risk_clients": snapshot_high_risk_clients
+}
+
+def read_snapshot_report(snapshot, report, **params):
+    reader = SNAPSHOT_READERS.get(report)
+    return reader(snapshot, **params) if reader else snapshot.frame(report)
+
+# Function to show which snapshot the dashboard is reading
+def display_snapshot_source():
+    try:
+        snapshot = get_snapshot(snapshot_path())
+    except (SnapshotUnavailable, OSError) as error:
+        st.error(f"Snapshot mode is on but no snapshot can be read: {error}")
+        st.stop()
+    taken = datetime.fromisoformat(snapshot.manifest["finished_at"])
+    st.sidebar.info(
+        f"Snapshot mode: data as of {taken.astimezone():%Y-%m-%d %H:%M:%S} "
+        f"(version {os.path.basename(snapshot.path)})"
+    )
+
+# Command-line entry point; `streamlit run procare.py` passes no command and gets the dashboard
+def cli(argv):
+    parser = argparse.ArgumentParser(prog="procare.py", description="ProCare dashboard maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("migrate", help="create the indexes the reports rely on")
+    check = commands.add_parser("check-plans", help="fail when a report plan sequentially scans a large table")
+    check.add_argument("--min-rows", type=int, default=100000, help="tables with at least this many rows count as large")
+    joins = commands.add_parser("check-joins", help="fail when a report join multiplies its rows")
+    joins.add_argument("--min-rows", type=int, default=100000, help="joins producing fewer rows are not checked")
+    joins.add_argument("--max-fanout", type=float, default=10.0, help="most rows a join may produce per row of its largest input")
+    changes = commands.add_parser("check-changes", help="check the report dependencies and that every change feed table publishes its writes")
+    changes.add_argument("--timeout", type=float, default=10.0, help="seconds to wait for the notifications")
+    commands.add_parser("check-fraud", help="compare the incremental fraud detector with the fraud_claims query")
+    commands.add_parser("check-risk", help="compare the risk feature store with the high_risk_clients query")
+    commands.add_parser("check-ledger", help="reconcile the finance ledger with the source tables and the raw profit query")
+    commands.add_parser("check-replicas", help="health-check the read replicas; fails when none is usable")
+    batch = commands.add_parser("batch", help="export every report to files with a manifest of timings and row counts")
+    batch.add_argument("--output-dir", default="exports")
+    batch.add_argument("--format", choices=sorted(BATCH_WRITERS), default="parquet")
+    batch.add_argument("--workers", type=int, default=BATCH_CONFIG["workers"])
+    batch.add_argument("--retries", type=int, default=BATCH_CONFIG["retries"], help="extra attempts per report")
+    batch.add_argument("--report", action="append", help="only export this report function")
+    batch.add_argument("--refresh-views", action="store_true", help="refresh the materialized views first")
+    batch.add_argument("--versioned", action="store_true", help="write into a new timestamped directory under --output-dir")
+    args = parser.parse_args(argv)
+
+    engine = connect_db()
+    if args.command == "migrate":
+        migrate_indexes(engine)
+        ensure_materialized_views(engine)
+        ensure_finance_ledger(engine)
+        ensure_risk_features(engine)
+        if CDC_CONFIG["enabled"] and engine.dialect.driver == "psycopg":
+            with engine.begin() as conn:
+                ensure_change_notifications(conn, change_feed_tables())
+        return 0
+    if args.command == "check-plans":
+        ensure_materialized_views(engine)
+        ensure_finance_ledger(engine)
+        ensure_risk_features(engine)
+        return 1 if check_plans(engine, args.min_rows) else 0
+    if args.command == "check-joins":
+        ensure_materialized_views(engine)
+        ensure_finance_ledger(engine)
+        ensure_risk_features(engine)
+        return 1 if check_joins(engine, args.min_rows, args.max_fanout) else 0
+    if args.command == "check-changes":
+        ensure_materialized_views(engine)
+        ensure_finance_ledger(engine)
+        ensure_risk_features(engine)
+        return 1 if check_change_feed(engine, args.timeout) else 0
+    if args.command == "check-fraud":
+        return 1 if check_fraud_detector(engine) else 0
+    if args.command == "check-risk":
+        ensure_risk_features(engine)
+        return 1 if check_risk_store(engine) else 0
+    if args.command == "check-ledger":
+        ensure_materialized_views(engine)
+        ensure_finance_ledger(engine)
+        return 1 if check_finance_ledger(engine) else 0
+    if args.command == "check-replicas":
+        return 1 if check_replicas() else 0
+    if args.command == "batch":
+        output_dir = args.output_dir
+        if args.versioned:
+            output_dir = os.path.join(output_dir, datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ"))
+        failed = run_batch(
+            engine, output_dir, args.format, args.workers, args.retries, BATCH_CONFIG["retry_backoff"],
+            args.report, args.refresh_views
+        )
+        return 1 if failed else 0
+
 # Run the app
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(cli(sys.argv[1:]))
     main()
@@ -0,0 +1,39 @@
+import os
+import sys
+
+import pytest
+from sqlalchemy import text
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import procare  # noqa: E402
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers", "db: needs the PostgreSQL database named by the PROCARE_DB_* settings, loaded by generate_data.py"
+    )
+
+
+# The configured database; tests that need it are skipped when it cannot be reached
+@pytest.fixture(scope="session")
+def engine():
+    engine = procare.connect_db()
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+    except Exception as error:
+        pytest.skip(f"database unavailable: {error}")
+    return engine
+
+
+# The configured database with the indexes, materialized views, ledger and feature tables that
+# `python procare.py migrate` creates
+@pytest.fixture(scope="session")
+def migrated(engine):
+    procare.migrate_indexes(engine)
+    procare.ensure_materialized_views(engine)
+    procare.ensure_finance_ledger(engine)
+    procare.ensure_risk_features(engine)
+    return engine
@@ -0,0 +1,51 @@
+import json
+import os
+import threading
+
+import pandas as pd
+import pytest
+
+import procare
+
+
+def test_concurrent_writers_leave_one_whole_file(tmp_path):
+    path = tmp_path / "manifest.json"
+    contents = [json.dumps({"writer": writer}) * 1000 for writer in range(8)]
+    writers = [threading.Thread(target=procare.write_atomically, args=(path, content)) for content in contents]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+    assert path.read_text() in contents
+    assert os.listdir(tmp_path) == ["manifest.json"]
+
+
+def test_a_failed_write_keeps_the_previous_file(tmp_path):
+    path = tmp_path / "report.csv"
+    path.write_text("previous")
+    with pytest.raises(ValueError):
+        with procare.replaced_atomically(path) as temporary:
+            with open(temporary, "w") as temporary_file:
+                temporary_file.write("partial")
+            raise ValueError("writer failed")
+    assert path.read_text() == "previous"
+    assert os.listdir(tmp_path) == ["report.csv"]
+
+
+# Two exports into the same directory each finish with whole files and a readable manifest
+@pytest.mark.db
+def test_concurrent_exports_to_one_directory(migrated, tmp_path):
+    failures = []
+
+    def export():
+        failures.extend(procare.run_batch(migrated, str(tmp_path), "csv", 2, 0, 0, only=["fraud_claims", "company_profits"]))
+
+    exports = [threading.Thread(target=export) for _ in range(2)]
+    for thread in exports:
+        thread.start()
+    for thread in exports:
+        thread.join()
+    assert failures == []
+    assert sorted(os.listdir(tmp_path)) == ["company_profits.csv", "fraud_claims.csv", "manifest.json"]
+    manifest = json.loads((tmp_path / "manifest.json").read_text())
+    assert manifest["reports"]["fraud_claims"]["rows"] == len(pd.read_csv(tmp_path / "fraud_claims.csv"))
@@ -0,0 +1,77 @@
+import pandas as pd
+
+import procare
+
+
+def frame(rows):
+    return pd.DataFrame({"value": range(rows)})
+
+
+# A cache with room for exactly two of the test frames
+def small_cache():
+    return procare.ReportCache(2 * procare.frame_bytes(frame(100)))
+
+
+def test_hits_and_misses_are_counted():
+    cache = small_cache()
+    key = procare.report_cache_key("fraud_claims", {})
+    assert cache.get(key) is None
+    cache.put(key, frame(100), 60)
+    assert cache.get(key).equals(frame(100))
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_expired_entries_are_dropped():
+    cache = small_cache()
+    cache.put(("fraud_claims", ()), frame(100), -1)
+    assert not cache.contains(("fraud_claims", ()))
+    assert cache.get(("fraud_claims", ())) is None
+    stats = cache.stats()
+    assert (stats["expirations"], stats["entries"], stats["bytes"]) == (1, 0, 0)
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = small_cache()
+    cache.put(("a", ()), frame(100), 60)
+    cache.put(("b", ()), frame(100), 60)
+    cache.get(("a", ()))
+    cache.put(("c", ()), frame(100), 60)
+    assert cache.contains(("a", ()))
+    assert not cache.contains(("b", ()))
+    assert cache.contains(("c", ()))
+    assert cache.stats()["evictions"] == 1
+
+
+def test_results_larger_than_the_cache_are_rejected():
+    cache = small_cache()
+    cache.put(("a", ()), frame(1000), 60)
+    assert cache.stats()["entries"] == 0
+    assert cache.stats()["rejections"] == 1
+
+
+# contains() is the prefetcher's check, so it must not count as a lookup or refresh the LRU order
+def test_contains_leaves_counters_and_order_alone():
+    cache = small_cache()
+    cache.put(("a", ()), frame(100), 60)
+    cache.put(("b", ()), frame(100), 60)
+    assert cache.contains(("a", ()))
+    cache.put(("c", ()), frame(100), 60)
+    assert not cache.contains(("a", ()))
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (0, 0)
+
+
+def test_invalidate_drops_every_entry_of_a_report():
+    cache = small_cache()
+    cache.put(procare.report_cache_key("client_spending_by_hcp", {"client_id": 1}), frame(10), 60)
+    cache.put(procare.report_cache_key("client_spending_by_hcp", {"client_id": 2}), frame(10), 60)
+    cache.put(procare.report_cache_key("fraud_claims", {}), frame(10), 60)
+    cache.invalidate("client_spending_by_hcp")
+    assert cache.stats()["entries"] == 1
+    assert cache.stats()["bytes"] == procare.frame_bytes(frame(10))
+    cache.invalidate()
+    assert cache.stats()["entries"] == 0
+
+
+def test_cache_keys_ignore_parameter_order():
+    assert procare.report_cache_key("r", {"a": 1, "b": 2}) == procare.report_cache_key("r", {"b": 2, "a": 1})
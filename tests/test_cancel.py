@@ -0,0 +1,63 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import procare
+
+
+class FakeConnection:
+    def __init__(self):
+        self.cancels = 0
+
+    def cancel(self):
+        self.cancels += 1
+
+
+def test_cancel_reaches_the_attached_connection():
+    cancel, connection = procare.QueryCancel(), FakeConnection()
+    cancel.attach(connection)
+    cancel.cancel()
+    assert connection.cancels == 1
+    cancel.detach()
+    cancel.cancel()
+    assert connection.cancels == 1
+
+
+# A report cancelled between statements does not start the next one
+def test_a_cancelled_report_starts_no_statement():
+    cancel = procare.QueryCancel()
+    cancel.cancel()
+    with pytest.raises(procare.ReportCancelled):
+        cancel.attach(FakeConnection())
+
+
+def sleep_report(engine, seconds):
+    return procare.run_query(engine, f"SELECT pg_sleep({seconds}) AS slept")
+
+
+@pytest.mark.db
+def test_cancelling_stops_the_running_statement(engine):
+    cancel = procare.QueryCancel()
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        started = time.monotonic()
+        future = pool.submit(procare.run_with_cancel, cancel, 60000, "sleep", sleep_report, engine, {"seconds": 30})
+        while cancel.connection is None and time.monotonic() - started < 10:
+            time.sleep(0.05)
+        cancel.cancel()
+        with pytest.raises(Exception) as raised:
+            future.result(timeout=10)
+    assert procare.query_timed_out(raised.value)
+    assert time.monotonic() - started < 10
+    # The connection went back to the pool in a usable state
+    assert procare.run_query(engine, "SELECT 1 AS one")["one"].tolist() == [1]
+
+
+@pytest.mark.db
+def test_report_timeout_limits_the_statement(engine):
+    started = time.monotonic()
+    # On a worker thread, like dashboard reports, since the timeout stays set on the thread that ran it
+    with ThreadPoolExecutor(max_workers=1) as pool, pytest.raises(Exception) as raised:
+        pool.submit(procare.run_with_cancel, procare.QueryCancel(), 200, "sleep", sleep_report, engine, {"seconds": 30}).result()
+    assert procare.query_timed_out(raised.value)
+    assert time.monotonic() - started < 10
@@ -0,0 +1,94 @@
+import threading
+import time
+
+import pandas as pd
+import pytest
+from sqlalchemy import text
+
+import procare
+
+
+def cache_report(report):
+    key = procare.report_cache_key(report, {})
+    procare.get_report_cache().put(key, pd.DataFrame({"value": [1]}), 600)
+    return key
+
+
+def cached(key):
+    return procare.get_report_cache().get(key) is not None
+
+
+def test_changes_invalidate_only_the_reports_reading_the_table():
+    listener = procare.ChangeListener()
+    healthcare, employees = cache_report("healthcare_providers"), cache_report("employee_claim_handling")
+    before = listener.version(["healthcare_providers", "employee_claim_handling"])
+    listener.apply({"healthcareprovider"})
+    assert not cached(healthcare) and cached(employees)
+    assert listener.version(["healthcare_providers", "employee_claim_handling"]) == (before[0] + 1, before[1])
+    assert listener.stats()["invalidations"]["healthcare_providers"] == 1
+    assert "healthcareprovider" in listener.stats()["changed_at"]
+
+
+def test_subscribers_wake_on_their_tables_and_on_reconnects():
+    listener = procare.ChangeListener()
+    ledger, risk = threading.Event(), threading.Event()
+    listener.subscribe(procare.LEDGER_SOURCES, ledger)
+    listener.subscribe(procare.RISK_SOURCES, risk)
+    listener.apply({"pays"})
+    assert ledger.is_set() and not risk.is_set()
+    ledger.clear()
+    listener.apply(None)
+    assert ledger.is_set() and risk.is_set()
+
+
+# Missed changes could have touched anything, so a reconnect drops every cached report
+def test_reconnects_drop_every_cached_report():
+    listener = procare.ChangeListener()
+    keys = [cache_report("healthcare_providers"), cache_report("fraud_claims")]
+    listener.apply(None)
+    assert not any(cached(key) for key in keys)
+    assert listener.stats()["invalidations"].keys() == procare.REPORT_DEPENDENCIES.keys()
+
+
+# Reports over a moving window keep their TTL; the rest are cached until the feed invalidates them
+def test_connected_feed_extends_the_ttl_of_table_reports(monkeypatch):
+    listener = procare.ChangeListener()
+    monkeypatch.setattr(procare, "get_change_listener", lambda: listener)
+    short = procare.report_ttl("healthcare_providers")
+    listener.connected = True
+    assert procare.report_ttl("healthcare_providers") == max(short, procare.CDC_CONFIG["cache_ttl"])
+    assert procare.report_ttl("fraud_claims") == procare.REPORT_TTLS.get(
+        "fraud_claims", procare.CACHE_CONFIG["default_ttl"]
+    )
+
+
+def test_feed_tables_leave_out_materialized_views():
+    tables = procare.change_feed_tables()
+    assert "clock" not in tables and not set(tables) & set(procare.MATERIALIZED_VIEWS)
+    assert {"finance_daily_ledger", "pays", "requestclaim"} <= set(tables)
+
+
+@pytest.mark.db
+def test_report_dependencies_match_the_plans_and_every_table_notifies(migrated):
+    assert not procare.check_change_feed(migrated, 10)
+
+
+@pytest.mark.db
+def test_a_committed_update_invalidates_the_reports_reading_the_table(migrated):
+    listener = procare.ChangeListener()
+    with migrated.begin() as conn:
+        procare.ensure_change_notifications(conn, ["HealthcareProvider"])
+    threading.Thread(target=listener.listen, args=(migrated,), daemon=True).start()
+    deadline = time.monotonic() + 10
+    while not listener.connected and time.monotonic() < deadline:
+        time.sleep(0.05)
+    key = cache_report("healthcare_providers")
+    with migrated.begin() as conn:
+        conn.execute(text(
+            "UPDATE HealthcareProvider SET HealthcareProviderID = HealthcareProviderID "
+            "WHERE HealthcareProviderID = (SELECT MIN(HealthcareProviderID) FROM HealthcareProvider)"
+        ))
+    while cached(key) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not cached(key)
+    assert listener.stats()["notifications"] >= 1
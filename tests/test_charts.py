@@ -0,0 +1,70 @@
+import pandas as pd
+import pytest
+
+import procare
+
+
+def spending(providers, clients, rows):
+    return pd.DataFrame({
+        "provider": [f"provider {i % providers}" for i in range(rows)],
+        "client": [f"client {i % clients}" for i in range(rows)],
+        "amount": [float(i % 97 + 1) for i in range(rows)]
+    })
+
+
+def test_small_frames_are_left_alone():
+    data = spending(5, 3, 15)
+    frame, reduced = procare.reduce_for_chart(data, "provider", "amount", "client")
+    assert not reduced
+    pd.testing.assert_frame_equal(frame, data[["provider", "amount", "client"]])
+
+
+def test_series_and_categories_fold_into_other_keeping_totals():
+    data = spending(120, 400, 12000)
+    frame, reduced = procare.reduce_for_chart(data, "provider", "amount", "client", top_n=10, max_categories=20)
+    assert reduced
+    assert frame["provider"].nunique() == 21
+    assert frame["client"].nunique() == 11
+    assert "Other" in set(frame["provider"]) and "Other" in set(frame["client"])
+    assert frame["amount"].sum() == pytest.approx(data["amount"].sum())
+
+
+def test_largest_values_are_kept():
+    data = pd.DataFrame({"provider": list("abcdef"), "amount": [1.0, 50.0, 2.0, 40.0, 3.0, 30.0]})
+    frame, _ = procare.reduce_for_chart(data, "provider", "amount", max_categories=3)
+    assert dict(zip(frame["provider"], frame["amount"])) == {"b": 50.0, "d": 40.0, "f": 30.0, "Other": 6.0}
+
+
+def test_numeric_x_is_binned():
+    data = pd.DataFrame({"year": range(500), "amount": [1.0] * 500})
+    frame, reduced = procare.reduce_for_chart(data, "year", "amount", max_categories=10)
+    assert reduced
+    assert len(frame) == 10
+    assert frame["amount"].sum() == 500
+
+
+def test_numeric_color_is_averaged_per_bar():
+    data = pd.DataFrame({"client": ["a", "a", "b", "c"], "amount": [1.0, 2.0, 3.0, 4.0], "rate": [10.0, 20.0, 5.0, 0.0]})
+    frame, reduced = procare.reduce_for_chart(data, "client", "amount", "rate", max_categories=2)
+    assert reduced
+    assert dict(zip(frame["client"], frame["rate"])) == {"c": 0.0, "a": 15.0, "Other": 5.0}
+
+
+@pytest.mark.parametrize("max_bars", [50, 200, 1000])
+def test_bar_count_stays_within_max_bars(max_bars):
+    data = pd.DataFrame({
+        "provider": [f"provider {i % 60}" for i in range(30000)],
+        "client": [f"client {i % 1009}" for i in range(30000)],
+        "amount": [float(i % 13 + 1) for i in range(30000)]
+    })
+    frame, _ = procare.reduce_for_chart(data, "provider", "amount", "client", max_bars=max_bars)
+    assert len(frame) <= max_bars
+    assert frame["amount"].sum() == pytest.approx(data["amount"].sum())
+
+
+def test_bar_chart_always_draws_bars(monkeypatch):
+    monkeypatch.setitem(procare.CHART_CONFIG, "max_bars", 100)
+    figure = procare.bar_chart(spending(300, 800, 20000), "provider", "amount", "client", title="Spending")
+    assert {trace.type for trace in figure.data} == {"bar"}
+    assert sum(len(trace.x) for trace in figure.data) <= 100
+    assert figure.layout.title.text.endswith("(largest values shown, the rest grouped as Other)")
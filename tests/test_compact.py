@@ -0,0 +1,49 @@
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+import procare
+
+
+def test_small_integers_are_narrowed_and_large_ones_kept():
+    data = procare.compact_frame(pd.DataFrame({
+        "small": np.array([1, -5, 2 ** 31 - 1], dtype="int64"),
+        "large": np.array([1, 2, 2 ** 31], dtype="int64")
+    }))
+    assert data["small"].dtype == "int32"
+    assert data["large"].dtype == "int64"
+    assert data["small"].tolist() == [1, -5, 2 ** 31 - 1]
+
+
+def test_decimals_become_floats():
+    data = procare.compact_frame(pd.DataFrame({"amount": [Decimal("10.25"), None, Decimal("3")]}, dtype=object))
+    assert data["amount"].dtype == "float64"
+    assert data["amount"].iloc[0] == 10.25
+    assert np.isnan(data["amount"].iloc[1])
+
+
+# Strings repeating across rows become categories; nearly unique ones stay strings
+def test_repeated_strings_become_categories(monkeypatch):
+    monkeypatch.setitem(procare.COMPACT_CONFIG, "category_ratio", 0.5)
+    data = procare.compact_frame(pd.DataFrame({
+        "level": ["Gold", "Silver", "Gold", "Gold", "Silver", "Gold"],
+        "name": ["a", "b", "c", "d", "e", "a"]
+    }, dtype=object))
+    assert isinstance(data["level"].dtype, pd.CategoricalDtype)
+    assert not isinstance(data["name"].dtype, pd.CategoricalDtype)
+    assert data["level"].astype(str).tolist() == ["Gold", "Silver", "Gold", "Gold", "Silver", "Gold"]
+
+
+def test_empty_and_all_null_columns_are_left_alone():
+    empty = procare.compact_frame(pd.DataFrame({"id": pd.Series([], dtype="int64")}))
+    assert empty["id"].dtype == "int64"
+    nulls = procare.compact_frame(pd.DataFrame({"note": [None, None]}, dtype=object))
+    assert nulls["note"].dtype == object
+
+
+# A float64 holds the nearest double to each amount, not the decimal itself
+def test_compacted_amounts_are_not_exact_decimals():
+    data = procare.compact_frame(pd.DataFrame({"amount": [Decimal("0.10")] * 3}, dtype=object))
+    assert data["amount"].sum() != 0.3
+    assert round(data["amount"].sum(), 2) == 0.3
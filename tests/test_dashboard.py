@@ -0,0 +1,61 @@
+import os
+import sys
+
+import pytest
+from streamlit.testing.v1 import AppTest
+
+import procare
+from conftest import ROOT
+
+pytestmark = pytest.mark.db
+
+
+# The dashboard with every view answered by its report queries: no prefetching in the background and
+# no in-memory risk store or fraud detector, so each report run shows up in the Performance panel.
+# The script reads CLI commands from sys.argv, which holds pytest's arguments here.
+@pytest.fixture
+def app(engine, monkeypatch):
+    monkeypatch.setattr(sys, "argv", ["procare.py"])
+    monkeypatch.setenv("PROCARE_PREFETCH_CONNECTIONS", "0")
+    monkeypatch.setenv("PROCARE_RISK_POLL_INTERVAL", "0")
+    monkeypatch.setenv("PROCARE_FRAUD_POLL_INTERVAL", "0")
+    app = AppTest.from_file(os.path.join(ROOT, "procare.py"), default_timeout=120)
+    app.run()
+    return app
+
+
+def report_runs(app):
+    for frame in app.dataframe:
+        if "runs" in frame.value.columns:
+            return dict(zip(frame.value["report"], frame.value["runs"]))
+    return {}
+
+
+@pytest.mark.parametrize("label", list(procare.QUERY_OPTIONS))
+def test_refresh_reruns_every_report_of_the_view(app, label):
+    app.sidebar.selectbox[0].select(label).run()
+    assert not app.exception
+    before = report_runs(app)
+    rendered = [report for report in procare.view_reports(label) if report in before]
+    assert rendered
+
+    next(button for button in app.sidebar.button if button.label == "Refresh data").click().run()
+    assert not app.exception
+    after = report_runs(app)
+    assert {report: after[report] for report in rendered} == {report: before[report] + 1 for report in rendered}
+
+
+def test_cleared_period_asks_for_one(app):
+    app.sidebar.selectbox[0].select("Company Profits").run()
+    app.date_input[0].set_value(()).run()
+    assert not app.exception
+    assert [info.value for info in app.info] == ["Choose a period to compare."]
+
+
+def test_half_picked_range_waits_for_its_end(app):
+    app.sidebar.selectbox[0].select("Revenue Contribution by Agent").run()
+    before = report_runs(app)["revenue_contribution_by_agent"]
+    app.date_input[0].set_value((procare.datetime(2024, 1, 1).date(),)).run()
+    assert not app.exception
+    assert [info.value for info in app.info] == ["Choose the end of the date range."]
+    assert report_runs(app)["revenue_contribution_by_agent"] == before
@@ -0,0 +1,29 @@
+import pandas as pd
+import pyarrow as pa
+
+import procare
+
+DATA = pd.DataFrame({
+    "status": pd.Categorical(["Approved"] * 3 + ["Pending"] * 3 + ["Rejected"] * 3),
+    "amount": [float(row) for row in range(9)]
+})
+
+
+def test_window_sends_only_the_categories_it_uses():
+    table = procare.window_table(DATA, 2, 3)
+    assert table.column("status").to_pylist() == ["Approved", "Pending", "Pending"]
+    assert table.column("status").chunk(0).dictionary.to_pylist() == ["Approved", "Pending"]
+    # The cached result keeps its categories
+    assert list(DATA["status"].cat.categories) == ["Approved", "Pending", "Rejected"]
+
+
+def test_window_keeps_the_row_numbers_of_the_result():
+    assert list(procare.window_table(DATA, 6, 5).to_pandas().index) == [6, 7, 8]
+
+
+def test_stream_size_matches_the_written_stream():
+    table = procare.window_table(DATA, 0, 9)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    assert procare.arrow_stream_bytes(table) == len(sink.getvalue())
@@ -0,0 +1,11 @@
+import pytest
+
+import benchmark
+
+pytestmark = pytest.mark.db
+
+
+# Each rewritten report returns what its original SQL in LEGACY_QUERIES returned
+@pytest.mark.parametrize("report", list(benchmark.LEGACY_QUERIES))
+def test_rewrite_matches_the_original_query(migrated, report):
+    assert benchmark.check_equivalence(migrated, repeat=1, warmup=0, only=[report]) == []
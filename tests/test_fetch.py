@@ -0,0 +1,37 @@
+import pandas as pd
+import pytest
+
+import procare
+
+pytestmark = pytest.mark.db
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    def use(name):
+        monkeypatch.setitem(procare.FETCH_CONFIG, "backend", name)
+
+    return use
+
+
+# COPY streamed through pyarrow returns the same values as fetching rows
+@pytest.mark.parametrize("report", ["client_spending_by_hcp", "employee_claim_handling", "fraud_claims"])
+def test_copy_matches_rows(migrated, backend, report):
+    load = getattr(procare, report).__wrapped__
+    backend("copy")
+    copied = load(migrated)
+    backend("rows")
+    fetched = load(migrated)
+    pd.testing.assert_frame_equal(
+        copied.reset_index(drop=True), fetched.reset_index(drop=True), check_dtype=False, check_categorical=False
+    )
+
+
+# A value that does not parse late in the stream falls back to rows on a still usable connection
+def test_copy_falls_back_to_rows(engine, backend, monkeypatch):
+    backend("copy")
+    monkeypatch.setitem(procare.FETCH_CONFIG, "block_bytes", 1 << 12)
+    query = "SELECT CASE WHEN g < 5000 THEN g::text ELSE 'x' END AS v FROM generate_series(1, 5000) g"
+    data = procare.run_query(engine, query, dtypes={"v": "int64"})
+    assert len(data) == 5000
+    assert data["v"].iloc[-1] == "x"
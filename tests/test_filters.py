@@ -0,0 +1,62 @@
+from datetime import date
+
+import pandas as pd
+import pytest
+
+import procare
+
+YEAR = "EXTRACT(YEAR FROM StartDate) = :year"
+CLIENT = "ClientID = :client_id"
+
+
+def test_unset_filters_add_no_clause():
+    assert procare.apply_filters([(YEAR, "year", None), (CLIENT, "client_id", None)]) == ("", {})
+
+
+def test_set_filters_are_bound_not_inlined():
+    where, params = procare.apply_filters([(YEAR, "year", 2024), (CLIENT, "client_id", "1; DROP TABLE Client")])
+    assert where == f"WHERE {YEAR} AND {CLIENT}"
+    assert params == {"year": 2024, "client_id": "1; DROP TABLE Client"}
+
+
+# The statement text depends on which filters are set, never on their values, so one prepared
+# statement per combination serves every selection
+def test_statement_text_only_depends_on_the_filters_set(monkeypatch):
+    statements = []
+    monkeypatch.setattr(procare, "run_query", lambda engine, query, params, dtypes: statements.append(query))
+    report = procare.revenue_contribution_by_agent.__wrapped__
+    for year in (2021, 2022):
+        report(None, year=year)
+        report(None, year=year, start_date=date(year, 3, 1), end_date=date(year, 6, 30))
+        report(None)
+    assert statements[0] == statements[3]
+    assert statements[1] == statements[4]
+    assert statements[2] == statements[5]
+    assert len(set(statements)) == 3
+
+
+# A filtered report returns exactly the matching rows of the unfiltered one
+@pytest.mark.db
+@pytest.mark.parametrize("report, param, column", [
+    ("client_spending_by_hcp", "client_id", "clientid"),
+    ("insurance_plan_distribution", "provider_id", "healthcareproviderid")
+])
+def test_filters_match_filtering_the_full_report(migrated, report, param, column):
+    load = getattr(procare, report).__wrapped__
+    full = load(migrated)
+    value = int(full[column].iloc[0])
+    expected = full[full[column] == value].sort_values(list(full.columns), ignore_index=True)
+    filtered = load(migrated, **{param: value})
+    pd.testing.assert_frame_equal(
+        filtered.sort_values(list(full.columns), ignore_index=True), expected, check_categorical=False
+    )
+
+
+@pytest.mark.db
+def test_year_filter_matches_the_full_report(migrated):
+    load = procare.revenue_contribution_by_agent.__wrapped__
+    full = load(migrated)
+    year = int(full["year"].iloc[0])
+    expected = full[full["year"] == year].sort_values(["agentid"], ignore_index=True)
+    filtered = load(migrated, year=year).sort_values(["agentid"], ignore_index=True)
+    pd.testing.assert_frame_equal(filtered, expected, check_categorical=False)
@@ -0,0 +1,139 @@
+import json
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+import pandas as pd
+import pytest
+from sqlalchemy import text
+
+import procare
+
+START = datetime(2026, 1, 1)
+
+
+# 11 claims of 10000.01 for client 1, two of them rejected: over both thresholds of FraudWindow(10, 100000)
+def busy_window():
+    window = procare.FraudWindow(10, Decimal(100000))
+    for claim in range(11):
+        window.add(claim + 1, 1, START + timedelta(days=claim), Decimal("10000.01"), 1 if claim < 2 else 0)
+    window.add(100, 2, START, Decimal("500000"), 0)
+    window.names = {1: "Lea Hasbini", 2: "Omar Karam"}
+    return window
+
+
+def test_client_is_flagged_above_both_thresholds():
+    window = busy_window()
+    assert window.flagged == {1}
+    assert window.watermark == 100
+    frame = window.frame()
+    assert list(frame.columns) == ["clientid", "clientname", "totalclaims", "totalamount", "rejectionrate"]
+    row = frame.iloc[0]
+    assert (row["clientid"], row["clientname"], row["totalclaims"]) == (1, "Lea Hasbini", 11)
+    assert row["totalamount"] == pytest.approx(110000.11)
+    assert row["rejectionrate"] == pytest.approx(18.18)
+
+
+def test_expiring_claims_unflags_and_forgets_clients():
+    window = busy_window()
+    # Client 1's first claim and client 2's only claim leave the window; 10 claims are not more than 10
+    assert window.expire(START + timedelta(days=1)) == 2
+    assert window.flagged == set()
+    assert window.totals[1][0] == 10
+    assert 2 not in window.totals
+    assert window.expire(START + timedelta(days=30)) == 10
+    assert window.totals == {}
+    assert window.frame().empty
+
+
+def test_frame_is_rebuilt_only_after_changes():
+    window = busy_window()
+    first = window.frame()
+    assert window.result is not None
+    window.add(200, 1, START + timedelta(days=20), Decimal("1"), 1)
+    assert window.result is None
+    assert window.frame().iloc[0]["totalclaims"] == 12
+    assert first.iloc[0]["totalclaims"] == 11
+
+
+def test_state_round_trips_through_json():
+    window = busy_window()
+    restored = procare.FraudWindow.from_state(json.loads(json.dumps(window.state())), 10, Decimal(100000))
+    assert restored.watermark == window.watermark
+    assert restored.names == window.names
+    assert restored.totals == window.totals
+    pd.testing.assert_frame_equal(restored.frame(), window.frame())
+
+
+def test_detector_checkpoint_is_json_and_resumes(tmp_path):
+    path = tmp_path / "fraud.json"
+    detector = procare.FraudDetector(str(path))
+    detector.window = busy_window()
+    detector.synced_at = datetime(2026, 1, 15, tzinfo=timezone.utc)
+    detector.save_checkpoint()
+    assert json.loads(path.read_text())["window"]["watermark"] == 100
+    assert [entry.name for entry in tmp_path.iterdir()] == ["fraud.json"]
+
+    resumed = procare.FraudDetector(str(path))
+    assert resumed.load_checkpoint()
+    assert resumed.synced_at == detector.synced_at
+    pd.testing.assert_frame_equal(resumed.flagged(), detector.flagged())
+
+
+def test_unreadable_checkpoint_is_ignored(tmp_path):
+    path = tmp_path / "fraud.json"
+    path.write_bytes(b"\x80\x04not json")
+    detector = procare.FraudDetector(str(path))
+    assert not detector.load_checkpoint()
+    assert detector.flagged() is None
+
+
+@pytest.mark.db
+def test_detector_matches_fraud_claims_query(engine):
+    assert not procare.check_fraud_detector(engine)
+
+
+# The Fraud Claims view reads the detector once its window has loaded, so fraud_claims is not prefetched
+def test_fraud_claims_is_prefetched_until_the_detector_loads(monkeypatch):
+    detector = procare.FraudDetector()
+    monkeypatch.setattr(procare, "start_fraud_detector", lambda engine: detector)
+    assert procare.prefetch_reports(None, "Fraud Claims") == [(procare.fraud_claims, {})]
+    detector.window = busy_window()
+    assert procare.prefetch_reports(None, "Fraud Claims") == []
+    monkeypatch.setattr(procare, "start_fraud_detector", lambda engine: None)
+    assert procare.prefetch_reports(None, "Fraud Claims") == [(procare.fraud_claims, {})]
+
+
+def test_notifications_carry_the_operation():
+    assert procare.parse_change("requestclaim:UPDATE") == ("requestclaim", "UPDATE")
+
+
+# New claims only wake the detector; updated or deleted ones also ask it to rebuild the window
+def test_rewritten_claims_ask_for_a_rebuild():
+    listener = procare.ChangeListener()
+    wake, rewrite = threading.Event(), threading.Event()
+    listener.subscribe(["RequestClaim", "Client"], wake, rewrite)
+    listener.apply({"requestclaim"})
+    assert wake.is_set() and not rewrite.is_set()
+    listener.apply({"requestclaim", "client"}, {"client"})
+    assert rewrite.is_set()
+
+
+@pytest.mark.db
+def test_claim_updates_reach_the_detector_as_rewrites(engine):
+    listener = procare.ChangeListener()
+    wake, rewrite = threading.Event(), threading.Event()
+    listener.subscribe(["RequestClaim"], wake, rewrite)
+    with engine.begin() as conn:
+        procare.ensure_change_notifications(conn, ["RequestClaim"])
+    threading.Thread(target=listener.listen, args=(engine,), daemon=True).start()
+    deadline = time.monotonic() + 10
+    while not listener.connected and time.monotonic() < deadline:
+        time.sleep(0.05)
+    rewrite.clear()
+    with engine.begin() as conn:
+        conn.execute(text(
+            "UPDATE RequestClaim SET ApprovalStatus = ApprovalStatus WHERE ClaimID = (SELECT MIN(ClaimID) FROM RequestClaim)"
+        ))
+    assert rewrite.wait(10)
@@ -0,0 +1,76 @@
+from datetime import date, timedelta
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import text
+
+import procare
+
+
+def test_compared_periods_have_the_selected_length():
+    periods = procare.finance_periods(date(2024, 3, 1), date(2024, 3, 31))
+    assert periods == [
+        ("Selected period", date(2024, 3, 1), date(2024, 3, 31)),
+        ("Previous period", date(2024, 1, 30), date(2024, 2, 29)),
+        ("Same period last year", date(2023, 3, 1), date(2023, 3, 31))
+    ]
+
+
+def test_default_period_is_the_last_year():
+    period = procare.default_finance_period()
+    assert period["end_date"] - period["start_date"] in (timedelta(days=365), timedelta(days=366))
+
+
+def ledger_day(conn, day):
+    return conn.execute(text(
+        "SELECT payment_revenue, salaries FROM finance_daily_ledger WHERE day = :day"
+    ), {"day": day}).one()
+
+
+@pytest.mark.db
+def test_ledger_matches_the_source_tables(migrated):
+    assert not procare.check_finance_ledger(migrated)
+
+
+# A payment queues its day, the update folds it in and deleting it takes it back out; the day's
+# accrued salaries are left alone
+@pytest.mark.db
+def test_payments_are_folded_into_their_day(migrated):
+    with migrated.begin() as conn:
+        day, client, payment = conn.execute(text("""
+            SELECT (SELECT MAX(day) FROM finance_daily_ledger WHERE day < CURRENT_DATE),
+                   (SELECT MIN(ClientID) FROM Client), (SELECT MAX(PaymentID) + 1 FROM Pays)
+        """)).one()
+    procare.update_finance_ledger(migrated)
+    with migrated.connect() as conn:
+        revenue, salaries = ledger_day(conn, day)
+    try:
+        with migrated.begin() as conn:
+            conn.execute(text("INSERT INTO Pays VALUES (:payment, :client, 123.45, :day)"),
+                         {"payment": payment, "client": client, "day": day})
+            queued = conn.execute(text("SELECT day FROM finance_ledger_dirty")).scalars().all()
+        assert day in queued
+        assert procare.update_finance_ledger(migrated) >= 1
+        with migrated.connect() as conn:
+            assert ledger_day(conn, day) == (revenue + Decimal("123.45"), salaries)
+    finally:
+        with migrated.begin() as conn:
+            conn.execute(text("DELETE FROM Pays WHERE PaymentID = :payment"), {"payment": payment})
+        procare.update_finance_ledger(migrated)
+    with migrated.connect() as conn:
+        assert ledger_day(conn, day) == (revenue, salaries)
+
+
+# Cached ledger reports are dropped when an update changes the ledger
+@pytest.mark.db
+def test_updates_invalidate_the_ledger_reports(migrated):
+    with migrated.begin() as conn:
+        day = conn.execute(text("SELECT MAX(day) FROM finance_daily_ledger WHERE day < CURRENT_DATE")).scalar()
+    params = {"start_date": day, "end_date": day}
+    procare.company_profits(migrated, **params)
+    key = procare.report_cache_key("company_profits", params)
+    assert procare.get_report_cache().get(key) is not None
+    with migrated.begin() as conn:
+        conn.execute(text("INSERT INTO finance_ledger_dirty VALUES (:day) ON CONFLICT DO NOTHING"), {"day": day})
+    procare.update_finance_ledger(migrated)
+    assert procare.get_report_cache().get(key) is None
@@ -0,0 +1,66 @@
+import os
+import threading
+
+import pandas as pd
+import pytest
+
+import procare
+
+
+def run_threads(target, count):
+    errors = []
+
+    def guarded(index):
+        try:
+            target(index)
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=guarded, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+def test_concurrent_atomic_writes_never_collide(tmp_path):
+    path = tmp_path / "metrics.prom"
+
+    def write(index):
+        for attempt in range(30):
+            procare.write_atomically(str(path), f"writer {index} attempt {attempt}\n" * 100)
+
+    assert run_threads(write, 8) == []
+    assert os.listdir(tmp_path) == ["metrics.prom"]
+    lines = set(path.read_text().splitlines())
+    assert len(lines) == 1 and lines.pop().startswith("writer ")
+
+
+def test_failed_write_leaves_no_temporary_file(tmp_path):
+    with pytest.raises(TypeError):
+        procare.write_atomically(str(tmp_path / "metrics.prom"), object())
+    assert os.listdir(tmp_path) == []
+
+
+def test_writer_flushes_and_never_raises(tmp_path):
+    writer = procare.MetricsFileWriter(str(tmp_path / "metrics.prom"), 60)
+    writer.mark()
+    writer.flush()
+    assert "# TYPE procare_report_runs_total counter" in (tmp_path / "metrics.prom").read_text()
+
+    procare.MetricsFileWriter(str(tmp_path / "missing" / "metrics.prom"), 60).write()
+
+
+def test_reports_run_concurrently_with_the_metrics_file_set(tmp_path, monkeypatch):
+    monkeypatch.setitem(procare.METRICS_CONFIG, "file", str(tmp_path / "metrics.prom"))
+    frame = pd.DataFrame({"clientid": range(10)})
+
+    def report(index):
+        for _ in range(30):
+            data = procare.instrument_report(f"metrics_test_{index}", lambda engine: frame.copy(), None, {})
+            assert len(data) == 10
+
+    assert run_threads(report, 8) == []
+    procare.get_metrics_file_writer().flush()
+    assert 'procare_report_runs_total{report="metrics_test_7"} 30' in (tmp_path / "metrics.prom").read_text()
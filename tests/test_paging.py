@@ -0,0 +1,52 @@
+import pandas as pd
+import pytest
+
+import procare
+
+# Ties on spending and on client, so the cursor has to use every key to order them
+SPENDING = pd.DataFrame({
+    "healthcareproviderid": [1, 2, 3, 1, 2, 1, 3],
+    "healthcareprovidername": ["A", "B", "C", "A", "B", "A", "C"],
+    "clientid": [7, 7, 7, 5, 5, 9, 2],
+    "clientfullname": ["G", "G", "G", "E", "E", "I", "B"],
+    "totalspending": [100.5, 100.5, 20.0, 100.5, 20.0, 3.25, 20.0]
+})
+
+
+class FakeSnapshot:
+    def frame(self, report):
+        return SPENDING
+
+
+# Every page through the keyset cursor the view builds, as the Next button walks them
+def all_pages(fetch, page_size):
+    pages, after = [], None
+    while True:
+        page = fetch(after=after, page_size=page_size)
+        pages.append(page)
+        after = procare.next_spending_cursor(page, page_size)
+        if after is None:
+            return pages
+
+
+@pytest.mark.parametrize("page_size", [1, 2, 3, 7, 10])
+def test_snapshot_pages_cover_every_row_once_in_order(page_size):
+    pages = all_pages(lambda **params: procare.snapshot_client_spending_page(FakeSnapshot(), **params), page_size)
+    rows = pd.concat(pages, ignore_index=True)
+    expected = SPENDING.sort_values(["totalspending", "clientid", "healthcareproviderid"], ascending=False)
+    pd.testing.assert_frame_equal(rows, expected.reset_index(drop=True))
+
+
+def test_a_short_page_is_the_last():
+    assert procare.next_spending_cursor(SPENDING.head(3), 5) is None
+    assert procare.next_spending_cursor(SPENDING.head(5), 5) == (20.0, 5, 2)
+
+
+# Paging the materialized view returns the same rows as reading it in one page
+@pytest.mark.db
+def test_database_pages_match_one_full_page(migrated):
+    total = int(procare.client_spending_count.__wrapped__(migrated)["total"].iloc[0])
+    pages = all_pages(lambda **params: procare.client_spending_page.__wrapped__(migrated, **params), total // 7 + 1)
+    assert len(pages) == 7
+    full = procare.client_spending_page.__wrapped__(migrated, page_size=total)
+    pd.testing.assert_frame_equal(pd.concat(pages, ignore_index=True), full)
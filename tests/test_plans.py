@@ -0,0 +1,33 @@
+import pandas as pd
+import pytest
+
+import procare
+
+pytestmark = pytest.mark.db
+
+
+# Tables of 1000 rows count as large here instead of the command's 100000, so the 10k data set
+# exercises the index checks too
+def test_reports_scan_no_large_table_without_an_index(migrated):
+    assert procare.check_plans(migrated, min_rows=1000) == []
+
+
+def test_allowed_scans_name_tables_the_reports_read():
+    for report, params, allowed in procare.PLAN_CHECKS:
+        assert allowed <= procare.REPORT_DEPENDENCIES[report] | set(procare.MATERIALIZED_VIEWS), report
+
+
+def test_reports_multiply_no_join_rows(migrated):
+    assert procare.check_joins(migrated, min_rows=1000, max_fanout=10) == []
+
+
+# The array of level ids that takes over from the bit mask past COVERAGE_MASK_LEVELS counts the same clients
+def test_coverage_levels_past_the_bit_mask(migrated, monkeypatch):
+    def insights():
+        data = procare.medical_conditions_insights.__wrapped__(migrated)
+        # Services serving as many clients come in either order
+        return data.sort_values(list(data.columns), ignore_index=True)
+
+    masked = insights()
+    monkeypatch.setattr(procare, "COVERAGE_MASK_LEVELS", 0)
+    pd.testing.assert_frame_equal(insights(), masked)
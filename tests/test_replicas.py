@@ -0,0 +1,86 @@
+import pytest
+from sqlalchemy.exc import OperationalError
+
+import procare
+
+
+def replica(name, healthy=True, lag=0.0, latency=0.01):
+    replica = procare.Replica(name, name)
+    replica.healthy, replica.lag_seconds, replica.latency_seconds = healthy, lag, latency
+    return replica
+
+
+def router(replicas, strategy="round_robin"):
+    return procare.ReplicaRouter(replicas, strategy, max_lag_seconds=30)
+
+
+def test_round_robin_takes_turns_among_usable_replicas():
+    routing = router([replica("a"), replica("lagging", lag=31), replica("down", healthy=False), replica("b")])
+    assert [routing.choose().name for _ in range(4)] == ["a", "b", "a", "b"]
+
+
+def test_least_latency_picks_the_fastest_usable_replica():
+    routing = router([replica("slow", latency=0.05), replica("fast", latency=0.01, lag=45)], "least_latency")
+    assert routing.choose().name == "slow"
+
+
+# A replica that never reported its replay lag counts as behind
+def test_without_a_usable_replica_reports_run_on_the_primary():
+    catching_up = replica("catching up", lag=float("inf"))
+    routing = router([catching_up, replica("unchecked", healthy=None)])
+    assert routing.choose() is None
+    assert routing.primary_routed == 1
+
+
+@pytest.fixture
+def routed(monkeypatch):
+    routing = router([replica("replica")])
+    runs = []
+    monkeypatch.setattr(procare, "get_replica_router", lambda: routing)
+    monkeypatch.setattr(routing, "check", lambda checked: runs.append(("check", checked.name)))
+
+    def run(errors):
+        def instrument_report(report, func, engine, params):
+            runs.append(("run", engine))
+            if engine in errors:
+                raise errors[engine]
+            return engine
+
+        monkeypatch.setattr(procare, "instrument_report", instrument_report)
+        return procare.run_routed("fraud_claims", None, "primary", {})
+
+    return routing, runs, run
+
+
+def test_reports_run_on_the_chosen_replica(routed):
+    routing, runs, run = routed
+    assert run({}) == "replica"
+    assert runs == [("run", "replica")]
+
+
+def test_a_dropped_replica_connection_falls_back_to_the_primary(routed):
+    routing, runs, run = routed
+    assert run({"replica": OperationalError("SELECT 1", {}, Exception("server closed the connection"))}) == "primary"
+    assert runs == [("run", "replica"), ("check", "replica"), ("run", "primary")]
+    assert routing.replicas[0].fallbacks == 1
+
+
+def test_report_errors_are_not_retried_on_the_primary(routed):
+    routing, runs, run = routed
+    with pytest.raises(ZeroDivisionError):
+        run({"replica": ZeroDivisionError()})
+    assert runs == [("run", "replica")]
+
+
+# The primary answers the lag query as a server that is not in recovery
+@pytest.mark.db
+def test_health_check_reads_lag_and_marks_unreachable_replicas_down(engine):
+    reachable = procare.Replica("primary", engine)
+    unreachable = procare.Replica("down", procare.create_pooled_engine(
+        dict(procare.DB_CONFIG, host="/nonexistent"), "replica-down", {"connect_timeout": 1}
+    ))
+    routing = router([reachable, unreachable])
+    routing.check_all()
+    assert (reachable.healthy, reachable.in_recovery, reachable.lag_seconds) == (True, False, 0.0)
+    assert unreachable.healthy is False and unreachable.error
+    assert routing.choose() is reachable
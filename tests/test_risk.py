@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import procare
+
+
+def features(**columns):
+    data = {name: [0] * len(columns["clientid"]) for name in procare.RISK_FEATURES}
+    data.update(columns)
+    data.setdefault("clientname", [f"Client {client}" for client in columns["clientid"]])
+    return procare.risk_feature_arrays(pd.DataFrame(data))
+
+
+CLIENTS = features(
+    clientid=[4, 1, 3, 2],
+    icd_codes=[12, 20, 5, 11],
+    dependents=[1, 2, 3, 1],
+    approved_cents=[10_000_000, 5_000_000, 90_000_000, 12_000_000],
+    pending_cents=[500, 6_000_000, 0, 0],
+    rejected_cents=[80_000_000, 0, 0, 0]
+)
+
+
+def test_thresholds_are_exclusive_and_amounts_sum_the_chosen_statuses():
+    selected = procare.select_risk_clients(CLIENTS, 11, 100000, 0, ("Approved", "Pending"))
+    # Client 2's 11 codes are not more than 11; client 3 has too few codes; client 4 has 100005.00
+    assert selected["clientid"].tolist() == [1, 4]
+    assert selected["totalclaimamount"].tolist() == [110000.0, 100005.0]
+    assert selected["medicalrecordcount"].tolist() == [20, 12]
+
+
+def test_rejected_claims_only_count_when_chosen():
+    selected = procare.select_risk_clients(CLIENTS, 0, 100000, 0, ("Rejected",))
+    assert selected["clientid"].tolist() == [4]
+    assert selected["totalclaimamount"].tolist() == [800000.0]
+
+
+# Ties on the sort feature are broken by client id
+def test_sorting_by_a_feature_breaks_ties_by_client():
+    selected = procare.select_risk_clients(CLIENTS, 0, 0, 0, ("Approved",), sort_by="Dependents")
+    assert selected["clientid"].tolist() == [3, 1, 2, 4]
+
+
+def test_snapshot_amounts_are_read_as_cents():
+    data = pd.DataFrame({
+        "clientid": [2, 1], "clientname": ["B", "A"], "icd_codes": [1, 2], "medical_records": [1, 2],
+        "claims": [1, 1], "dependents": [0, 0], "approved_amount": [0.29, 1234.5],
+        "pending_amount": [0.0, 0.0], "rejected_amount": [0.0, 0.0]
+    })
+    arrays = procare.risk_feature_arrays(data)
+    assert arrays["clientid"].tolist() == [1, 2]
+    assert arrays["approved_cents"].tolist() == [123450, 29]
+    assert arrays["approved_cents"].dtype == np.int64
+
+
+def test_merge_updates_existing_clients_and_inserts_new_ones_in_order():
+    changed = features(clientid=[3, 5, 0], icd_codes=[30, 50, 1], approved_cents=[1, 2, 3])
+    merged = procare.merge_risk_features(CLIENTS, changed)
+    assert merged["clientid"].tolist() == [0, 1, 2, 3, 4, 5]
+    assert merged["icd_codes"].tolist() == [1, 20, 11, 30, 12, 50]
+    assert merged["approved_cents"].tolist() == [3, 5_000_000, 12_000_000, 1, 10_000_000, 2]
+    # The store swaps in the merged arrays; the ones filters may still be reading are not touched
+    assert CLIENTS["icd_codes"].tolist() == [20, 11, 5, 12]
+
+
+# The in-memory store selects the same clients as the high_risk_clients query
+@pytest.mark.db
+def test_store_matches_the_high_risk_query(migrated):
+    assert not procare.check_risk_store(migrated)
@@ -0,0 +1,35 @@
+import pandas as pd
+import pytest
+from sqlalchemy import text
+
+import procare
+
+pytestmark = pytest.mark.db
+
+
+# REFRESH ... CONCURRENTLY matches rows on the unique index, so it has to be the spec's natural key
+@pytest.mark.parametrize("view", list(procare.MATERIALIZED_VIEWS))
+def test_views_are_keyed_on_their_spec(migrated, view):
+    with migrated.connect() as conn:
+        key = procare.index_columns(conn, f"{view}_key")
+    assert key == [column.lower() for column in procare.MATERIALIZED_VIEWS[view]["unique_index"]]
+
+
+@pytest.mark.parametrize("view", list(procare.MATERIALIZED_VIEWS))
+def test_views_refresh_concurrently(migrated, view):
+    procare.refresh_materialized_view(migrated, view)
+
+
+def test_top_services_match_the_source_view(migrated):
+    report = procare.top_5_monthly_services.__wrapped__(migrated)
+    with migrated.connect() as conn:
+        source = pd.DataFrame(conn.execute(text("SELECT * FROM top5monthlyservicesummary")).mappings().all())
+    source["totalgenerated"] = source["totalgenerated"].astype(float)
+    columns = list(report.columns)
+    pd.testing.assert_frame_equal(
+        report.sort_values(columns, ignore_index=True),
+        source[columns].sort_values(columns, ignore_index=True),
+        check_dtype=False
+    )
+    periods = report["serviceperiod"].tolist()
+    assert periods == sorted(periods)